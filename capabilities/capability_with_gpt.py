@@ -3,6 +3,7 @@ import os
 import logging
 from datetime import datetime
 from src.agent.io_interface import text_to_text
+from src.agent.base import FALLBACK_RESPONSE
 
 
 
@@ -42,5 +43,9 @@ class SystemstatsCapability(Capability):
 
         logging.debug(response)
 
+        if response is None:
+            logging.error("No system stats description generated")
+            return FALLBACK_RESPONSE
+
         return response
 
@@ -1,55 +1,8 @@
-import os
 import logging
-import openai
 from typing import ClassVar, List
 from src.agent.capability import Capability
-from src.utils import timeit
-from src.system_conf import (
-    get_conf,
-    OPENAI_TTT_MODEL,
-    OPENAI_TTT_TEMPERATURE,
-    OPENAI_TTT_FREQUENCY_PENALTY,
-    OPENAI_TTT_PRESENCE_PENALTY,
-    OPENAI_STT_MODEL,
-    OPENAI_KEY,
-)
+from src.clients.openai import OpenAiClient, get_openai_client
 
-# Assuming timeit.PROFILE is a decorator you have defined elsewhere in your utilities
-# If not, you can replace @timeit.PROFILE with a simple function pass-through decorator
-
-class OpenAiClient:
-    def __init__(self):
-        api_key = os.environ.get(OPENAI_KEY)
-        if api_key is None:
-            raise ValueError("OPENAI_KEY is not set")
-        openai.api_key = api_key
-
-    @timeit.PROFILE
-    def ttt(self, messages_input: list[str]) -> str:
-        msg = [{"role": "system", "content": "\n".join(messages_input)}]
-        logging.debug(f"Sending msg to GPT: {messages_input}")
-
-        try:
-            model = get_conf(OPENAI_TTT_MODEL)
-            temperature = get_conf(OPENAI_TTT_TEMPERATURE)
-            frequency_penalty = get_conf(OPENAI_TTT_FREQUENCY_PENALTY)
-            presence_penalty = get_conf(OPENAI_TTT_PRESENCE_PENALTY)
-
-            completion = openai.ChatCompletion.create(
-                model=model,
-                temperature=temperature,
-                frequency_penalty=frequency_penalty,
-                presence_penalty=presence_penalty,
-                messages=msg,
-            )
-
-            chat_response = completion.choices[0].message.content
-            logging.debug(f"chat_response: {chat_response}")
-        except Exception as e:
-            logging.error(f"Error {e}")
-            chat_response = "Error generating response"
-
-        return chat_response
 
 class PersonalityQuizCapability(Capability):
     user_history: List[str] = []
@@ -87,7 +40,18 @@ class PersonalityQuizCapability(Capability):
             prompt_lines.append(f"Q: {question}")
             prompt_lines.append(f"A: {answer}")
 
-        mbti_prediction = openai_client.ttt(messages_input=prompt_lines)
+        try:
+            mbti_prediction = openai_client.ttt(messages_input="\n".join(prompt_lines))
+
+        except Exception as e:
+            logging.error(f"Error {e}")
+            mbti_prediction = "Error generating response"
+
+        if mbti_prediction is None:
+            # NOTE ttt gives up on a deadline or an api error instead of raising
+            logging.error("No MBTI prediction generated")
+            mbti_prediction = "Error generating response"
+
         return mbti_prediction
 
     def call(self, agent) -> str:
@@ -97,7 +61,7 @@ class PersonalityQuizCapability(Capability):
             response = self.ask_question(agent, question)
             self.user_history.append(response)
 
-        openai_client = OpenAiClient()
+        openai_client = get_openai_client()
         mbti_prediction = self.generate_mbti_prediction(openai_client)
         
         summary = self.summarize_responses()
@@ -1,21 +1,76 @@
 import os
-from collections.abc import Callable
-from pydantic import BaseModel, ConfigDict
+import shutil
+import time
+import threading
+from collections.abc import Callable, Iterator
+from pydantic import BaseModel, ConfigDict, PrivateAttr
 import logging
 from enum import Enum
-from src.agent.memory import BotAgentMemory
-from src.agent.io_interface import text_to_speech_wss, speech_to_text, text_to_text
+from src.agent.memory import BotAgentMemory, UserMemory
+from src.agent.io_interface import (
+    text_to_speech_wss,
+    text_to_speech_wss_stream,
+    speech_to_text,
+    text_to_text,
+    text_to_text_stream,
+)
 from src.agent.capability import Capability
+from src.agent.context import (
+    ContextWindow,
+    PREVIOUS_MESSAGES_INSTRUCTIONS,
+    history_token_budget,
+)
 from src.agent.message import RoleTypes, Message
-from src.utils.db import RedisConnect
+from src.agent.speculation import SpeculativeResponse
+from src.agent.mood import MoodEvolver
+from src.utils.db import get_db_connection, VERSION_FIELD
+from src.utils.write_behind import WriteBehindQueue
+from src.utils.segments import SegmentReader, write_segment
 from src.utils.markdown_loader import prompt_loader
 from src.utils.ip import get_ip_address
+from src.utils.tokens import count_tokens, exact_token_counts
+from src.system_conf import get_config
 
-db_connection = RedisConnect()
+db_connection = get_db_connection()
+
+# NOTE agent saves are persisted off the turn's critical path, flush before reading
+write_behind = WriteBehindQueue(db_connection)
 
 CURR_DIR = os.getcwd()
 PROMPT_TEMPLATE_PATH = f"{CURR_DIR}/src/agent/llm_prompt_strategy_templates/"
 
+# number of most recent messages loaded when resuming an agent
+HISTORY_TAIL_SIZE = 100
+
+# number of most recent messages kept in the db once older ones are archived
+HISTORY_HOT_SIZE = 1000
+
+# archival is attempted every this many saved messages
+HISTORY_ARCHIVE_BATCH = 1000
+
+# tokens of a prompt's template instructions, kept out of the history budget
+PROMPT_TEMPLATE_TOKENS = 400
+
+# tokens kept out of the history budget for the response itself
+RESPONSE_TOKENS = 200
+
+# NOTE spoken when no response was generated (deadline, provider errors), the
+# conversation goes on instead of the turn failing
+FALLBACK_RESPONSE = "Sorry, I lost my train of thought, could you say that again?"
+
+# marks a db whose agents stored before the index existed were added to it
+AGENT_INDEX_BACKFILLED_KEY = "agents_backfilled"
+
+# versioned saves retried (after merging) before giving up on a conflict
+SAVE_MAX_RETRIES = 5
+
+# memory fields stored in the SUMMARIES hash field
+SUMMARY_FIELDS = (
+    "last_interaction_summation",
+    "last_day_summation",
+    "last_week_summation",
+)
+
 
 class AgentNameExistsError(Exception):
     def __init__(self, name: str):
@@ -24,6 +79,26 @@ class AgentNameExistsError(Exception):
         super().__init__(self.message)
 
 
+class AgentDbFields(Enum):
+
+    """
+    Hash fields an agent is persisted under - cold METADATA rarely changes while
+    the memory fields change as the conversation goes on
+    """
+
+    METADATA = "metadata"
+    USER_MEMORY = "user_memory"
+    SUMMARIES = "summaries"
+    MOOD = "mood"
+
+
+class AgentSaveConflictError(Exception):
+    def __init__(self, name: str):
+        self.name = name
+        self.message = f"Agent with name {name} kept being saved concurrently"
+        super().__init__(self.message)
+
+
 class BotMemoryUpdateType(Enum):
     DAILY = "day"
     WEEKLY = "week"
@@ -105,6 +180,33 @@ class BotAgent(BaseModel):
 
     capabilities: list[str]
 
+    _dirty_fields: set[AgentDbFields] = PrivateAttr(default_factory=set)
+
+    # NOTE summaries are updated one by one, a merge keeps the stored ones we did not
+    # change
+    _dirty_summaries: set[str] = PrivateAttr(default_factory=set)
+
+    # version of the stored agent this instance last read or wrote
+    _version: int = PrivateAttr(default=0)
+
+    _lock: threading.RLock = PrivateAttr(default_factory=threading.RLock)
+
+    # NOTE separate from _lock as archival runs inside write-behind flushes
+    _archive_lock: threading.RLock = PrivateAttr(default_factory=threading.RLock)
+
+    # NOTE kept up to date by save_message, prompts never rescan the history
+    _context: ContextWindow = PrivateAttr(default_factory=ContextWindow)
+
+    # memoized system prompt and the metadata it was rendered from
+    _system_prompt: str | None = PrivateAttr(default=None)
+    _system_prompt_metadata: BotMetadata | None = PrivateAttr(default=None)
+
+    _mood_evolver: MoodEvolver | None = PrivateAttr(default=None)
+
+    def model_post_init(self, context, /):
+        self._context.rebuild(self.memory.full_message_history)
+        self._mood_evolver = MoodEvolver(on_mood=self.update_mood)
+
     @property
     def cold_start_prompt(self):
         cold_start_prompt = prompt_loader(
@@ -117,32 +219,40 @@ class BotAgent(BaseModel):
 
     @property
     def curr_message(self):
-        logging.debug(f"FULL MSG HIST: {self.memory.full_message_history}")
-        curr_message = {}
-        for message in reversed(self.memory.full_message_history):
-            if message.role == RoleTypes.USER:
-                curr_message = message.model_dump()
-                break
-        return curr_message.get("content","")
+        return self._context.curr_message
 
     @property
-    def last_10_messages(self):
-        total_messages = len(self.memory.full_message_history)
-        start_index = max(0, total_messages - 20)
-        user_messages_ = [msg.model_dump() for msg in self.memory.full_message_history[start_index:-2] if msg.model_dump().get("role") != "assistant"]
-        user_messages = "\n".join(f"{i + 1}: user: {msg.get('content', 'content')}" for i, msg in enumerate(user_messages_))
-
-        # agent_messages_ = [msg.model_dump() for msg in self.memory.full_message_history[start_index:-1] if msg.model_dump().get("role") != "user"]
-        # agent_messages = "\n".join(f"{i + 1}: You: {msg.get('content', 'content')}" for i, msg in enumerate(agent_messages_))
-
-        if total_messages > 0:
-            messages = user_messages
-            # messages = "User Messages:\n" + user_messages
-            # messages += "\n\nYour Questions:\n" + agent_messages
-            messages += "\n\nProvided above are the previous messages of the user, you must keep these previous messages in context when replying to the user's CURR_MESSAGE and can even reference a previous message."
-        logging.debug("Previous Messages: \n%s" % messages)
+    def previous_messages(self):
+        """
+        As many recent messages as fit the token budget once the rest of the prompt
+        (personality, summaries, mood, current message) is packed
+        """
+        token_budget = history_token_budget(
+            self.personality_dna_prompt,
+            self.summaries_prompt,
+            str(self.metadata.mood_dna),
+            self.curr_message,
+            PREVIOUS_MESSAGES_INSTRUCTIONS,
+            reserved=PROMPT_TEMPLATE_TOKENS,
+        )
+
+        messages = self._context.previous_messages(token_budget)
+
+        logging.debug("Previous Messages (budget %s): \n%s", token_budget, messages)
 
         return messages
+
+    @property
+    def summaries_prompt(self):
+        summaries = {
+            "Last interaction": self.memory.last_interaction_summation,
+            "Last day": self.memory.last_day_summation,
+            "Last week": self.memory.last_week_summation,
+        }
+
+        return "".join(
+            f"{name}:\n{summary}\n\n" for name, summary in summaries.items() if summary
+        )
     
     @property
     def personality_dna_prompt(self):
@@ -156,43 +266,158 @@ class BotAgent(BaseModel):
 
     @property
     def mood_evolver_prompt(self):
-        mood_evolve_prompt = prompt_loader(
-            PROMPT_TEMPLATE_PATH + "ttt_mood_evolver.md",
-            {
+        return self._render_mood_evolver_prompt(self._mood_evolver_prompt_data())
+
+    def _mood_evolver_prompt_data(self) -> dict:
+        """
+        Snapshot of what the mood evolver prompt is rendered from, taken under the lock
+        so messages saved (or moods set) meanwhile never leak into it
+        """
+        with self._lock:
+            return {
                 "personality_dna": self.personality_dna_prompt,
                 "mood_dna": self.metadata.mood_dna,
                 "curr_message": self.curr_message,
-                "previous_messages": self.last_10_messages,
-            },
+                "previous_messages": self.previous_messages,
+            }
+
+    @staticmethod
+    def _render_mood_evolver_prompt(prompt_data: dict) -> str:
+        mood_evolve_prompt = prompt_loader(
+            PROMPT_TEMPLATE_PATH + "ttt_mood_evolver.md",
+            prompt_data,
         )
         logging.debug(f"mood_evolve_prompt: {mood_evolve_prompt}")
 
         return mood_evolve_prompt
 
     @property
-    def response_prompt(self):
-        response_prompt = prompt_loader(
-            PROMPT_TEMPLATE_PATH + "tts_response.md",
-            {
-                "personality_dna": self.personality_dna_prompt,
-                "mood_instructions": self.metadata.mood_dna,
-                "curr_message": self.curr_message,
-                "previous_messages": self.last_10_messages,
-            },
+    def system_prompt(self):
+        """
+        Static part of the response prompt (instructions, personality and mood DNA),
+        byte-identical from one turn to the next so providers can cache it as a
+        prefix - memoized until the metadata changes
+        """
+        with self._lock:
+            if (
+                self._system_prompt is None
+                or self._system_prompt_metadata is not self.metadata
+            ):
+                self._system_prompt = prompt_loader(
+                    PROMPT_TEMPLATE_PATH + "tts_response.md",
+                    {
+                        "personality_dna": self.personality_dna_prompt,
+                        "mood_dna": self.metadata.mood_dna,
+                    },
+                )
+                self._system_prompt_metadata = self.metadata
+
+                logging.debug(f"system_prompt: {self._system_prompt}")
+
+            return self._system_prompt
+
+    @property
+    def response_messages(self) -> list[dict[str, str]]:
+        """
+        Chat messages of the response prompt - the stable system prompt first, then the
+        dynamic parts (summaries, then as many recent messages as fit the token budget)
+        """
+        return self._response_messages()
+
+    def _response_messages(
+        self,
+        pending_message: str | None = None,
+    ) -> list[dict[str, str]]:
+        """
+        pending_message: a user message not saved (yet) answered as the current one
+        """
+        messages = [{"role": RoleTypes.SYSTEM.value, "content": self.system_prompt}]
+
+        summaries = self.summaries_prompt
+
+        if summaries:
+            messages.append(
+                {
+                    "role": RoleTypes.SYSTEM.value,
+                    "content": f"SUMMARIES:\n\n{summaries}",
+                },
+            )
+
+        # NOTE read once, the mood evolver may set the next mood meanwhile
+        with self._lock:
+            current_mood = self.memory.current_mood
+
+        if current_mood:
+            messages.append(
+                {
+                    "role": RoleTypes.SYSTEM.value,
+                    "content": f"CURRENT_MOOD:\n\n{current_mood}",
+                },
+            )
+
+        pending = []
+        if pending_message is not None:
+            pending.append({"role": RoleTypes.USER.value, "content": pending_message})
+
+        token_budget = history_token_budget(
+            *(message["content"] for message in messages + pending),
+            reserved=RESPONSE_TOKENS,
         )
-        logging.debug(f"response_prompt: {response_prompt}")
 
-        return response_prompt
+        messages += self._context.recent_messages(token_budget) + pending
+
+        logging.debug(f"response_messages: {len(messages)} (budget {token_budget})")
+
+        return messages
 
     @property
     def unique_db_key(self):
         return f"agent:{self.user_id}:{self.unique_name}"
 
+    @property
+    def messages_db_key(self):
+        # NOTE kept outside of the agent:* namespace so the append-only list never
+        # shows up when reading agent blobs by their base key
+        return f"messages:{self.user_id}:{self.unique_name}"
+
+    @property
+    def index_db_key(self):
+        return f"agents:{self.user_id}"
+
+    @property
+    def archive_db_key(self):
+        return f"archive:{self.user_id}:{self.unique_name}"
+
+    @property
+    def archive_dir(self):
+        return os.path.join(get_config().archive_dir, self.user_id, self.unique_name)
+
     @classmethod
-    def available_bots(self):
-        base_key = "agent"
-        agents = db_connection.read_many(base_key)
-        agent_names = [agent["unique_name"] for agent in agents]
+    def available_bots(cls):
+        # ip_address = get_ip_address()
+        ip_address = "0.0.0.0"
+
+        index_key = f"agents:{ip_address}"
+
+        write_behind.flush()
+
+        backfilled_key = f"{AGENT_INDEX_BACKFILLED_KEY}:{ip_address}"
+
+        if not db_connection.exists(backfilled_key):
+            # NOTE once per db, agents stored before the index existed are added to
+            # it - names are parsed from the keys so no agent blob is downloaded
+            indexed = set(db_connection.read_index(index_key))
+
+            bot_keys = db_connection.scan_keys(f"agent:{ip_address}:*")
+
+            for name in sorted(key.split(":", 2)[2] for key in bot_keys):
+                if name not in indexed:
+                    db_connection.add_to_index(index_key, name)
+
+            db_connection.write(backfilled_key, time.time())
+
+        agent_names = db_connection.read_index(index_key)
+
         logging.debug(f"Found ({len(agent_names)}) Agent(s) named: {agent_names}")
         return agent_names
 
@@ -209,6 +434,8 @@ class BotAgent(BaseModel):
         ip_address = "0.0.0.0"
         logging.debug(f"IP Address: {ip_address}")
 
+        write_behind.flush()
+
         if db_connection.exists(f"agent:{ip_address}:{name}"):
             logging.warning(f"Agent with name {name} already exists")
 
@@ -229,30 +456,82 @@ class BotAgent(BaseModel):
                 capabilities=capabilities,
             )
 
-            agent.save()
+            agent.save(full=True)
+
+            db_connection.add_to_index(agent.index_db_key, name, score=time.time())
 
             return agent
 
     @classmethod
-    def find_agent(cls, name: str):
+    def find_agent(cls, name: str, history_tail: int = HISTORY_TAIL_SIZE):
+        """
+        Load an agent with only the last history_tail messages of its history, older
+        messages are paged in on demand with load_older_messages
+        """
         # ip_address = get_ip_address()
         ip_address = "0.0.0.0"
         logging.debug(f"IP Address: {ip_address}")
 
         bot_key = f"agent:{ip_address}:{name}"
 
-        if not db_connection.exists(bot_key):
+        write_behind.flush()
+
+        bot_type = db_connection.key_type(bot_key)
+
+        if bot_type == "none":
             logging.error(f"Agent named {name} does not exist")
 
             return None
 
-        bot = db_connection.read(bot_key)
+        legacy_history = None
+
+        if bot_type == "string":
+            # NOTE agents saved before the hot/cold split are a single blob
+            bot = db_connection.read(bot_key)
+
+            legacy_history = bot["memory"].get("full_message_history")
+
+            fields = {
+                AgentDbFields.METADATA.value: bot,
+                AgentDbFields.USER_MEMORY.value: bot["memory"]["user_memory"],
+                AgentDbFields.SUMMARIES.value: bot["memory"],
+            }
+
+        else:
+            fields = db_connection.read_fields(bot_key)
+
+        bot = fields[AgentDbFields.METADATA.value]
 
         metadata = BotMetadata.load_meta(bot["metadata"])
 
-        memory = BotAgentMemory.load_memory(bot["memory"])
+        messages_key = f"messages:{ip_address}:{name}"
+        archive_key = f"archive:{ip_address}:{name}"
 
-        return cls(
+        # NOTE read together, an archival in between would count the archived
+        # messages in both tiers (or in none)
+        tails = db_connection.read_tails({messages_key: history_tail, archive_key: 1})
+
+        stored_length, history = tails[messages_key]
+
+        archived_count = cls._archived_count(tails[archive_key][1])
+
+        history_length = archived_count + stored_length
+
+        if stored_length == 0 and legacy_history:
+            history_length = len(legacy_history)
+            history = legacy_history[-history_tail:]
+
+        memory = BotAgentMemory.load_memory(
+            {
+                **fields[AgentDbFields.SUMMARIES.value],
+                **fields.get(AgentDbFields.MOOD.value, {}),
+                "user_memory": fields[AgentDbFields.USER_MEMORY.value],
+            },
+            full_message_history=history,
+            history_offset=history_length - len(history),
+        )
+
+        agent = cls(
             unique_name=bot["unique_name"],
             user_id=bot["user_id"],
             metadata=metadata,
@@ -260,35 +539,436 @@ class BotAgent(BaseModel):
             capabilities=bot["capabilities"],
         )
 
-    def save(self):
-        save_obj = self.model_dump(exclude=["model_config"])
-        db_connection.write(self.unique_db_key, save_obj)
+        agent._version = fields.get(VERSION_FIELD, 0)
+
+        if bot_type == "string":
+            agent._migrate_legacy_blob(legacy_history)
+
+        return agent
+
+    def _migrate_legacy_blob(self, legacy_history: list[dict] | None):
+        """
+        Agents saved before the append-only message log and the hot/cold split are
+        one blob embedding their full history - move the history to the message list
+        once and re-save the agent as separate fields
+            - the blob is swapped for the fields in one atomic step, a failure leaves
+              the blob as is and another process migrating it too is a no-op
+        """
+        logging.info(f"migrating legacy agent blob of {self.unique_name}")
+
+        migrated = db_connection.replace_with_fields(
+            self.unique_db_key,
+            {field.value: self._dump_field(field) for field in AgentDbFields},
+            self.messages_db_key,
+            legacy_history or [],
+        )
+
+        if not migrated:
+            logging.info(f"legacy agent blob of {self.unique_name} already migrated")
+
+        if self.unique_name not in db_connection.read_index(self.index_db_key):
+            db_connection.add_to_index(self.index_db_key, self.unique_name)
+
+    def mark_dirty(self, *fields: AgentDbFields):
+        with self._lock:
+            self._dirty_fields.update(fields)
+
+            # NOTE metadata changed in place, the system prompt is rendered again
+            if AgentDbFields.METADATA in fields:
+                self._system_prompt = None
+
+    def save(self, full: bool = False):
+        """
+        Save the fields of the agent marked dirty (or all of them when full), each
+        field is its own hash field so an update never re-serializes the rest of the
+        agent - messages are appended one by one to their own list by save_message
+        """
+        if full:
+            with self._lock:
+                self._dirty_summaries.update(SUMMARY_FIELDS)
+
+            self.mark_dirty(*AgentDbFields)
+
+        if len(self._dirty_fields) == 0:
+            return
+
+        write_behind.call(self.unique_db_key, self._flush_save)
+
+    def _flush_save(self):
+        # NOTE a conflict still unresolved after the retries is not raised to the
+        # write-behind queue (which would re-queue it on every flush), the fields stay
+        # dirty for the next save
+        try:
+            self._save_dirty_fields()
+
+        except AgentSaveConflictError as e:
+            logging.error(f"{e.message}, giving up until the next save")
+
+    def _save_dirty_fields(self):
+        """
+        Versioned write of the dirty fields, when another thread or process saved the
+        agent since it was loaded the stored fields are merged in and the write retried
+        """
+        with self._lock:
+            dirty_fields, self._dirty_fields = self._dirty_fields, set()
+            dirty_summaries, self._dirty_summaries = self._dirty_summaries, set()
+
+        for _ in range(SAVE_MAX_RETRIES):
+            version = db_connection.compare_and_set_fields(
+                self.unique_db_key,
+                {field.value: self._dump_field(field) for field in dirty_fields},
+                version=self._version,
+            )
+
+            if version is not None:
+                self._version = version
+                return
+
+            logging.warning(f"agent {self.unique_name} saved concurrently, merging")
+
+            self._merge_stored_fields(dirty_fields, dirty_summaries)
+
+        # NOTE kept dirty so the next save retries
+        with self._lock:
+            self._dirty_summaries.update(dirty_summaries)
+
+        self.mark_dirty(*dirty_fields)
+
+        raise AgentSaveConflictError(name=self.unique_name)
+
+    def _merge_stored_fields(
+        self,
+        dirty_fields: set[AgentDbFields],
+        dirty_summaries: set[str],
+    ):
+        """
+        Fields we did not change are refreshed from the db, the ones we changed win
+        except for append-only parts (user memory relevant messages) which are merged
+        and summaries, of which only the ones we changed win
+        """
+        fields = db_connection.read_fields(self.unique_db_key)
+
+        self._version = fields.get(VERSION_FIELD, 0)
+
+        for field in AgentDbFields:
+            if field.value not in fields:
+                continue
+
+            stored = fields[field.value]
+
+            match field:
+                case AgentDbFields.METADATA if field not in dirty_fields:
+                    self.metadata = BotMetadata.load_meta(stored["metadata"])
+                    self.capabilities = stored["capabilities"]
+
+                case AgentDbFields.USER_MEMORY:
+                    stored_user_memory = UserMemory.load_user_memory(stored)
+
+                    if field in dirty_fields:
+                        self.memory.user_memory.merge_stored(stored_user_memory)
+
+                    else:
+                        self.memory.user_memory = stored_user_memory
+
+                case AgentDbFields.SUMMARIES:
+                    for summary_name in SUMMARY_FIELDS:
+                        if (
+                            field not in dirty_fields
+                            or summary_name not in dirty_summaries
+                        ):
+                            setattr(self.memory, summary_name, stored[summary_name])
+
+                case AgentDbFields.MOOD if field not in dirty_fields:
+                    with self._lock:
+                        self.memory.current_mood = stored["current_mood"]
+
+    def _dump_field(self, field: AgentDbFields) -> dict:
+        match field:
+            case AgentDbFields.METADATA:
+                return self.model_dump(
+                    include={"unique_name", "user_id", "metadata", "capabilities"},
+                )
+
+            case AgentDbFields.USER_MEMORY:
+                return self.memory.user_memory.model_dump()
+
+            case AgentDbFields.SUMMARIES:
+                return self.memory.model_dump(include=set(SUMMARY_FIELDS))
+
+            case AgentDbFields.MOOD:
+                return self.memory.model_dump(include={"current_mood"})
+
+            case _:
+                raise ValueError(f"Invalid agent db field: {field}")
+
+    def update_summaries(self, **summaries: str):
+        with self._lock:
+            for summary_name, summary in summaries.items():
+                setattr(self.memory, summary_name, summary)
+
+            self._dirty_summaries.update(summaries)
+
+        self.mark_dirty(AgentDbFields.SUMMARIES)
+
+        self.save()
+
+    def update_mood(self, mood: str):
+        with self._lock:
+            self.memory.current_mood = mood
+
+        self.mark_dirty(AgentDbFields.MOOD)
+
+        self.save()
+
+    def evolve_mood(self):
+        """
+        Evolve the mood from the current message in the background, the response of
+        the next turn is prompted with it (see agent/mood.py)
+            - the prompt inputs are snapshot now, only the rendering runs in the
+              background, so the messages it covers never depend on thread timing
+        """
+        prompt_data = self._mood_evolver_prompt_data()
+
+        self._mood_evolver.evolve(
+            lambda: self._render_mood_evolver_prompt(prompt_data),
+        )
 
     def save_message(self, message: str, role: RoleTypes):
         logging.debug(f"saving message '{message}' with role '{role.value}'")
 
-        self.memory.full_message_history.append(
-            Message(content=message, role=role.value),
+        message = Message(
+            content=message,
+            role=role.value,
+            tokens=count_tokens(message) if exact_token_counts() else None,
         )
-        self.save()
 
-        logging.debug("saved message")
+        # NOTE messages are append-only (RPUSH) so concurrent saves never drop one,
+        # the lock keeps the local history in the same order as the stored one
+        with self._lock:
+            self.memory.full_message_history.append(message)
+            self._context.push(message)
+
+            write_behind.append(self.messages_db_key, message.model_dump())
+
+            if self.message_count % HISTORY_ARCHIVE_BATCH == 0:
+                write_behind.call(self.archive_db_key, self.archive_history)
+
+        logging.debug(
+            f"queued message - write-behind depth: {write_behind.queue_depth}",
+        )
+
+    @property
+    def message_count(self):
+        """
+        Total number of messages in the history, loaded or not
+        """
+        return self.memory.history_offset + len(self.memory.full_message_history)
+
+    def load_older_messages(self, count: int) -> list[Message]:
+        """
+        Page in (up to) count messages older than the loaded ones, they are prepended
+        to full_message_history and returned
+        """
+        end = self.memory.history_offset
+
+        start = max(0, end - count)
+
+        if end == 0:
+            return []
+
+        write_behind.flush()
+
+        with self._archive_lock:
+            segments = db_connection.read_range(self.archive_db_key)
+
+            archived_count = self._archived_count(segments)
+
+            older_messages = self._read_archived(
+                segments,
+                start,
+                min(end, archived_count),
+            )
+
+            if end > archived_count:
+                older_messages += db_connection.read_range(
+                    self.messages_db_key,
+                    max(start, archived_count) - archived_count,
+                    end - archived_count - 1,
+                )
+
+        older_messages = [Message(**message) for message in older_messages]
+
+        with self._lock:
+            self.memory.full_message_history[:0] = older_messages
+            self.memory.history_offset = start
+
+            # NOTE only changes when fewer messages than the window were loaded
+            self._context.rebuild(self.memory.full_message_history)
+
+        logging.debug(f"paged in {len(older_messages)} older message(s)")
+
+        return older_messages
+
+    def archive_history(self, keep: int = HISTORY_HOT_SIZE) -> int:
+        """
+        Move the messages older than the last keep ones out of the db into a new
+        append-only segment file, the db only keeps the hot tail and the index of the
+        segments - returns the number of archived messages
+        """
+        write_behind.flush()
+
+        with self._archive_lock:
+            count = db_connection.length(self.messages_db_key) - keep
+
+            if count <= 0:
+                return 0
+
+            segments = db_connection.read_range(self.archive_db_key)
+
+            start = self._archived_count(segments)
+
+            file_name = f"{start:012d}.seg"
+
+            write_segment(
+                os.path.join(self.archive_dir, file_name),
+                db_connection.read_range(self.messages_db_key, 0, count - 1),
+            )
+
+            # NOTE indexed and trimmed atomically, readers never see the messages in
+            # both tiers (or in none) and a crash before it keeps them in the db
+            db_connection.append_and_trim(
+                self.archive_db_key,
+                {"file": file_name, "start": start, "count": count},
+                self.messages_db_key,
+                count,
+                -1,
+            )
+
+        logging.info(
+            f"archived {count} message(s) of {self.unique_name} to {file_name}",
+        )
+
+        return count
+
+    def search_archived_messages(self, text: str) -> list[Message]:
+        """
+        Archived messages containing text, segments are scanned through mmap so the
+        archive is never loaded whole
+        """
+        with self._archive_lock:
+            segments = db_connection.read_range(self.archive_db_key)
+
+            messages = []
+            for segment in segments:
+                path = os.path.join(self.archive_dir, segment["file"])
+
+                with SegmentReader(path) as reader:
+                    messages += reader.search(text)
+
+        return [Message(**message) for message in messages]
+
+    def _read_archived(self, segments: list[dict], start: int, end: int) -> list[dict]:
+        """
+        Archived messages from start (inclusive) to end (exclusive)
+        """
+        messages = []
+        for segment in segments:
+            segment_start = segment["start"]
+            segment_end = segment_start + segment["count"]
+
+            if segment_end <= start or segment_start >= end:
+                continue
+
+            # NOTE indexes relative to the segment
+            first = max(start, segment_start) - segment_start
+            last = min(end, segment_end) - segment_start
+
+            path = os.path.join(self.archive_dir, segment["file"])
+
+            with SegmentReader(path) as reader:
+                messages += reader[first:last]
+
+        return messages
+
+    @staticmethod
+    def _archived_count(segments: list[dict]) -> int:
+        if len(segments) == 0:
+            return 0
+
+        return segments[-1]["start"] + segments[-1]["count"]
+
+    def delete(self):
+        logging.info(f"Deleting agent with name {self.unique_name}")
+
+        write_behind.discard(self.unique_db_key)
+
+        db_connection.delete(self.unique_db_key)
+
+        db_connection.remove_from_index(self.index_db_key, self.unique_name)
+
+        self.clear_message_history()
+
+    def clear_message_history(self):
+        # NOTE cancelled outside of the lock, an evolution finishing meanwhile takes
+        # the lock to set its mood
+        self._mood_evolver.cancel()
+
+        with self._lock:
+            self.memory.full_message_history = []
+            self.memory.history_offset = 0
+            self._context.clear()
+
+        write_behind.discard(self.messages_db_key)
+        write_behind.discard(self.archive_db_key)
+
+        with self._archive_lock:
+            if db_connection.exists(self.messages_db_key):
+                db_connection.delete(self.messages_db_key)
+
+            if db_connection.exists(self.archive_db_key):
+                db_connection.delete(self.archive_db_key)
+
+            shutil.rmtree(self.archive_dir, ignore_errors=True)
 
     def memory_update(self, update_type: BotMemoryUpdateType):
         # TODO
         logging.error(f"updating memory with ({update_type.value}) update type")
 
-    def listen(self):
-        return speech_to_text()
+    def listen(self, on_interim: Callable[[str], None] | None = None):
+        return speech_to_text(on_interim=on_interim)
 
     def speak(self, response: str):
         text_to_speech_wss(text=response, voice_id=self.metadata.voice_api_id)
 
+    def speak_stream(self, response: Iterator[str]) -> str:
+        """
+        Speak a response while it is generated, returns the full response
+        """
+        return text_to_speech_wss_stream(
+            text_iterator=response,
+            voice_id=self.metadata.voice_api_id,
+        )
+
+    def speculative_response(self, msgs: str) -> str | None:
+        """
+        Response to msgs generated before it is saved, as if it was the current
+        message (see agent/speculation.py) - None when msgs would call a capability
+        or no response was generated, the turn then generates it as usual
+        """
+        if Capability.match_capability(msgs) is not None:
+            return None
+
+        return text_to_text(
+            messages_input=self._response_messages(pending_message=msgs),
+        )
+
     def manage_context(
         self,
         msgs: str,
         cold_start: bool = False,
-    ) -> str | Callable | None:
+        stream: bool = False,
+        speculation: SpeculativeResponse | None = None,
+    ) -> str | Iterator[str] | Callable | None:
         """
         Manage the context of the conversation
             - handles cold start
@@ -296,13 +976,17 @@ class BotAgent(BaseModel):
             - detect wake word # TODO
             - match capability
             - evolve current mood
-            - generate response
+            - generate response (an iterator of its tokens when stream), unless
+              the speculative one matches
         """
         logging.debug(f"managing context: {msgs}")
 
         capability = Capability.match_capability(msgs)
 
         if capability is not None:
+            if speculation is not None:
+                speculation.cancel()
+
             assert isinstance(
                 capability,
                 Capability,
@@ -314,19 +998,29 @@ class BotAgent(BaseModel):
             response_prompt = self.cold_start_prompt
 
         else:
-            # TODO make it asynchronous and fix its templating prompt
-            # mood_evolver_strat = text_to_text(messages_input=self.mood_evolver_prompt)
+            response = None
+            if speculation is not None:
+                response = speculation.commit(msgs)
+
+            # NOTE prompted with the mood evolved on the previous turn, the next one
+            # is evolved while this response is generated
+            if response is None:
+                response_prompt = self.response_messages
+
+            self.evolve_mood()
+
+            if response is not None:
+                return response
 
-            # logging.debug(f"mood evolving strategy (post TTT): {mood_evolver_strat}")
+        # NOTE the cold start greeting only depends on the personality, reused as is
+        if stream is True:
+            return text_to_text_stream(messages_input=response_prompt, cache=cold_start)
 
-            # self.save_message(message=mood_evolver_strat, role=RoleTypes.SYSTEM)
-            
-            # TODO ensure no race conditions can occur between save and read
-            # - may need to have async await saves
-            response_prompt = self.response_prompt
+        response = text_to_text(messages_input=response_prompt, cache=cold_start)
 
-        response = text_to_text(messages_input=response_prompt)
+        if not response:
+            logging.error("no response generated, falling back")
 
-        assert isinstance(response, str), f"Invalid response type: {type(response)}"
+            return FALLBACK_RESPONSE
 
         return response
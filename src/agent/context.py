@@ -0,0 +1,225 @@
+import bisect
+import logging
+import threading
+from src.agent.message import RoleTypes, Message
+from src.system_conf import get_config
+from src.utils.tokens import count_tokens, truncate_tokens
+
+# max number of most recent messages the previous messages are picked from
+CONTEXT_WINDOW_SIZE = 100
+
+# most recent messages left out of the previous messages (the current turn)
+CONTEXT_WINDOW_SKIP_LAST = 2
+
+# tokens of the numbering / role prefix of a rendered line
+LINE_TOKEN_OVERHEAD = 4
+
+# tokens a chat message costs on top of its content (role, separators)
+CHAT_MESSAGE_TOKEN_OVERHEAD = 4
+
+# NOTE the current message is never dropped from the recent messages, at worst it is
+# truncated to the budget left (and at least this many tokens)
+LAST_MESSAGE_MIN_TOKENS = 32
+
+PREVIOUS_MESSAGES_INSTRUCTIONS = (
+    "\n\nProvided above are the previous messages of the user, you must keep these "
+    "previous messages in context when replying to the user's CURR_MESSAGE and can "
+    "even reference a previous message."
+)
+
+
+class ContextWindow:
+
+    """
+    Recent conversation context kept up to date as messages are saved, so building a
+    prompt never rescans (nor serializes, nor re-tokenizes) the message history
+        - the most recent messages, pre-rendered as prompt lines and as chat messages
+        - prefix sums of their token counts, packing the most recent ones that fit a
+          token budget is a binary search
+        - the current (most recent) user message
+        - previous messages rendered once per new message and budget, shared by
+          every prompt of the turn
+    """
+
+    def __init__(
+        self,
+        size: int = CONTEXT_WINDOW_SIZE,
+        skip_last: int = CONTEXT_WINDOW_SKIP_LAST,
+    ):
+        self.size = size
+        self.skip_last = skip_last
+
+        # (role, pre-rendered line) of the most recent messages
+        self._lines: list[tuple[RoleTypes, str]] = []
+        # tokens of the lines before each line (and after the last one)
+        self._token_sums: list[int] = [0]
+        # same as above for the messages as chat messages
+        self._chat_messages: list[dict[str, str]] = []
+        self._chat_token_sums: list[int] = [0]
+        self._curr_message = ""
+        self._previous_messages: dict[int, str] = {}
+        self._recent_messages: dict[int, list[dict[str, str]]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def curr_message(self) -> str:
+        return self._curr_message
+
+    def previous_messages(self, token_budget: int | None = None) -> str:
+        """
+        The most recent previous messages fitting token_budget (the context token
+        budget by default), rendered
+        """
+        if token_budget is None:
+            token_budget = get_config().context_token_budget
+
+        with self._lock:
+            if token_budget not in self._previous_messages:
+                self._previous_messages[token_budget] = self._render_previous_messages(
+                    token_budget,
+                )
+
+            return self._previous_messages[token_budget]
+
+    def recent_messages(
+        self,
+        token_budget: int | None = None,
+    ) -> list[dict[str, str]]:
+        """
+        The most recent messages (current one included) fitting token_budget (the
+        context token budget by default), as chat messages - the last one is
+        truncated when it does not fit on its own
+        """
+        if token_budget is None:
+            token_budget = get_config().context_token_budget
+
+        with self._lock:
+            if token_budget not in self._recent_messages:
+                start = bisect.bisect_left(
+                    self._chat_token_sums,
+                    self._chat_token_sums[-1] - max(0, token_budget),
+                    lo=max(0, len(self._chat_messages) - self.size),
+                    hi=len(self._chat_messages),
+                )
+
+                recent_messages = self._chat_messages[start:]
+
+                if len(recent_messages) == 0 and len(self._chat_messages) > 0:
+                    recent_messages = [
+                        self._truncated(self._chat_messages[-1], token_budget),
+                    ]
+
+                self._recent_messages[token_budget] = recent_messages
+
+            return list(self._recent_messages[token_budget])
+
+    def push(self, message: Message):
+        with self._lock:
+            self._push(message)
+
+    def rebuild(self, messages: list[Message]):
+        """
+        Reset the window to the end of messages, e.g. once a history is loaded
+        """
+        with self._lock:
+            self._lines = []
+            self._token_sums = [0]
+            self._chat_messages = []
+            self._chat_token_sums = [0]
+            self._curr_message = ""
+            self._previous_messages = {}
+            self._recent_messages = {}
+
+            # NOTE the current user message can be older than the window
+            for message in reversed(messages):
+                if message.role == RoleTypes.USER:
+                    self._curr_message = message.content
+                    break
+
+            for message in messages[-self.size :]:
+                self._push(message, curr_message=False)
+
+    def clear(self):
+        self.rebuild([])
+
+    def _push(self, message: Message, curr_message: bool = True):
+        # NOTE only the user's side of the conversation is rendered
+        tokens = 0
+        if message.role != RoleTypes.ASSISTANT:
+            tokens = message.token_count + LINE_TOKEN_OVERHEAD
+
+        self._lines.append((message.role, f"user: {message.content}"))
+        self._token_sums.append(self._token_sums[-1] + tokens)
+
+        self._chat_messages.append(
+            {"role": message.role.value, "content": message.content},
+        )
+        self._chat_token_sums.append(
+            self._chat_token_sums[-1]
+            + message.token_count
+            + CHAT_MESSAGE_TOKEN_OVERHEAD,
+        )
+
+        self._previous_messages = {}
+        self._recent_messages = {}
+
+        if curr_message and message.role == RoleTypes.USER:
+            self._curr_message = message.content
+
+        # NOTE trimmed in batches to keep pushes amortized O(1)
+        if len(self._lines) > 2 * self.size:
+            del self._lines[: -self.size]
+            del self._token_sums[: -self.size - 1]
+            del self._chat_messages[: -self.size]
+            del self._chat_token_sums[: -self.size - 1]
+
+    def _truncated(
+        self,
+        message: dict[str, str],
+        token_budget: int,
+    ) -> dict[str, str]:
+        max_tokens = max(
+            token_budget - CHAT_MESSAGE_TOKEN_OVERHEAD,
+            LAST_MESSAGE_MIN_TOKENS,
+        )
+
+        logging.warning(
+            f"last message over the token budget, truncated to {max_tokens}",
+        )
+
+        return {**message, "content": truncate_tokens(message["content"], max_tokens)}
+
+    def _render_previous_messages(self, token_budget: int) -> str:
+        if len(self._lines) == 0:
+            return ""
+
+        end = max(0, len(self._lines) - self.skip_last)
+
+        # first line such that the lines from it to end fit the budget
+        start = bisect.bisect_left(
+            self._token_sums,
+            self._token_sums[end] - max(0, token_budget),
+            lo=max(0, len(self._lines) - self.size),
+            hi=end,
+        )
+
+        user_lines = [
+            line for role, line in self._lines[start:end] if role != RoleTypes.ASSISTANT
+        ]
+
+        return (
+            "\n".join(f"{i + 1}: {line}" for i, line in enumerate(user_lines))
+            + PREVIOUS_MESSAGES_INSTRUCTIONS
+        )
+
+
+def history_token_budget(*prompt_parts: str, reserved: int = 0) -> int:
+    """
+    Tokens left for the history once the other parts of a prompt are packed
+    """
+    used = reserved
+
+    for part in prompt_parts:
+        used += count_tokens(part)
+
+    return max(0, get_config().context_token_budget - used)
@@ -1,13 +1,16 @@
 import os
 import logging
 import tempfile
+from collections.abc import Callable, Iterator
 from enum import Enum
-from src.clients.openai import OpenAiClient
+from src.clients.openai import get_openai_client
 from src.clients.eleven_labs import eleven_labs_tts
-from src.clients.eleven_labs_wss import eleven_labs_wss_tts
+from src.clients.eleven_labs_wss import eleven_labs_wss_tts, eleven_labs_wss_tts_stream
 from src.clients.assembly import assembly_transcribe
 from src.clients.local_microphone import local_record_online_transcribe
-from src.system_conf import get_conf, STT_CLIENT, TTT_CLIENT, TTS_CLIENT, SPEECH_OFF, WHISPER_MIC, MIC_OFF
+from src.clients.rate_limiter import Priority
+from src.system_conf import SystemConfig, get_config
+from src.utils.llm_cache import cache_key, get_response_cache
 from pydub import AudioSegment
 from pydub.playback import play
 from time import time
@@ -39,8 +42,16 @@ def get_client_from_env():
     return wrapper
 
 
-def speech_to_text() -> str:
-    client = get_conf(STT_CLIENT)
+def speech_to_text(
+    config: SystemConfig | None = None,
+    on_interim: Callable[[str], None] | None = None,
+) -> str:
+    """
+    on_interim: called with the interim transcript whenever it stabilizes (deepgram)
+    """
+    config = config or get_config()
+
+    client = config.stt_client
 
     logging.debug(f"STT_CLIENT: {client}")
 
@@ -48,16 +59,16 @@ def speech_to_text() -> str:
     match client:
         case STT_CLIENTS.INTERNAL.value:
 
-            if os.environ.get(MIC_OFF):
+            if config.mic_off:
                 text = input("User Message:")
 
-            elif os.environ.get(WHISPER_MIC):
+            elif config.whisper_mic:
                 # Openai whisper implementation
-                text = local_record_online_transcribe()
+                text = local_record_online_transcribe(config=config)
                 logging.info(f"User Message: {text}")
             else:
                 # Deepgram STT implementation
-                text = deepgram_trascription()
+                text = deepgram_trascription(config=config, on_interim=on_interim)
                 logging.info(f"User Message: {text}")
 
             # logging.info(f"STT: {text}")
@@ -76,34 +87,124 @@ def speech_to_text() -> str:
     return text
 
 
-def text_to_text(messages_input: str) -> str | None:
-    client = get_conf(TTT_CLIENT)
+def text_to_text(
+    messages_input: str | list[dict[str, str]],
+    config: SystemConfig | None = None,
+    cache: bool = False,
+    priority: Priority = Priority.FOREGROUND,
+) -> str | None:
+    """
+    messages_input is either a single (system) prompt or a list of chat messages
+        - cache: reuse the response of an identical earlier call (see
+          utils/llm_cache.py)
+        - priority: background calls yield the provider quota to conversational ones
+    """
+    config = config or get_config()
+
+    if cache is True:
+        text = get_response_cache().get(cache_key(messages_input, config))
+
+        if text is not None:
+            logging.info("Agent Response (cached): %s" % text)
+            return text
+
+    client = config.ttt_client
 
     logging.debug(f"TTT_CLIENT: {client}")
 
     text = None
+    model = None
     match client:
         case TTT_CLIENTS.INTERNAL.value:
             # TODO internal model
             pass
 
         case TTT_CLIENTS.OPENAI.value:
-            text = OpenAiClient().ttt(messages_input=messages_input)
+            response = get_openai_client().ttt_response(
+                messages_input=messages_input,
+                config=config,
+                priority=priority,
+            )
+            text, model = response.content, response.model
             logging.info("Agent Response: %s"%text)
 
         case _:
             raise ValueError(f"Invalid client type: {client}")
 
+    # NOTE keyed by the model that responded, a fallback response is never served
+    # for the configured model
+    if cache is True and isinstance(text, str) and len(text) > 0:
+        get_response_cache().set(cache_key(messages_input, config, model=model), text)
+
     return text
 
 
-def text_to_speech(text: str, voice_id: str) -> int:
+def text_to_text_stream(
+    messages_input: str | list[dict[str, str]],
+    config: SystemConfig | None = None,
+    cache: bool = False,
+) -> Iterator[str]:
+    """
+    Same as text_to_text but yields the response tokens as they are generated, a
+    cached response is yielded at once
+    """
+    config = config or get_config()
+
+    if cache is True:
+        key = cache_key(messages_input, config)
+
+        text = get_response_cache().get(key)
+
+        if text is not None:
+            logging.info("Agent Response (cached): %s" % text)
+            return iter((text,))
+
+        return _cached_stream(text_to_text_stream(messages_input, config), key)
+
+    client = config.ttt_client
+
+    logging.debug(f"TTT_CLIENT (stream): {client}")
+
+    match client:
+        case TTT_CLIENTS.INTERNAL.value:
+            # TODO internal model
+            return iter(())
+
+        case TTT_CLIENTS.OPENAI.value:
+            return get_openai_client().ttt_stream(
+                messages_input=messages_input,
+                config=config,
+            )
+
+        case _:
+            raise ValueError(f"Invalid client type: {client}")
+
+
+def _cached_stream(text_iterator: Iterator[str], key: str) -> Iterator[str]:
+    """
+    Pass the tokens through and cache the response once the stream completed
+    """
+    chunks = []
+
+    for chunk in text_iterator:
+        chunks.append(chunk)
+        yield chunk
+
+    text = "".join(chunks)
+
+    if len(text) > 0:
+        get_response_cache().set(key, text)
+
+
+def text_to_speech(text: str, voice_id: str, config: SystemConfig | None = None) -> int:
     stime = time()
-    if os.environ.get(SPEECH_OFF):
+    config = config or get_config()
+
+    if config.speech_off:
         logging.debug("Speech is off")
         return 200
 
-    client = get_conf(TTS_CLIENT)
+    client = config.tts_client
 
     logging.debug(f"TTS_CLIENT: {client}")
 
@@ -117,6 +218,7 @@ def text_to_speech(text: str, voice_id: str) -> int:
             status, audio_bytes = eleven_labs_tts(
                 text=text,
                 voice_id=voice_id,
+                api_key=config.eleven_labs_key,
             )
 
         case _:
@@ -145,12 +247,18 @@ def text_to_speech(text: str, voice_id: str) -> int:
 
     return status
 
-def text_to_speech_wss(text: str, voice_id: str) -> int:
-    if os.environ.get(SPEECH_OFF):
+def text_to_speech_wss(
+    text: str,
+    voice_id: str,
+    config: SystemConfig | None = None,
+) -> int:
+    config = config or get_config()
+
+    if config.speech_off:
         logging.debug("Speech is off")
         return 200
 
-    client = get_conf(TTS_CLIENT)
+    client = config.tts_client
 
     logging.debug(f"TTS_CLIENT: {client}")
 
@@ -163,6 +271,7 @@ def text_to_speech_wss(text: str, voice_id: str) -> int:
             asyncio.run(eleven_labs_wss_tts(
                 text=text,
                 voice_id=voice_id,
+                api_key=config.eleven_labs_key,
             ))
             status = 1
 
@@ -171,3 +280,59 @@ def text_to_speech_wss(text: str, voice_id: str) -> int:
             return
 
     return status
+
+
+def text_to_speech_wss_stream(
+    text_iterator: Iterator[str],
+    voice_id: str,
+    config: SystemConfig | None = None,
+) -> str:
+    """
+    Speak text as it streams in and return the full text once the stream finished,
+    even when speech failed midway
+    """
+    config = config or get_config()
+
+    chunks = []
+
+    def recorded_text_iterator():
+        for chunk in text_iterator:
+            chunks.append(chunk)
+            yield chunk
+
+    iterator = recorded_text_iterator()
+
+    if config.speech_off:
+        logging.debug("Speech is off")
+        return "".join(iterator)
+
+    client = config.tts_client
+
+    logging.debug(f"TTS_CLIENT (stream): {client}")
+
+    match client:
+        case TTS_CLIENTS.INTERNAL.value:
+            pass
+
+        case TTS_CLIENTS.ELEVENLABS.value:
+            try:
+                asyncio.run(
+                    eleven_labs_wss_tts_stream(
+                        iterator,
+                        voice_id=voice_id,
+                        api_key=config.eleven_labs_key,
+                    ),
+                )
+
+            except Exception as e:
+                logging.error(f"I/O Error TTS stream: {e}")
+
+        case _:
+            logging.error(f"Invalid client type: {client}")
+
+    # NOTE whatever was not spoken is still part of the response
+    text = "".join(chunks) + "".join(iterator)
+
+    logging.info("Agent Response: %s" % text)
+
+    return text
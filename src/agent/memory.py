@@ -55,18 +55,40 @@ class UserMemory(BaseModel):
             dislikes=UserContextVolume(**memory["dislikes"]),
         )
 
+    def merge_stored(self, stored: "UserMemory"):
+        """
+        Merge a concurrently stored copy into this (locally changed) one - local
+        values win but relevant messages are append-only so none are dropped
+        """
+        for volume, stored_volume in (
+            (self.likes, stored.likes),
+            (self.dislikes, stored.dislikes),
+        ):
+            volume.relevant_messages = stored_volume.relevant_messages + [
+                message
+                for message in volume.relevant_messages
+                if message not in stored_volume.relevant_messages
+            ]
+
 
 class BotAgentMemory(BaseModel):
     model_config = ConfigDict(arbitrary_types_allowed=True)
 
+    # NOTE only the most recent messages are loaded, older ones are paged in on demand
     full_message_history: list[Message]
 
+    # index (in the stored message list) of the first loaded message
+    history_offset: int = Field(default=0, exclude=True)
+
     last_interaction_summation: str
 
     last_day_summation: str  # NOTE test within minute crons
 
     last_week_summation: str
 
+    # NOTE evolved in the background, guides the tone of the next response
+    current_mood: str = ""
+
     user_memory: UserMemory
 
     @classmethod
@@ -80,12 +102,26 @@ class BotAgentMemory(BaseModel):
         )
 
     @classmethod
-    def load_memory(cls, memory: dict):
+    def load_memory(
+        cls,
+        memory: dict,
+        full_message_history: list[dict] | None = None,
+        history_offset: int = 0,
+    ):
+        """
+        full_message_history is stored in its own append-only list, fall back to the
+        (legacy) history embedded in the memory blob when it is not provided
+        """
+        if full_message_history is None:
+            full_message_history = memory.get("full_message_history", [])
+
         user_memory = UserMemory.load_user_memory(memory["user_memory"])
         return cls(
-            full_message_history=memory["full_message_history"],
+            full_message_history=full_message_history,
+            history_offset=history_offset,
             last_interaction_summation=memory["last_interaction_summation"],
             last_day_summation=memory["last_day_summation"],
             last_week_summation=memory["last_week_summation"],
+            current_mood=memory.get("current_mood", ""),
             user_memory=user_memory,
         )
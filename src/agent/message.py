@@ -1,5 +1,6 @@
 from pydantic import BaseModel, model_serializer
 from enum import Enum
+from src.utils.tokens import count_tokens, exact_token_counts
 
 
 class RoleTypes(Enum):
@@ -13,13 +14,38 @@ class Message(BaseModel):
 
     content: str
 
+    # NOTE stored with the message so a reloaded history is never re-tokenized, None
+    # for messages stored before it was or while counts were only estimated
+    tokens: int | None = None
+
+    @property
+    def token_count(self) -> int:
+        """
+        Tokens of the content, counted once per message - estimates are not kept so
+        they are recounted once the tokenizer is available
+        """
+        if self.tokens is not None:
+            return self.tokens
+
+        tokens = count_tokens(self.content)
+
+        if exact_token_counts():
+            self.tokens = tokens
+
+        return tokens
+
     @model_serializer
     def serialize_to_gpt3(self):
-        return {
+        message = {
             "role": self.role.value,
             "content": self.content,
         }
 
+        if self.tokens is not None:
+            message["tokens"] = self.tokens
+
+        return message
+
 
 # NOTE grouping interactions not necessary imo atm
 # class Interaction(BaseModel):
@@ -0,0 +1,83 @@
+import logging
+import threading
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from src.agent.io_interface import text_to_text
+from src.clients.rate_limiter import Priority
+from src.system_conf import get_config
+
+
+class MoodEvolver:
+
+    """
+    Evolves the mood off the turn's critical path - the evolution started on turn N
+    updates the mood the response of turn N+1 is prompted with, a response never
+    waits on it
+        - a new evolution supersedes (cancels) the one still running, whose result
+          is dropped
+        - the LLM call is bounded by deadline, mood_evolver_deadline of the config
+          by default
+    """
+
+    def __init__(
+        self,
+        on_mood: Callable[[str], None],
+        deadline: float | None = None,
+    ):
+        self.on_mood = on_mood
+        self.deadline = deadline
+        self._generation = 0
+        self._future: Future | None = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mood")
+        self._lock = threading.Lock()
+
+    def evolve(self, prompt: Callable[[], str]) -> Future:
+        """
+        prompt is rendered in the background too
+        """
+        with self._lock:
+            if self._future is not None:
+                self._future.cancel()
+
+            self._generation += 1
+            self._future = self._executor.submit(self._evolve, self._generation, prompt)
+
+            return self._future
+
+    def cancel(self):
+        with self._lock:
+            if self._future is not None:
+                self._future.cancel()
+
+            self._generation += 1
+            self._future = None
+
+    def _evolve(self, generation: int, prompt: Callable[[], str]):
+        config = get_config()
+        deadline = self.deadline or config.mood_evolver_deadline
+        config = config.model_copy(
+            update={"ttt_deadline": min(deadline, config.ttt_deadline)},
+        )
+
+        mood = text_to_text(
+            messages_input=prompt(),
+            config=config,
+            priority=Priority.BACKGROUND,
+        )
+
+        with self._lock:
+            superseded = generation != self._generation
+
+        if superseded:
+            logging.debug("mood evolution superseded, dropping it")
+            return
+
+        if not mood:
+            logging.warning("mood evolution failed, keeping the current mood")
+            return
+
+        logging.debug(f"mood evolved: {mood}")
+
+        # NOTE called without the lock, on_mood takes the agent's lock which is held
+        # while cancelling (e.g. clear_message_history)
+        self.on_mood(mood)
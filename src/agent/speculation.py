@@ -0,0 +1,108 @@
+import logging
+import threading
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from fuzzywuzzy import fuzz, utils
+from src.system_conf import get_config
+
+# NOTE in-flight requests can't be aborted, a stale one just has its result dropped
+SPECULATION_MAX_WORKERS = 2
+
+
+def transcripts_match(a: str, b: str, min_ratio: int | None = None) -> bool:
+    """
+    Fuzzy match ignoring case and punctuation (interim transcripts are often only
+    re-punctuated once final) - min_ratio is speculation_min_ratio of the config by
+    default
+    """
+    if min_ratio is None:
+        min_ratio = get_config().speculation_min_ratio
+
+    return fuzz.ratio(utils.full_process(a), utils.full_process(b)) >= min_ratio
+
+
+class SpeculativeResponse:
+
+    """
+    Response generated from a (stable) interim transcript while the user may still be
+    speaking, hides the endpointing wait and the LLM latency behind each other
+        - propose: (re)start generating for an interim transcript, an equivalent one
+          keeps the generation already running
+        - commit: the final transcript takes the speculative response when it matches
+          closely enough (waiting for it if still generating), None otherwise and the
+          caller generates as usual
+        - min_ratio: speculation_min_ratio of the config by default
+    """
+
+    def __init__(
+        self,
+        generate: Callable[[str], str | None],
+        min_ratio: int | None = None,
+    ):
+        self.generate = generate
+        self.min_ratio = min_ratio
+        self.hits = 0
+        self.misses = 0
+        self._transcript: str | None = None
+        self._future: Future | None = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=SPECULATION_MAX_WORKERS,
+            thread_name_prefix="speculation",
+        )
+        self._lock = threading.Lock()
+
+    def propose(self, transcript: str):
+        with self._lock:
+            if self._transcript is not None and transcripts_match(
+                self._transcript,
+                transcript,
+                self.min_ratio,
+            ):
+                return
+
+            if self._future is not None:
+                self._future.cancel()
+
+            logging.debug(f"speculating response for: {transcript}")
+
+            self._transcript = transcript
+            self._future = self._executor.submit(self.generate, transcript)
+
+    def commit(self, transcript: str) -> str | None:
+        with self._lock:
+            speculated, future = self._transcript, self._future
+            self._transcript, self._future = None, None
+
+        if future is None:
+            return None
+
+        if not transcripts_match(speculated, transcript, self.min_ratio):
+            future.cancel()
+            self.misses += 1
+
+            logging.debug(
+                f"speculation missed ({self.hits} hits, {self.misses} misses): "
+                f"'{speculated}' != '{transcript}'",
+            )
+            return None
+
+        try:
+            response = future.result()
+
+        except Exception as e:
+            logging.error(f"speculative response failed: {e}")
+            return None
+
+        if response is not None:
+            self.hits += 1
+
+            logging.debug(f"speculation hit ({self.hits} hits, {self.misses} misses)")
+
+        return response
+
+    def cancel(self):
+        with self._lock:
+            if self._future is not None:
+                self._future.cancel()
+
+            self._transcript, self._future = None, None
@@ -5,8 +5,7 @@
 from dotenv import load_dotenv
 # import logging, verboselogs
 from time import sleep,time
-import os
-from threading import Event
+import threading
 from deepgram import (
     DeepgramClient,
     DeepgramClientOptions,
@@ -15,102 +14,295 @@ from deepgram import (
     Microphone,
 )
 import logging
-from src.system_conf import (
-    DEEPGRAM_KEY,
-)
+from src.system_conf import SystemConfig, get_config
+from src.clients.rate_limiter import RateLimitTimeoutError, get_rate_limiter
+from src.utils.singleton import Singleton
+from collections.abc import Callable
 load_dotenv()
 
-def deepgram_trascription():
-    while True:
-        try:
-            # TODO new dg connection needs to be optimized 
-            logging.info('starting mic...')
-            api_key = os.environ.get(DEEPGRAM_KEY)
-            # Open a microphone stream on the default input device
-            microphone: Microphone
-            dg_connection: DeepgramClient
-            deepgram = DeepgramClient(api_key)
-            dg_connection = deepgram.listen.live.v("1")
-            sentence_buffer = ''
-            sentences_added = []
-            LISTENING = False
-            def on_message(self, result, **kwargs):
-                nonlocal sentence_buffer
-                nonlocal sentences_added
-                sentence = result.channel.alternatives[0].transcript
-                if len(sentence) == 0:
-                    return
-                if len(sentence) < len(sentence_buffer):
-                    logging.debug(f"speaker: {sentence_buffer}")
-                    sentences_added.append(sentence_buffer)
-                    sentence_buffer = ''
-                sentence_buffer = sentence
-
-
-            # def on_metadata(self, metadata, **kwargs):
-            #     print(f"\n\n{metadata}\n\n")
-
-            # def on_speech_started(self, speech_started, **kwargs):
-            #     print(f"\n\n{speech_started}\n\n")
-
-            def on_utterance_end(self, utterance_end, **kwargs):
-                nonlocal sentences_added
-                nonlocal sentence_buffer
-                nonlocal microphone
-                nonlocal LISTENING
-                logging.debug(f"speaker: {sentence_buffer}")
-                sentences_added.append(sentence_buffer)
-                logging.debug('stopped listening...')
-                # print(f"\n\n{utterance_end}\n\n")
-                microphone.finish()
-                LISTENING = False
-
-                return 
-
-            def on_error(self, error, **kwargs):
-                print(f"\n\n{error}\n\n")
-
-            dg_connection.on(LiveTranscriptionEvents.Transcript, on_message)
-            # dg_connection.on(LiveTranscriptionEvents.Metadata, on_metadata)
-            # dg_connection.on(LiveTranscriptionEvents.SpeechStarted, on_speech_started)
-            dg_connection.on(LiveTranscriptionEvents.UtteranceEnd, on_utterance_end)
-            dg_connection.on(LiveTranscriptionEvents.Error, on_error)
-
-            options: LiveOptions = LiveOptions(
-                model="nova-2-general",
-                punctuate=True,
-                language="en-US",
-                encoding="linear16",
-                channels=1,
-                sample_rate=16000, # To get UtteranceEnd, the following must be set:
-                interim_results=True,
-                utterance_end_ms="1000",
-                vad_events=True,
-                endpointing=100
-            )
-            dg_connection.start(options)
-
-            logging.info('listening...')
-            # Open a microphone stream on the default input device
-            microphone: Microphone = Microphone(dg_connection.send)
-
-            # start microphone
-            microphone.start()
-            LISTENING = True
-
-            while LISTENING:
-                # if not microphone.is_active():
-                #     break
-                sleep(0.1)
-
-            dg_connection.signal_exit()
-            dg_connection.finish()
-
-            final_text = " ".join(sentences_added)
-
-            return final_text
-        except Exception as e:
-            logging.error("Could not open socket, Make sure your mic is connected!")
-            sleep(1)
-            logging.info(f"Retrying Deepgram Connection!")
-            continue
+# seconds between connection checks while waiting for the utterance, callbacks wake
+# the listener up directly, this only bounds noticing a silently dropped socket
+CONNECTION_CHECK_SECONDS = 1.0
+
+# NOTE first reconnection is immediate, the following ones back off exponentially
+RECONNECT_BACKOFF = 0.25
+RECONNECT_MAX_BACKOFF = 5.0
+# failed (re)connections of a listen before the last error is raised
+RECONNECT_MAX_RETRIES = 5
+
+LIVE_OPTIONS = LiveOptions(
+    model="nova-2-general",
+    punctuate=True,
+    language="en-US",
+    encoding="linear16",
+    channels=1,
+    sample_rate=16000, # To get UtteranceEnd, the following must be set:
+    interim_results=True,
+    utterance_end_ms="1000",
+    vad_events=True,
+    endpointing=100
+)
+
+_DEEPGRAM_SESSION: "Singleton[DeepgramSession]" = Singleton()
+
+
+class DeepgramSession:
+
+    """
+    Live transcription session kept open across turns - one websocket (kept alive
+    with KeepAlive messages while nobody speaks) and one microphone stream, muted
+    between utterances so nothing is transcribed while the agent speaks
+        - listen returns the next utterance, woken up by the transcript callbacks
+          as soon as it ends (UtteranceEnd, or speech_final with early finalize)
+        - a closed or failed connection is reopened on the next listen
+        - setup_times: seconds each (re)connection took
+    """
+
+    def __init__(self, config: SystemConfig):
+        self.config = config
+        self.setup_times: list[float] = []
+        self._connection = None
+        self._microphone: Microphone | None = None
+        self._connected = False
+        self._muted = threading.Event()
+        self._muted.set()
+        self._lock = threading.Lock()
+        # NOTE notified by the callbacks on every transcript change, utterance end
+        # and error
+        self._changed = threading.Condition(self._lock)
+        # state of the utterance being listened to
+        self._sentence_buffer = ''
+        self._sentences_added: list[str] = []
+        self._listening = False
+        self._last_change = time()
+        # NOTE set when an utterance is finalized on speech_final, its UtteranceEnd
+        # still comes and must not end the next utterance
+        self._utterance_end_pending = False
+
+    @property
+    def is_connected(self) -> bool:
+        return (
+            self._connected
+            and self._connection is not None
+            and not self._connection.exit
+        )
+
+    def connect(self):
+        stime = time()
+
+        get_rate_limiter().acquire("deepgram")
+
+        logging.info('starting mic...')
+        deepgram = DeepgramClient(
+            self.config.deepgram_key,
+            DeepgramClientOptions(options={"keepalive": "true"}),
+        )
+        connection = deepgram.listen.live.v("1")
+
+        connection.on(LiveTranscriptionEvents.Transcript, self._on_message)
+        connection.on(LiveTranscriptionEvents.UtteranceEnd, self._on_utterance_end)
+        connection.on(LiveTranscriptionEvents.Error, self._on_error)
+
+        connection.start(LIVE_OPTIONS)
+        self._connection = connection
+
+        # Open a microphone stream on the default input device
+        self._microphone = Microphone(self._send_audio)
+        self._microphone.start()
+
+        self._connected = True
+
+        setup_time = time() - stime
+        self.setup_times.append(setup_time)
+        logging.info(f"deepgram connected in {setup_time:.3f}s")
+
+    def close(self):
+        self._muted.set()
+        self._connected = False
+        self._utterance_end_pending = False
+
+        microphone, self._microphone = self._microphone, None
+        connection, self._connection = self._connection, None
+
+        for closable in (microphone, connection):
+            try:
+                if closable is not None:
+                    closable.finish()
+
+            except Exception as e:
+                logging.debug(f"error closing deepgram session: {e}")
+
+    def listen(self, on_interim: Callable[[str], None] | None = None) -> str:
+        """
+        on_interim: called with the interim transcript once it stabilizes, before the
+        utterance end (e.g. to start generating a response early)
+        """
+        retries = 0
+        while True:
+            try:
+                with self._lock:
+                    self._sentence_buffer = ''
+                    self._sentences_added = []
+                    self._last_change = time()
+                    self._listening = True
+
+                if not self.is_connected:
+                    self.close()
+                    self.connect()
+
+                self._muted.clear()
+                logging.info('listening...')
+
+                return self._wait_utterance(on_interim)
+
+            except RateLimitTimeoutError:
+                # NOTE already waited for the quota, retrying would only wait again
+                self.close()
+                raise
+
+            except Exception as e:
+                logging.error(
+                    f"Could not open socket, Make sure your mic is connected! ({e})",
+                )
+                self.close()
+
+                if retries >= RECONNECT_MAX_RETRIES:
+                    raise
+
+                backoff = 0
+                if retries:
+                    backoff = min(
+                        RECONNECT_BACKOFF * 2**retries,
+                        RECONNECT_MAX_BACKOFF,
+                    )
+                retries += 1
+                sleep(backoff)
+
+                logging.info(f"Retrying Deepgram Connection!")
+                continue
+
+    def _wait_utterance(self, on_interim: Callable[[str], None] | None) -> str:
+        stable_interim = ''
+        while True:
+            with self._changed:
+                if not self._listening:
+                    self._muted.set()
+                    return " ".join(self._sentences_added)
+
+                if not self.is_connected:
+                    raise ConnectionError("deepgram connection lost")
+
+                timeout = CONNECTION_CHECK_SECONDS
+                interim = " ".join(
+                    [*self._sentences_added, self._sentence_buffer],
+                ).strip()
+
+                if on_interim is not None and interim and interim != stable_interim:
+                    stable_at = self._last_change + self.config.interim_stable_seconds
+                    timeout = min(timeout, stable_at - time())
+
+                if timeout > 0:
+                    self._changed.wait(timeout)
+                    continue
+
+            # NOTE called without the lock, transcripts keep coming meanwhile
+            stable_interim = interim
+            on_interim(interim)
+
+    def _send_audio(self, data: bytes):
+        # NOTE muted frames are dropped, KeepAlive keeps the socket open meanwhile
+        if not self._muted.is_set() and self._connection is not None:
+            self._connection.send(data)
+
+    def _on_message(self, client, result, **kwargs):
+        sentence = result.channel.alternatives[0].transcript
+        if len(sentence) == 0:
+            return
+
+        with self._changed:
+            if not self._listening:
+                return
+            if len(sentence) < len(self._sentence_buffer):
+                logging.debug(f"speaker: {self._sentence_buffer}")
+                self._sentences_added.append(self._sentence_buffer)
+                self._sentence_buffer = ''
+            if sentence != self._sentence_buffer:
+                self._last_change = time()
+            self._sentence_buffer = sentence
+
+            if self.config.deepgram_early_finalize and result.speech_final:
+                logging.debug('speech final, finalizing before utterance end')
+                self._finalize()
+                self._utterance_end_pending = True
+
+            self._changed.notify_all()
+
+    def _on_utterance_end(self, client, utterance_end, **kwargs):
+        with self._changed:
+            # NOTE the UtteranceEnd of an utterance already finalized on speech_final,
+            # possibly arriving once the next one is being transcribed
+            if self._utterance_end_pending:
+                self._utterance_end_pending = False
+                return
+
+            if not self._listening or not (
+                self._sentence_buffer or self._sentences_added
+            ):
+                return
+            self._finalize()
+            self._changed.notify_all()
+
+    def _on_error(self, client, error, **kwargs):
+        logging.error(f"deepgram error: {error}")
+        with self._changed:
+            self._connected = False
+            self._changed.notify_all()
+
+    def _finalize(self):
+        # NOTE called with the lock held
+        logging.debug(f"speaker: {self._sentence_buffer}")
+        self._sentences_added.append(self._sentence_buffer)
+        self._sentence_buffer = ''
+        logging.debug('stopped listening...')
+        self._muted.set()
+        self._listening = False
+
+
+def get_deepgram_session(config: SystemConfig) -> DeepgramSession:
+    """
+    The process wide session, reopened when the deepgram key changed and following
+    the latest config otherwise
+    """
+    with _DEEPGRAM_SESSION.lock:
+        session = _DEEPGRAM_SESSION.instance
+
+        if session is not None and session.config.deepgram_key != config.deepgram_key:
+            _DEEPGRAM_SESSION.pop().close()
+
+        session = _DEEPGRAM_SESSION.get(lambda: DeepgramSession(config))
+        session.config = config
+
+        return session
+
+
+def close_deepgram_session():
+    """
+    Close the session (its socket threads would otherwise keep the process alive)
+    """
+    with _DEEPGRAM_SESSION.lock:
+        session = _DEEPGRAM_SESSION.pop()
+
+        if session is not None:
+            session.close()
+
+
+def deepgram_trascription(
+    config: SystemConfig | None = None,
+    on_interim: Callable[[str], None] | None = None,
+):
+    """
+    Next utterance of the user, transcribed over the persistent session
+    """
+    config = config or get_config()
+
+    return get_deepgram_session(config).listen(on_interim=on_interim)
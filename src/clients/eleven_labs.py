@@ -1,7 +1,7 @@
 import os
 from src.clients.base_api_request import push_request
 from src.utils import timeit
-from src.system_conf import ELEVEN_LABS_KEY
+from src.clients.rate_limiter import get_rate_limiter
 
 BASE_URL = "https://api.elevenlabs.io/v1/text-to-speech/"
 
@@ -13,17 +13,19 @@ CURR_DIR = os.getcwd()
 
 
 @timeit.PROFILE
-def eleven_labs_tts(text: str, voice_id: str) -> tuple[int, bytes] | None:
+def eleven_labs_tts(
+    text: str,
+    voice_id: str,
+    api_key: str | None,
+) -> tuple[int, bytes] | None:
     url = f"{BASE_URL}{voice_id}"
 
-    api_key = os.environ.get(ELEVEN_LABS_KEY)
-
     if api_key is None:
         raise ValueError("ELEVEN_LABS_KEY is not set")
 
     headers = {
         "Accept": "audio/mpeg",
-        "xi-api-key": os.environ.get(ELEVEN_LABS_KEY),
+        "xi-api-key": api_key,
         "Content-Type": "application/json",
     }
 
@@ -33,6 +35,8 @@ def eleven_labs_tts(text: str, voice_id: str) -> tuple[int, bytes] | None:
         "voice_settings": {"stability": 0.6, "similarity_boost": 0.85},
     }
 
+    get_rate_limiter().acquire("elevenlabs", tokens=len(text))
+
     response = push_request(api_key, url, headers, data)
 
     return response.status_code, response.content
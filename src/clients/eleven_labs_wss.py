@@ -7,10 +7,9 @@ import subprocess
 import logging
 from time import time
 import sys
-import os
+from collections.abc import Iterator
 from src.utils import timeit
-from src.system_conf import ELEVEN_LABS_KEY
-print(ELEVEN_LABS_KEY)
+from src.clients.rate_limiter import get_rate_limiter
 
 
 def is_installed(lib_name):
@@ -65,15 +64,29 @@ async def stream(audio_stream):
     mpv_process.wait()
 
 
-async def text_to_speech_input_streaming(voice_id, text_iterator):
-    """Send text to ElevenLabs API and stream the returned audio."""
+async def text_to_speech_input_streaming(
+    voice_id,
+    text_iterator,
+    api_key,
+    characters=None,
+):
+    """
+    Send text to ElevenLabs API and stream the returned audio - characters are
+    charged upfront when known, otherwise as each chunk is sent
+    """
+    await asyncio.to_thread(
+        get_rate_limiter().acquire,
+        "elevenlabs",
+        tokens=characters or 0,
+    )
+
     uri = f"wss://api.elevenlabs.io/v1/text-to-speech/{voice_id}/stream-input?model_id=eleven_turbo_v2"
 
     async with websockets.connect(uri) as websocket:
         await websocket.send(json.dumps({
             "text": " ",
             "voice_settings": {"stability": 0.6, "similarity_boost": 0.85},
-            "xi_api_key": os.environ.get(ELEVEN_LABS_KEY),
+            "xi_api_key": api_key,
         }))
 
         async def listen():
@@ -93,6 +106,14 @@ async def text_to_speech_input_streaming(voice_id, text_iterator):
         listen_task = asyncio.create_task(stream(listen()))
         logging.debug("Start Audio Stream from Eleven Labs")
         async for text in text_chunker(text_iterator):
+            if characters is None:
+                await asyncio.to_thread(
+                    get_rate_limiter().acquire,
+                    "elevenlabs",
+                    tokens=len(text),
+                    requests=0,
+                )
+
             await websocket.send(json.dumps({"text": text, "try_trigger_generation": True}))
         
         await websocket.send(json.dumps({"text": ""}))
@@ -100,12 +121,33 @@ async def text_to_speech_input_streaming(voice_id, text_iterator):
 
 
 @timeit.PROFILE
-async def eleven_labs_wss_tts(text: str, voice_id: str) -> tuple[int, bytes] | None:
+async def eleven_labs_wss_tts(
+    text: str,
+    voice_id: str,
+    api_key: str | None,
+) -> tuple[int, bytes] | None:
     response = text.split(" ")
     async def text_iterator():
         for chunk in response:
             delta = chunk + " "
             yield delta
 
-    await text_to_speech_input_streaming(voice_id, text_iterator())
+    await text_to_speech_input_streaming(voice_id, text_iterator(), api_key, len(text))
+
+
+async def eleven_labs_wss_tts_stream(
+    text_iterator: Iterator[str],
+    voice_id: str,
+    api_key: str | None,
+):
+    """
+    Speak text while it is being generated (e.g. LLM tokens) - the blocking
+    iterator is consumed in a thread so audio keeps streaming between tokens
+    """
+    async def async_text_iterator():
+        iterator = iter(text_iterator)
+
+        while (chunk := await asyncio.to_thread(next, iterator, None)) is not None:
+            yield chunk
 
+    await text_to_speech_input_streaming(voice_id, async_text_iterator(), api_key)
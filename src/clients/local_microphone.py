@@ -1,27 +1,182 @@
 import os
 import sounddevice as sd
 import logging
+import threading
 
 import speech_recognition as sr
-from src.clients.openai import OpenAiClient
+from src.clients.openai import get_openai_client
 from src.utils import timeit
-from time import time
-
-from src.system_conf import (
-    get_conf,
-    LOCAL_RECORDING_PAUSE_THRESHOLD,
-    LOCAL_RECORDING_NON_SPEAKING_DURATION,
-    LOCAL_RECORDING_PHRASE_THRESHOLD,
-    LOCAL_RECORDING_ENERGY_ADJUSTMENT_DURATION,
-    LOCAL_RECORDING_ENERGY_THRESHOLD,
-    LOCAL_RECORDING_DYNAMIC_ENERGY_THRESHOLD,
-    LOCAL_RECORDING_DYNAMIC_ENERGY_ADJUSTMENT_DAMPING,
-)
+from src.utils.singleton import Singleton
+
+from src.system_conf import SystemConfig, get_config
 
 CURR_DIR = os.getcwd()
 
+# NOTE seconds of audio sampled per calibration step, listen waits one step at most
+# for the microphone
+CALIBRATION_STEP_SECONDS = 0.1
+
+_AMBIENT_NOISE_CALIBRATOR: "Singleton[AmbientNoiseCalibrator]" = Singleton()
+
+
+class AmbientNoiseCalibrator:
+
+    """
+    Keeps the microphone open and tracks the noise floor in the background (while the
+    agent is idle or speaking) instead of sampling it before every utterance
+        - the recognizer's energy_threshold is updated continuously with the same
+          damped average as adjust_for_ambient_noise, listen starts right away
+        - calibration pauses while listening, the recognizer's own dynamic threshold
+          takes over meanwhile
+        - only the first start pays the energy_adjustment_duration
+    """
+
+    def __init__(self, config: SystemConfig):
+        self.config = config
+        self.recognizer = sr.Recognizer()
+        self.recognizer.energy_threshold = config.energy_threshold
+        self._source: sr.Microphone | None = None
+        self._source_lock = threading.Lock()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def energy_threshold(self) -> float:
+        return self.recognizer.energy_threshold
+
+    def start(self):
+        self._source = sr.Microphone().__enter__()
+
+        try:
+            self._configure()
+
+            logging.debug("calibrating ambient noise...")
+            self.recognizer.adjust_for_ambient_noise(
+                self._source,
+                duration=self.config.energy_adjustment_duration,
+            )
+
+        except Exception:
+            # NOTE the microphone is released, the next listen opens it again
+            with self._source_lock:
+                source, self._source = self._source, None
+
+            source.__exit__(None, None, None)
+            raise
+
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._calibrate,
+            name="ambient-noise",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def close(self):
+        self._stopped.set()
+        self._idle.set()
+
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+        with self._source_lock:
+            source, self._source = self._source, None
+
+            try:
+                if source is not None:
+                    source.__exit__(None, None, None)
+
+            except Exception as e:
+                logging.debug(f"error closing microphone: {e}")
+
+    def listen(self) -> sr.AudioData:
+        if not self.is_running:
+            self.close()
+            self.start()
+
+        self._idle.clear()
+        try:
+            with self._source_lock:
+                self._configure()
+
+                logging.debug(f"energy threshold: {self.energy_threshold:.0f}")
 
-def local_record_online_transcribe():
+                return self.recognizer.listen(self._source)
+
+        finally:
+            self._idle.set()
+
+    def _configure(self):
+        # NOTE energy_threshold is left to the calibration
+        self.recognizer.pause_threshold = self.config.pause_threshold
+        self.recognizer.non_speaking_duration = self.config.non_speaking_duration
+        self.recognizer.phrase_threshold = self.config.phrase_threshold
+        self.recognizer.dynamic_energy_threshold = self.config.dynamic_energy_threshold
+        self.recognizer.dynamic_energy_adjustment_damping = (
+            self.config.dynamic_energy_adjustment_damping
+        )
+
+    def _calibrate(self):
+        try:
+            while not self._stopped.is_set():
+                self._idle.wait()
+
+                with self._source_lock:
+                    if self._stopped.is_set() or not self._idle.is_set():
+                        continue
+
+                    # self.energy_threshold = self.energy_threshold * damping
+                    #     + target_energy * (1 - damping)
+                    # target_energy = energy * self.dynamic_energy_ratio
+                    # damping = self.dynamic_energy_adjustment_damping
+                    #     ** seconds_per_buffer
+                    # seconds_per_buffer = (source.CHUNK + 0.0) / source.SAMPLE_RATE
+                    # NOTE w/ DEFAULTS of
+                    # self.dynamic_energy_adjustment_damping = 0.15
+                    # self.energy_threshold = 300
+                    #     minimum audio energy to consider for recording
+                    self.recognizer.adjust_for_ambient_noise(
+                        self._source,
+                        duration=CALIBRATION_STEP_SECONDS,
+                    )
+
+        except Exception as e:
+            # NOTE the next listen restarts the calibrator
+            logging.error(f"ambient noise calibration stopped: {e}")
+
+
+def get_ambient_noise_calibrator(config: SystemConfig) -> AmbientNoiseCalibrator:
+    """
+    The process wide calibrator, following the latest config
+    """
+    with _AMBIENT_NOISE_CALIBRATOR.lock:
+        calibrator = _AMBIENT_NOISE_CALIBRATOR.get(
+            lambda: AmbientNoiseCalibrator(config),
+        )
+        calibrator.config = config
+
+        return calibrator
+
+
+def close_ambient_noise_calibrator():
+    """
+    Release the microphone held by the calibrator
+    """
+    with _AMBIENT_NOISE_CALIBRATOR.lock:
+        calibrator = _AMBIENT_NOISE_CALIBRATOR.pop()
+
+        if calibrator is not None:
+            calibrator.close()
+
+
+def local_record_online_transcribe(config: SystemConfig | None = None):
     """
     Start point to bring STT locally and lower latency - please read all _speech_recon_lib too
 
@@ -42,15 +197,17 @@ def local_record_online_transcribe():
 
     """
 
-    recording = _speech_recon_lib()
+    config = config or get_config()
 
-    transcription = OpenAiClient().stt(recording)
+    recording = _speech_recon_lib(config)
+
+    transcription = get_openai_client().stt(recording, config=config)
 
     return transcription
 
 
 @timeit.PROFILE
-def _speech_recon_lib():
+def _speech_recon_lib(config: SystemConfig):
     """
     Simple speech recognition library. Detects phrases based on energy of what means silence and bunch of duration params
         - pause_threshold
@@ -62,63 +219,49 @@ def _speech_recon_lib():
 
     See below for full details:
     """
-    r = sr.Recognizer()
-
-    r.pause_threshold = get_conf(LOCAL_RECORDING_PAUSE_THRESHOLD)
-    r.non_speaking_duration = get_conf(LOCAL_RECORDING_NON_SPEAKING_DURATION)
-    r.phrase_threshold = get_conf(LOCAL_RECORDING_PHRASE_THRESHOLD)
-    r.energy_threshold = get_conf(LOCAL_RECORDING_ENERGY_THRESHOLD)
-    r.dynamic_energy_threshold = get_conf(LOCAL_RECORDING_DYNAMIC_ENERGY_THRESHOLD)
-    r.dynamic_energy_adjustment_damping = get_conf(
-        LOCAL_RECORDING_DYNAMIC_ENERGY_ADJUSTMENT_DAMPING,
-    )
-
-    with sr.Microphone() as source:
-        logging.debug("Listen start...")
-        # NOTE TODO this costs by default 1 second at minimum 0.5 seconds
-        # should be on a seperate thread constantly sampling on periods of background noise # TODO - define this
-        # once sampled then dynamically adjust sr.Recognizer()'s self.energy_threshold < # NOTE
-        r.adjust_for_ambient_noise(
-            source,
-            duration=get_conf(LOCAL_RECORDING_ENERGY_ADJUSTMENT_DURATION),
-        )
-        # self.energy_threshold = self.energy_threshold * damping + target_energy * (1 - damping)
-        # target_energy = energy * self.dynamic_energy_ratio
-        # damping = self.dynamic_energy_adjustment_damping ** seconds_per_buffer
-        # seconds_per_buffer = (source.CHUNK + 0.0) / source.SAMPLE_RATE
-        # NOTE w/ DEFAULTS of
-        # self.dynamic_energy_adjustment_damping = 0.15
-        # self.energy_threshold = 300  # minimum audio energy to consider for recording
-
-        logging.debug("Recording.")
-
-        # NOTE .listen()
-        # - Records a single phrase from ``source`` (an ``AudioSource`` instance) into an ``AudioData`` instance, which it returns.
-        # - waits until audio has an energy above ``recognizer_instance.energy_threshold`` (the user has started speaking)
-        # - and then recording until it encounters ``recognizer_instance.pause_threshold`` seconds of non-speaking or there is no more audio input.
-        # - ending silence is not included.
-        # NOTE w/ DEFAULTS of
-        # self.pause_threshold = 0.8  # seconds of non-speaking audio before a phrase is considered complete
-        # self.non_speaking_duration = 0.5  # seconds of non-speaking audio to keep on both sides of the recording
-        # self.phrase_threshold = 0.3  # minimum seconds of speaking audio before we consider the recording a phrase
-        data = r.listen(source)
-        # TODO test snowboy hotword engine performance and generalizeable setup
-        # - ``snowboy_configuration`` parameter allows integration with `Snowboy <https://snowboy.kitt.ai/>`__
-        # - an offline, high-accuracy, power-efficient hotword recognition engine.
-        # - When used, this function will pause until Snowboy detects a hotword, after which it will unpause.
-        # - tuple of the form ``(SNOWBOY_LOCATION, LIST_OF_HOT_WORD_FILES)``,
-        # - where ``SNOWBOY_LOCATION`` is the path to the Snowboy root directory
-        # - ``LIST_OF_HOT_WORD_FILES`` is a list of paths to Snowboy hotword configuration files (`*.pmdl` or `*.umdl` format).
-
-        recording = data.get_wav_data()
-        # NOTE - data
-        # Audio data is sequence of audio samples representing bytes - PCM WAV format
-        # sample-width: each sample, in bytes, respresent a single audio sample
-        # sample-rate: samples of audio per second (Hz)
-        # def __init__(self, frame_data, sample_rate, sample_width)
-        # recording.get_wav_data(): PCM WAV -> WAV
-
-        logging.debug("Listen stop.")
+    # NOTE the ambient noise (energy_threshold) is sampled on a separate thread
+    # constantly, see AmbientNoiseCalibrator - adjust_for_ambient_noise before each
+    # phrase cost 0.5 to 1 second per turn
+    calibrator = get_ambient_noise_calibrator(config)
+
+    logging.debug("Listen start...")
+
+    # NOTE .listen()
+    # - Records a single phrase from ``source`` (an ``AudioSource`` instance) into an
+    #   ``AudioData`` instance, which it returns.
+    # - waits until audio has an energy above
+    #   ``recognizer_instance.energy_threshold`` (the user has started speaking)
+    # - and then recording until it encounters
+    #   ``recognizer_instance.pause_threshold`` seconds of non-speaking or there is
+    #   no more audio input.
+    # - ending silence is not included.
+    # NOTE w/ DEFAULTS of
+    # self.pause_threshold = 0.8
+    #   seconds of non-speaking audio before a phrase is considered complete
+    # self.non_speaking_duration = 0.5
+    #   seconds of non-speaking audio to keep on both sides of the recording
+    # self.phrase_threshold = 0.3
+    #   minimum seconds of speaking audio before we consider the recording a phrase
+    data = calibrator.listen()
+    # TODO test snowboy hotword engine performance and generalizeable setup
+    # - ``snowboy_configuration`` parameter allows integration with `Snowboy <https://snowboy.kitt.ai/>`__
+    # - an offline, high-accuracy, power-efficient hotword recognition engine.
+    # - When used, this function will pause until Snowboy detects a hotword, after
+    #   which it will unpause.
+    # - tuple of the form ``(SNOWBOY_LOCATION, LIST_OF_HOT_WORD_FILES)``,
+    # - where ``SNOWBOY_LOCATION`` is the path to the Snowboy root directory
+    # - ``LIST_OF_HOT_WORD_FILES`` is a list of paths to Snowboy hotword
+    #   configuration files (`*.pmdl` or `*.umdl` format).
+
+    recording = data.get_wav_data()
+    # NOTE - data
+    # Audio data is sequence of audio samples representing bytes - PCM WAV format
+    # sample-width: each sample, in bytes, respresent a single audio sample
+    # sample-rate: samples of audio per second (Hz)
+    # def __init__(self, frame_data, sample_rate, sample_width)
+    # recording.get_wav_data(): PCM WAV -> WAV
+
+    logging.debug("Listen stop.")
 
     return recording
 
@@ -1,19 +1,20 @@
-import os
+import time
 import tempfile
+import threading
+from collections import Counter, defaultdict, deque
+from collections.abc import Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from enum import Enum
 import logging
 import openai
+from pydantic import BaseModel
+import requests
 from src.utils import timeit
+from src.utils.tokens import count_tokens
+from src.utils.singleton import Singleton
+from src.clients.rate_limiter import Priority, get_rate_limiter
 
-from src.system_conf import (
-    get_conf,
-    OPENAI_TTT_MODEL,
-    OPENAI_TTT_TEMPERATURE,
-    OPENAI_TTT_FREQUENCY_PENALTY,
-    OPENAI_TTT_PRESENCE_PENALTY,
-    OPENAI_STT_MODEL,
-    OPENAI_KEY,
-)
+from src.system_conf import SystemConfig, get_config
 
 
 class OpenAITTTModels(Enum):
@@ -25,60 +26,380 @@ class OpenAISTTModels(Enum):
     WHISPER_1 = "whisper-1"
 
 
+# NOTE keep-alive connections shared by every thread making OpenAI requests
+HTTP_POOL_CONNECTIONS = 4
+HTTP_POOL_MAXSIZE = 16
+HTTP_MAX_RETRIES = 2
+
+# NOTE a late response is raced by a duplicate request once slower than the p95
+# latency of its model (hedging), then by the fallback model if the deadline is at risk
+TTT_HEDGE_PERCENTILE = 0.95
+
+# seconds before hedging until enough latencies are recorded
+TTT_HEDGE_AFTER = 4.0
+
+TTT_LATENCY_WINDOW = 100
+TTT_LATENCY_MIN_SAMPLES = 20
+
+# concurrent TTT requests (raced ones included)
+TTT_MAX_WORKERS = 8
+
+# NOTE tokens of a response charged to the rate limit before it is generated
+TTT_RESPONSE_TOKENS_ESTIMATE = 256
+
+# seconds a request is sent with at least, less left of the deadline fails fast
+TTT_MIN_REQUEST_TIMEOUT = 0.1
+
+_OPENAI_CLIENT: "Singleton[OpenAiClient]" = Singleton()
+
+
+class TTTPaths(Enum):
+    PRIMARY = "primary"
+    HEDGE = "hedge"
+    FALLBACK = "fallback"
+    TIMEOUT = "timeout"
+    ERROR = "error"
+
+
+class TTTResponse(BaseModel):
+
+    """
+    Response of a (raced) TTT call and the model and path that produced it
+    """
+
+    content: str | None = None
+    model: str | None = None
+    path: TTTPaths
+
+
+class LatencyTracker:
+
+    """
+    Latencies of the most recent successful requests, per model
+    """
+
+    def __init__(self, window: int = TTT_LATENCY_WINDOW):
+        self._latencies: dict[str, deque[float]] = defaultdict(
+            lambda: deque(maxlen=window),
+        )
+        self._lock = threading.Lock()
+
+    def record(self, model: str, seconds: float):
+        with self._lock:
+            self._latencies[model].append(seconds)
+
+    def percentile(
+        self,
+        model: str,
+        q: float = TTT_HEDGE_PERCENTILE,
+        default: float = TTT_HEDGE_AFTER,
+    ) -> float:
+        with self._lock:
+            latencies = sorted(self._latencies[model])
+
+        if len(latencies) < TTT_LATENCY_MIN_SAMPLES:
+            return default
+
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+
+class PersistentSession(requests.Session):
+
+    """
+    openai (0.28) closes and rebuilds its per-thread session every few minutes and
+    for every new thread - this one is shared and kept open for the whole process
+    so requests never pay for the TCP / TLS handshake again
+    """
+
+    def close(self):
+        pass
+
+
+def get_openai_client() -> "OpenAiClient":
+    """
+    The process wide OpenAI client, created on first use
+    """
+    return _OPENAI_CLIENT.get(OpenAiClient)
+
+
 class OpenAiClient:
+
+    """
+    Thread-safe - prefer the shared instance of get_openai_client
+    """
+
     def __init__(self):
-        api_key = os.environ.get(OPENAI_KEY)
+        if not isinstance(openai.requestssession, PersistentSession):
+            session = PersistentSession()
 
-        if api_key is None:
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=HTTP_POOL_CONNECTIONS,
+                pool_maxsize=HTTP_POOL_MAXSIZE,
+                max_retries=HTTP_MAX_RETRIES,
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+
+            openai.requestssession = session
+
+        self.latencies = LatencyTracker()
+        # number of responses won by each path (see TTTPaths)
+        self.ttt_paths: Counter[str] = Counter()
+        self._ttt_paths_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=TTT_MAX_WORKERS,
+            thread_name_prefix="openai-ttt",
+        )
+
+    @staticmethod
+    def _api_key(config: SystemConfig) -> str:
+        # NOTE passed per request so a reloaded config applies to the shared client
+        if config.openai_key is None:
             raise ValueError("OPENAI_KEY is not set")
 
-        openai.api_key = api_key
+        return config.openai_key
+
+    def ttt(
+        self,
+        messages_input: str | list[dict[str, str]],
+        config: SystemConfig | None = None,
+        priority: Priority = Priority.FOREGROUND,
+    ) -> str | None:
+        """
+        Response of the configured model within config.ttt_deadline seconds, None on
+        errors or once the deadline passed (see ttt_response)
+        """
+        return self.ttt_response(messages_input, config, priority).content
 
     @timeit.PROFILE
-    def ttt(self, messages_input: list[str]):
-        msg = [{"role": "system", "content": messages_input}]
+    def ttt_response(
+        self,
+        messages_input: str | list[dict[str, str]],
+        config: SystemConfig | None = None,
+        priority: Priority = Priority.FOREGROUND,
+    ) -> TTTResponse:
+        """
+        Response of the configured model within config.ttt_deadline seconds, no
+        content on errors or once the deadline passed
+            - hedge: the same request is sent again when the first one is slower than
+              the p95 latency of the model (or right away when it failed)
+            - fallback: the fallback model is raced in when there is less time left
+              than its own p95 latency
+        """
+        config = config or get_config()
+
+        msg = messages_input
+        if isinstance(messages_input, str):
+            msg = [{"role": "system", "content": messages_input}]
+
         logging.debug("Sending msg to GPT: %s"%messages_input)
 
-        try:
-            model = get_conf(OPENAI_TTT_MODEL)
-            logging.debug(f"OPENAI TTT model: {model}")
+        logging.debug(
+            f"OPENAI TTT model: {config.openai_ttt_model} "
+            f"temperature: {config.temperature} "
+            f"frequency_penalty: {config.frequency_penalty} "
+            f"presence_penalty: {config.presence_penalty} "
+            f"deadline: {config.ttt_deadline}",
+        )
+
+        model = config.openai_ttt_model
+        fallback_model = config.openai_ttt_fallback_model
+
+        # (seconds after start, path, model) of the requests that may be raced
+        launches = [
+            (0.0, TTTPaths.PRIMARY, model),
+            (self.latencies.percentile(model), TTTPaths.HEDGE, model),
+        ]
+        if fallback_model != model:
+            launches.append(
+                (
+                    max(
+                        0.0,
+                        config.ttt_deadline - self.latencies.percentile(fallback_model),
+                    ),
+                    TTTPaths.FALLBACK,
+                    fallback_model,
+                ),
+            )
+        launches.sort(key=lambda launch: launch[0])
+
+        start = time.monotonic()
+        deadline = start + config.ttt_deadline
+
+        pending: dict[Future, tuple[TTTPaths, str]] = {}
+        chat_response = None
+        path = TTTPaths.TIMEOUT
+        response_model = None
+
+        while chat_response is None:
+            now = time.monotonic()
+
+            if now >= deadline:
+                break
+
+            # NOTE nothing left in flight (failed), the next request is sent right away
+            while len(launches) > 0 and (
+                start + launches[0][0] <= now or len(pending) == 0
+            ):
+                _, launch_path, launch_model = launches.pop(0)
+
+                logging.debug(f"OPENAI TTT {launch_path.value} request: {launch_model}")
+
+                future = self._executor.submit(
+                    self._chat_completion,
+                    msg,
+                    launch_model,
+                    config,
+                    deadline - now,
+                    priority,
+                )
+                pending[future] = (launch_path, launch_model)
+
+            if len(pending) == 0:
+                path = TTTPaths.ERROR
+                break
+
+            next_launch = start + launches[0][0] if len(launches) > 0 else deadline
+
+            done, _ = wait(
+                pending,
+                timeout=min(next_launch, deadline) - now,
+                return_when=FIRST_COMPLETED,
+            )
+
+            for future in done:
+                launch_path, launch_model = pending.pop(future)
+
+                try:
+                    chat_response = future.result()
 
-            temperature = get_conf(OPENAI_TTT_TEMPERATURE)
-            logging.debug(f"OPENAI TTT temperature: {temperature}")
+                except Exception as e:
+                    logging.error("Error %s" % e)
+                    continue
 
-            frequency_penalty = get_conf(OPENAI_TTT_FREQUENCY_PENALTY)
-            logging.debug(f"OPENAI TTT frequency_penalty: {frequency_penalty}")
+                if chat_response is not None:
+                    path, response_model = launch_path, launch_model
+                    break
 
-            presence_penalty = get_conf(OPENAI_TTT_PRESENCE_PENALTY)
-            logging.debug(f"OPENAI TTT presence_penalty: {presence_penalty}")
+        # NOTE requests still in flight finish in the background, bounded by the
+        # deadline
+        for future in pending:
+            future.cancel()
+
+        with self._ttt_paths_lock:
+            self.ttt_paths[path.value] += 1
+            paths = dict(self.ttt_paths)
+
+        if path == TTTPaths.TIMEOUT:
+            logging.error(f"OPENAI TTT deadline ({config.ttt_deadline}s) exceeded")
+
+        logging.debug(f"OPENAI TTT path: {path.value} {paths}")
+
+        logging.debug(f"chat_response: {chat_response}")
+
+        return TTTResponse(content=chat_response, model=response_model, path=path)
+
+    def _chat_completion(
+        self,
+        msg: list[dict[str, str]],
+        model: str,
+        config: SystemConfig,
+        timeout: float,
+        priority: Priority,
+    ) -> str:
+        if timeout < TTT_MIN_REQUEST_TIMEOUT:
+            raise openai.error.Timeout(f"{timeout:.2f}s left for the {model} request")
+
+        # NOTE queueing for the quota eats into the deadline, not into the latency
+        waited = get_rate_limiter().acquire(
+            "openai",
+            model,
+            tokens=self._estimate_tokens(msg),
+            priority=priority,
+            timeout=timeout - TTT_MIN_REQUEST_TIMEOUT,
+        )
+        timeout = max(timeout - waited, TTT_MIN_REQUEST_TIMEOUT)
+
+        stime = time.monotonic()
+
+        completion = openai.ChatCompletion.create(
+            api_key=self._api_key(config),
+            model=model,
+            temperature=config.temperature,
+            frequency_penalty=config.frequency_penalty,
+            presence_penalty=config.presence_penalty,
+            messages=msg,
+            request_timeout=timeout,
+        )
+
+        self.latencies.record(model, time.monotonic() - stime)
+
+        return completion["choices"][0]["message"]["content"]
+
+    @staticmethod
+    def _estimate_tokens(msg: list[dict[str, str]]) -> int:
+        return TTT_RESPONSE_TOKENS_ESTIMATE + sum(
+            count_tokens(message["content"]) for message in msg
+        )
+
+    def ttt_stream(
+        self,
+        messages_input: str | list[dict[str, str]],
+        config: SystemConfig | None = None,
+    ) -> Iterator[str]:
+        """
+        Yield the response tokens as they are generated (stream=True)
+        """
+        config = config or get_config()
+
+        msg = messages_input
+        if isinstance(messages_input, str):
+            msg = [{"role": "system", "content": messages_input}]
+
+        logging.debug("Streaming msg to GPT: %s" % messages_input)
+
+        try:
+            get_rate_limiter().acquire(
+                "openai",
+                config.openai_ttt_model,
+                tokens=self._estimate_tokens(msg),
+                timeout=config.ttt_deadline,
+            )
 
             completion = openai.ChatCompletion.create(
-                model=model,
-                temperature=temperature,
-                frequency_penalty=frequency_penalty,
-                presence_penalty=presence_penalty,
+                api_key=self._api_key(config),
+                model=config.openai_ttt_model,
+                temperature=config.temperature,
+                frequency_penalty=config.frequency_penalty,
+                presence_penalty=config.presence_penalty,
                 messages=msg,
+                stream=True,
+                request_timeout=config.ttt_deadline,
             )
 
-            chat_response = completion["choices"][0]["message"]["content"]
+            for chunk in completion:
+                token = chunk["choices"][0]["delta"].get("content")
+
+                if token:
+                    yield token
 
         except Exception as e:
             logging.error("Error %s" % e)
 
-        logging.debug(f"chat_response: {chat_response}")
-
-        return chat_response
-
     @timeit.PROFILE
-    def stt(self, mp3_buffer: bytes):
+    def stt(self, mp3_buffer: bytes, config: SystemConfig | None = None):
+        config = config or get_config()
+
         transcription = None
         try:
             logging.debug("Transcription started Whisper-1 online ...")
 
-            model = get_conf(OPENAI_STT_MODEL)
+            model = config.openai_stt_model
 
             logging.debug(f"OPENAI STT model: {model}")
 
+            get_rate_limiter().acquire("openai", model)
+
             with tempfile.NamedTemporaryFile(suffix=".mp3", delete=True) as temp_file:
                 temp_file.write(mp3_buffer)
 
@@ -86,7 +407,11 @@ class OpenAiClient:
 
                 temp_file.seek(0)
 
-                result = openai.Audio.translate(model=model, file=temp_file)
+                result = openai.Audio.translate(
+                    api_key=self._api_key(config),
+                    model=model,
+                    file=temp_file,
+                )
 
             transcription = result["text"]
 
@@ -0,0 +1,170 @@
+import time
+import logging
+import threading
+from enum import Enum
+from src.utils.db import DbConnect, TokenBucket, get_db_connection
+from src.utils.singleton import Singleton
+from src.system_conf import RateLimit, get_config
+
+RATE_LIMIT_KEY_PREFIX = "rate_limit"
+
+# NOTE share of each bucket background calls (summaries, mood...) leave untouched
+# for conversational ones
+BACKGROUND_RESERVE = 0.2
+
+# seconds a call waits for its quota at most
+RATE_LIMIT_MAX_WAIT = 30.0
+
+_RATE_LIMITER: "Singleton[RateLimiter]" = Singleton()
+
+
+class Priority(Enum):
+    FOREGROUND = "foreground"
+    BACKGROUND = "background"
+
+
+# keyed by provider:model, provider:* applies to every model of the provider
+# NOTE overridden per account by rate_limits of the config
+DEFAULT_RATE_LIMITS = {
+    "openai:gpt-3.5-turbo": RateLimit(requests=3500, tokens=90000),
+    "openai:gpt-4": RateLimit(requests=500, tokens=10000),
+    "openai:whisper-1": RateLimit(requests=50),
+    "elevenlabs:*": RateLimit(requests=120),
+    "deepgram:*": RateLimit(requests=60),
+}
+
+
+class RateLimitTimeoutError(Exception):
+    def __init__(self, provider: str, model: str, wait: float):
+        self.provider = provider
+        self.model = model
+        self.message = f"{provider} ({model}) quota not available for {wait:.1f}s"
+        super().__init__(self.message)
+
+
+class RateLimiter:
+
+    """
+    Schedules provider calls within their quotas, shared by every process (companion)
+    of the account through token buckets stored in the db
+        - a requests and a tokens bucket per provider and model, refilled every
+          minute, calls wait until both have enough instead of hitting 429s
+        - foreground (conversational) calls go first, background ones wait while
+          any foreground call of the process is waiting and never dip into the
+          BACKGROUND_RESERVE of a bucket
+    """
+
+    def __init__(
+        self,
+        db: DbConnect | None = None,
+        limits: dict[str, RateLimit] | None = None,
+    ):
+        self.db = db or get_db_connection()
+        self._limits = limits
+        self._foreground_waiting = 0
+        self._condition = threading.Condition()
+
+    @property
+    def limits(self) -> dict[str, RateLimit]:
+        if self._limits is not None:
+            return self._limits
+
+        return {**DEFAULT_RATE_LIMITS, **get_config().rate_limits}
+
+    def limit(self, provider: str, model: str = "*") -> RateLimit | None:
+        limits = self.limits
+
+        return limits.get(f"{provider}:{model}", limits.get(f"{provider}:*"))
+
+    def acquire(
+        self,
+        provider: str,
+        model: str = "*",
+        tokens: float = 0,
+        priority: Priority = Priority.FOREGROUND,
+        timeout: float = RATE_LIMIT_MAX_WAIT,
+        *,
+        requests: int = 1,
+    ) -> float:
+        """
+        Block until the call fits the quota, returns the seconds waited - raises a
+        RateLimitTimeoutError when it would take longer than timeout
+            - requests: 0 charges only the tokens of an already counted request
+              (e.g. the chunks of a stream)
+        """
+        limit = self.limit(provider, model)
+
+        if limit is None:
+            return 0.0
+
+        reserve = BACKGROUND_RESERVE if priority == Priority.BACKGROUND else 0.0
+
+        buckets = []
+        for name, quota, amount in (
+            ("requests", limit.requests, requests),
+            ("tokens", limit.tokens, tokens),
+        ):
+            if quota is None or amount <= 0:
+                continue
+
+            buckets.append(
+                TokenBucket(
+                    key=f"{RATE_LIMIT_KEY_PREFIX}:{provider}:{model}:{name}",
+                    # NOTE more than a bucket holds would never be granted
+                    amount=min(amount, quota * (1 - reserve)),
+                    rate=quota / 60,
+                    capacity=quota,
+                ),
+            )
+
+        if len(buckets) == 0:
+            return 0.0
+
+        start = time.monotonic()
+        deadline = start + timeout
+
+        if priority == Priority.FOREGROUND:
+            with self._condition:
+                self._foreground_waiting += 1
+
+        try:
+            while True:
+                if priority == Priority.BACKGROUND:
+                    with self._condition:
+                        self._condition.wait_for(
+                            lambda: self._foreground_waiting == 0,
+                            timeout=max(0.0, deadline - time.monotonic()),
+                        )
+
+                wait = self.db.take_tokens(buckets, reserve=reserve)
+
+                if wait == 0:
+                    break
+
+                if time.monotonic() + wait > deadline:
+                    raise RateLimitTimeoutError(provider, model, wait)
+
+                time.sleep(wait)
+
+        finally:
+            if priority == Priority.FOREGROUND:
+                with self._condition:
+                    self._foreground_waiting -= 1
+                    self._condition.notify_all()
+
+        waited = time.monotonic() - start
+
+        if waited > 0.01:
+            logging.debug(
+                f"rate limited {provider} ({model}, {priority.value}) "
+                f"for {waited:.2f}s",
+            )
+
+        return waited
+
+
+def get_rate_limiter() -> RateLimiter:
+    """
+    The process wide rate limiter, created on first use
+    """
+    return _RATE_LIMITER.get(RateLimiter)
@@ -0,0 +1,52 @@
+import os
+import logging
+from jinja2 import Template
+from src.agent.base import PROMPT_TEMPLATE_PATH
+from src.utils import timeit
+from src.utils.markdown_loader import precompile_templates, prompt_loader
+
+# NOTE the prompts rendered on every turn
+TURN_TEMPLATES = ["tts_response.md", "ttt_mood_evolver.md"]
+
+TURN_VARIABLES = {
+    "personality_dna": "Description:\nA calm philosopher\n\n" * 4,
+    "mood_dna": [],
+    "mood_instructions": [],
+    "curr_message": "what do you think about the weather today ?",
+    "previous_messages": "\n".join(f"{i + 1}: user: message {i}" for i in range(10)),
+}
+
+
+def _render_uncompiled(file_path: str) -> str:
+    # NOTE how prompt_loader rendered before the template registry
+    with open(file_path) as file:
+        template_content = file.read()
+
+    return Template(template_content).render(**TURN_VARIABLES)
+
+
+def benchmark_prompts():
+    """
+    Per turn cost of rendering the prompts, compiling on every call vs compiled once
+    """
+    logging.basicConfig(level=logging.INFO)
+
+    file_paths = [os.path.join(PROMPT_TEMPLATE_PATH, name) for name in TURN_TEMPLATES]
+
+    precompile_templates(PROMPT_TEMPLATE_PATH)
+
+    timeit.print_c("compiled on every call (per turn):", "HEADER")
+    uncompiled = timeit.nice_timeit(
+        lambda: [_render_uncompiled(file_path) for file_path in file_paths],
+    )
+
+    timeit.print_c("compiled once (per turn):", "HEADER")
+    compiled = timeit.nice_timeit(
+        lambda: [prompt_loader(file_path, TURN_VARIABLES) for file_path in file_paths],
+    )
+
+    timeit.print_c(
+        f"saving per turn: {timeit.format_time(uncompiled.average - compiled.average)}"
+        f" ({uncompiled.average / compiled.average:.1f}x faster)",
+        "OKGREEN",
+    )
@@ -3,7 +3,7 @@ import logging
 import json
 from pydantic import BaseModel
 from src.agent.base import BotAgent, BotPersonalityDna, BotMoodAxiom
-from src.utils.db import RedisConnect
+from src.utils.db import get_db_connection
 from src.utils.markdown_loader import prompt_loader
 
 # from src.system_conf import ENV_DATA
@@ -19,7 +19,7 @@ except ImportError:
     logging.error("upload_env not found")
 
 
-db_connection = RedisConnect()
+db_connection = get_db_connection()
 
 # CURR_DIR = os.getcwd()
 DEFAULT_DATA_PATH = "src/dev_tools/default_data/default_personalities.json"
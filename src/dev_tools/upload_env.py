@@ -1,9 +1,9 @@
 import logging
 from src.system_conf import OPENAI_KEY, ELEVEN_LABS_KEY, ASSEMBLYAI_KEY, ENV_DATA, DEEPGRAM_KEY
-from src.utils.db import RedisConnect
+from src.utils.db import get_db_connection
 
 
-db = RedisConnect()
+db = get_db_connection()
 
 
 def upload_env():
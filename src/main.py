@@ -4,31 +4,56 @@ import pytz
 from datetime import datetime, timedelta
 import typer
 import threading
+from collections.abc import Iterator
 import logging
 from src.personality_conf import PersonalityConfigPrompt
-from src.system_conf import SystemConfigPrompt, ENV_DATA, SPEECH_OFF, WHISPER_MIC, MIC_OFF
-from src.agent.base import BotAgent, BotMemoryUpdateType
+from src.system_conf import (
+    SystemConfigPrompt,
+    ENV_DATA,
+    SPEECH_OFF,
+    WHISPER_MIC,
+    MIC_OFF,
+    DEEPGRAM_EARLY_FINALIZE,
+    load_config,
+    watch_config,
+)
+from src.agent.base import BotAgent, BotMemoryUpdateType, FALLBACK_RESPONSE, PROMPT_TEMPLATE_PATH
 from src.agent.message import RoleTypes
+from src.agent.speculation import SpeculativeResponse
+from src.clients.deepgram import close_deepgram_session
+from src.clients.local_microphone import close_ambient_noise_calibrator
 from src.agent.capability import Capability
 from src.utils import timeit, pretty_console
-from src.utils.db import RedisConnect
+from src.utils.db import get_db_connection
+from src.utils.markdown_loader import precompile_templates
 from src.dev_tools.db_management import create_new_db
 from typing import Annotated
 from queue import Queue
 
 app = typer.Typer()
 
-db = RedisConnect()
+db = get_db_connection()
 
 # TODO test race conditions > in Rust concurrency will be garuanteed
 
 
 class ThreadManager:
-    def __init__(self, agent: BotAgent, debug: bool = False, cold_start: bool = False):
+    def __init__(
+        self,
+        agent: BotAgent,
+        debug: bool = False,
+        cold_start: bool = False,
+        stream: bool = False,
+        speculative: bool = False,
+    ):
         launch_time = datetime.now(pytz.UTC)
         self.agent = agent
         self.debug = debug
         self.cold_start = cold_start
+        self.stream = stream
+        self.speculation = None
+        if speculative is True:
+            self.speculation = SpeculativeResponse(self.agent.speculative_response)
         self.listen_queue = Queue()
         self.response_queue = Queue()
         self.interupt_queue = Queue()
@@ -128,24 +153,35 @@ class ThreadManager:
         
         if self.cold_start:
             logging.debug("Flushing old msges")
-            self.agent.memory.full_message_history = []
+            self.agent.clear_message_history()
             
         elif self.agent.memory.full_message_history == []:
             self.cold_start = True
 
-        context = self.agent.manage_context(msgs='', cold_start=self.cold_start)
+        context = self.agent.manage_context(
+            msgs='',
+            cold_start=self.cold_start,
+            stream=self.stream,
+        )
 
-        self.agent.save_message(context, role=RoleTypes.ASSISTANT)
-        self.agent.speak(response=context)
+        self.respond(context)
 
         time.sleep(0.1)
 
+        on_interim = None
+        if self.speculation is not None:
+            on_interim = self.speculation.propose
+
         while True:
-            msgs = self.agent.listen()
+            msgs = self.agent.listen(on_interim=on_interim)
 
             self.agent.save_message(msgs, role=RoleTypes.USER)
 
-            context = self.agent.manage_context(msgs)
+            context = self.agent.manage_context(
+                msgs,
+                stream=self.stream,
+                speculation=self.speculation,
+            )
 
             if isinstance(context, Capability):
                 logging.info(f"Calling capability: {context.unique_name}")
@@ -153,9 +189,28 @@ class ThreadManager:
                 if context:
                     self.agent.speak(response=context)
 
-            elif isinstance(context, str):
-                self.agent.save_message(context, role=RoleTypes.ASSISTANT)    
-                self.agent.speak(response=context)
+            else:
+                self.respond(context)
+
+    def respond(self, context: str | Iterator[str]):
+        if isinstance(context, str):
+            self.agent.save_message(context, role=RoleTypes.ASSISTANT)
+            self.agent.speak(response=context)
+
+        elif isinstance(context, Iterator):
+            # NOTE spoken as it is generated, saved once the stream finished
+            response = self.agent.speak_stream(response=context)
+
+            if response:
+                self.agent.save_message(response, role=RoleTypes.ASSISTANT)
+
+            else:
+                logging.error("Empty streamed response")
+                self.agent.save_message(FALLBACK_RESPONSE, role=RoleTypes.ASSISTANT)
+                self.agent.speak(response=FALLBACK_RESPONSE)
+
+        else:
+            logging.error(f"Invalid context: {context}")
 
 
 @app.command()
@@ -167,6 +222,26 @@ def main(
     mic_off: bool = typer.Option(False, "--mic-off", help="Toggle mic for debugging"),
     cold_start: bool = typer.Option(False, "--cold-start", help="Toggle cold start to flush old messages"),
     whisper_mic: bool = typer.Option(False, "--whisper-mic", help="Enable this if you face error with deepgram"),
+    stream: bool = typer.Option(
+        False,
+        "--stream",
+        help="Speak responses while they are generated",
+    ),
+    speculative: bool = typer.Option(
+        False,
+        "--speculative",
+        help="Start generating responses from interim transcripts (deepgram)",
+    ),
+    early_finalize: bool = typer.Option(
+        False,
+        "--early-finalize",
+        help="End the utterance on deepgram endpointing instead of UtteranceEnd",
+    ),
+    config_reload: float = typer.Option(
+        0,
+        "--config-reload",
+        help="Reload the system config every N seconds (0 to disable)",
+    ),
     # local_db: bool = False,
     # mock_api: bool = False,
 ):
@@ -211,6 +286,18 @@ def main(
     if mic_off:
         os.environ[MIC_OFF] = "True"
 
+    if early_finalize:
+        os.environ[DEEPGRAM_EARLY_FINALIZE] = "True"
+
+    # NOTE parsed once, an invalid config fails here instead of mid conversation
+    load_config()
+
+    if config_reload > 0:
+        watch_config(config_reload)
+
+    # NOTE compiled ahead so the first turn only pays for rendering
+    precompile_templates(PROMPT_TEMPLATE_PATH)
+
     print("Default bot status:", default_bot)
     if default_bot is True:
         agent = BotAgent.find_agent("Alan Watts")
@@ -220,7 +307,18 @@ def main(
 
     logging.info(f"Initializing agent bot: {agent.unique_name}")
 
-    ThreadManager(agent=agent, debug=debug, cold_start=cold_start).single_thread()
+    try:
+        ThreadManager(
+            agent=agent,
+            debug=debug,
+            cold_start=cold_start,
+            stream=stream,
+            speculative=speculative,
+        ).single_thread()
+
+    finally:
+        close_deepgram_session()
+        close_ambient_noise_calibrator()
 
 
 # if __name__ == "__main__":
@@ -1,13 +1,13 @@
-import os
 import typer
 import logging
 from enum import Enum
 from src.utils.prompt import Prompt, Question, QTypes
 from src.agent.base import BotAgent, BotPersonalityDna, BotMoodAxiom
 from src.agent.io_interface import TTS_CLIENTS, text_to_speech_wss
-from src.utils.db import RedisConnect
+from src.utils.db import get_db_connection
+from src.system_conf import get_config
 
-db_connection = RedisConnect()
+db_connection = get_db_connection()
 
 
 class PersonalityChoice(Enum):
@@ -128,8 +128,10 @@ class PersonalityConfigPrompt(Prompt):
                 continue
 
             # check if voice exists on with client
-            os.environ["TTS_CLIENT"] = TTS_CLIENTS.ELEVENLABS.value
-            status = text_to_speech_wss(text="testing", voice_id=voice)
+            config = get_config().model_copy(
+                update={"tts_client": TTS_CLIENTS.ELEVENLABS.value},
+            )
+            status = text_to_speech_wss(text="testing", voice_id=voice, config=config)
             api_voice_exists = lambda x, status=status: status in (200, 1)
             if not api_voice_exists(voice):
                 typer.secho(
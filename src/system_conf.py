@@ -1,12 +1,23 @@
 import typer
 import os
+import json
+import time
 import logging
+import threading
 from enum import Enum
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    Field,
+    ValidationError,
+    field_validator,
+)
 from src.utils.prompt import Prompt, Question, QTypes
-from src.utils.db import RedisConnect
+from src.utils.db import get_db_connection
+from src.utils.singleton import Singleton
 
 
-db_connection = RedisConnect()
+db_connection = get_db_connection()
 
 # NOTE ALL THESE ARE CONSTANTS TO DIMINISHING STRING ERROR MISTAKES
 
@@ -16,6 +27,8 @@ STT_CLIENT = "STT_CLIENT"
 TTT_CLIENT = "TTT_CLIENT"
 TTS_CLIENT = "TTS_CLIENT"
 DEEPGRAM_KEY = "deepgram_key"
+DEEPGRAM_EARLY_FINALIZE = "deepgram_early_finalize"
+DEEPGRAM_INTERIM_STABLE_SECONDS = "interim_stable_seconds"
 # > CLIENT PARAMS
 
 # >> LOCAL (STT)
@@ -32,6 +45,10 @@ OPENAI_TTT_MODEL = "openai_ttt_model"
 OPENAI_TTT_TEMPERATURE = "temperature"
 OPENAI_TTT_FREQUENCY_PENALTY = "frequency_penalty"
 OPENAI_TTT_PRESENCE_PENALTY = "presence_penalty"
+OPENAI_TTT_FALLBACK_MODEL = "openai_ttt_fallback_model"
+OPENAI_TTT_DEADLINE = "ttt_deadline"
+LLM_CACHE_TTL = "llm_cache_ttl"
+LLM_CACHE_MAX_ENTRIES = "llm_cache_max_entries"
 # OPENAI_TTT_MAX_TOKENS = "max_tokens"
 
 # NOTE handle user keys starts here API_KEY = "api_key"
@@ -44,6 +61,15 @@ OPENAI_STT_MODEL = "openai_stt_model"
 EL_TTS_VOICE_STABILITY = "voice_stability"
 EL_TTS_VOICE_SIMILARITY_BOOST = "voice_similarity_boost"
 
+# > AGENT
+ARCHIVE_DIR = "archive_dir"
+CONTEXT_TOKEN_BUDGET = "context_token_budget"
+SPECULATION_MIN_RATIO = "speculation_min_ratio"
+MOOD_EVOLVER_DEADLINE = "mood_evolver_deadline"
+
+# > RATE LIMITS
+RATE_LIMITS = "rate_limits"
+
 
 # KEYS
 ENV_DATA = "env_data"
@@ -58,8 +84,195 @@ WHISPER_MIC = "whisper_mic"
 MIC_OFF = "mic_off"
 
 
+class RateLimit(BaseModel):
+
+    """
+    Quota per minute of a provider (and model), None for no limit - tokens are the
+    LLM tokens (openai) or the characters (elevenlabs) of the calls
+    """
+
+    requests: float | None = Field(default=None, gt=0)
+    tokens: float | None = Field(default=None, gt=0)
+
+
+class SystemConfig(BaseModel):
+
+    """
+    Typed snapshot of the system configuration - validated once (bad values fail at
+    startup, not mid-conversation) from the env vars set by SystemConfigPrompt and
+    the env_data stored in the db, lookups are then plain attribute reads
+        - immutable, a reload swaps the whole snapshot
+        - fields are aliased by the env var constants above
+    """
+
+    model_config = ConfigDict(frozen=True, populate_by_name=True, extra="ignore")
+
+    # clients
+    stt_client: str = Field(alias=STT_CLIENT)
+    ttt_client: str = Field(alias=TTT_CLIENT)
+    tts_client: str = Field(alias=TTS_CLIENT)
+
+    # local recording (STT)
+    pause_threshold: float = Field(alias=LOCAL_RECORDING_PAUSE_THRESHOLD)
+    non_speaking_duration: float = Field(alias=LOCAL_RECORDING_NON_SPEAKING_DURATION)
+    phrase_threshold: float = Field(alias=LOCAL_RECORDING_PHRASE_THRESHOLD)
+    energy_adjustment_duration: float = Field(
+        alias=LOCAL_RECORDING_ENERGY_ADJUSTMENT_DURATION,
+    )
+    energy_threshold: int = Field(alias=LOCAL_RECORDING_ENERGY_THRESHOLD)
+    dynamic_energy_threshold: bool = Field(
+        alias=LOCAL_RECORDING_DYNAMIC_ENERGY_THRESHOLD,
+    )
+    dynamic_energy_adjustment_damping: float = Field(
+        alias=LOCAL_RECORDING_DYNAMIC_ENERGY_ADJUSTMENT_DAMPING,
+    )
+
+    # openai (TTT / STT)
+    openai_ttt_model: str = Field(alias=OPENAI_TTT_MODEL)
+    temperature: float = Field(alias=OPENAI_TTT_TEMPERATURE)
+    frequency_penalty: float = Field(alias=OPENAI_TTT_FREQUENCY_PENALTY)
+    presence_penalty: float = Field(alias=OPENAI_TTT_PRESENCE_PENALTY)
+    # NOTE faster model raced against the configured one when a response is late
+    openai_ttt_fallback_model: str = Field(
+        default="gpt-3.5-turbo",
+        alias=OPENAI_TTT_FALLBACK_MODEL,
+    )
+    # seconds a response may take at most
+    ttt_deadline: float = Field(default=15.0, gt=0, alias=OPENAI_TTT_DEADLINE)
+    # NOTE responses cached with text_to_text(..., cache=True), see utils/llm_cache.py
+    llm_cache_ttl: float = Field(default=24 * 60 * 60, ge=0, alias=LLM_CACHE_TTL)
+    llm_cache_max_entries: int = Field(default=1000, gt=0, alias=LLM_CACHE_MAX_ENTRIES)
+    openai_stt_model: str = Field(alias=OPENAI_STT_MODEL)
+
+    # elevenlabs (TTS)
+    voice_stability: float = Field(alias=EL_TTS_VOICE_STABILITY)
+    voice_similarity_boost: float = Field(alias=EL_TTS_VOICE_SIMILARITY_BOOST)
+
+    # keys (env_data)
+    openai_key: str | None = Field(default=None, alias=OPENAI_KEY)
+    eleven_labs_key: str | None = Field(default=None, alias=ELEVEN_LABS_KEY)
+    assembly_key: str | None = Field(default=None, alias=ASSEMBLYAI_KEY)
+    deepgram_key: str | None = Field(default=None, alias=DEEPGRAM_KEY)
+
+    # deepgram (STT)
+    # NOTE end the utterance on the endpointing (speech_final) instead of waiting
+    # for UtteranceEnd, faster turns but a pause mid sentence may cut the user off
+    deepgram_early_finalize: bool = Field(default=False, alias=DEEPGRAM_EARLY_FINALIZE)
+    # seconds the interim transcript must stay unchanged to be reported as stable
+    interim_stable_seconds: float = Field(
+        default=0.3,
+        ge=0,
+        alias=DEEPGRAM_INTERIM_STABLE_SECONDS,
+    )
+
+    # agent
+    # NOTE messages older than the hot tail are moved out of the db to segment files
+    archive_dir: str = Field(
+        default_factory=lambda: f"{os.getcwd()}/archive",
+        alias=ARCHIVE_DIR,
+    )
+    # tokens a whole prompt (instructions, personality, history...) is packed into
+    context_token_budget: int = Field(default=3000, gt=0, alias=CONTEXT_TOKEN_BUDGET)
+    # similarity (0-100) the final transcript needs with the speculated one for the
+    # speculative response to be used
+    speculation_min_ratio: int = Field(
+        default=90,
+        ge=0,
+        le=100,
+        alias=SPECULATION_MIN_RATIO,
+    )
+    # seconds the mood evolution of a turn may take, past it the mood is left as is
+    mood_evolver_deadline: float = Field(
+        default=10,
+        gt=0,
+        alias=MOOD_EVOLVER_DEADLINE,
+    )
+
+    # rate limits
+    # NOTE keyed by provider:model (provider:* for every model of the provider), they
+    # override the defaults of clients/rate_limiter.py, set as json in the env, e.g.
+    # rate_limits='{"openai:gpt-4": {"requests": 5000, "tokens": 300000}}'
+    rate_limits: dict[str, RateLimit] = Field(default_factory=dict, alias=RATE_LIMITS)
+
+    # other
+    speech_off: bool = Field(default=False, alias=SPEECH_OFF)
+    whisper_mic: bool = Field(default=False, alias=WHISPER_MIC)
+    mic_off: bool = Field(default=False, alias=MIC_OFF)
+
+    @field_validator("rate_limits", mode="before")
+    @classmethod
+    def _parse_rate_limits(cls, value):
+        if isinstance(value, str):
+            value = json.loads(value or "{}")
+
+        if isinstance(value, dict):
+            for key in value:
+                provider, _, model = key.partition(":")
+
+                if provider == "" or model == "":
+                    raise ValueError(f"rate limit key {key} is not provider:model")
+
+        return value
+
+
+_SYSTEM_CONFIG: Singleton[SystemConfig] = Singleton()
+
+
+def load_config(env_data: dict[str, str] | None = None) -> SystemConfig:
+    """
+    Build the config from the env (overridden by env_data) and make it the current
+    snapshot, raises a ValidationError on missing or invalid values
+    """
+    config = SystemConfig.model_validate({**os.environ, **(env_data or {})})
+
+    # NOTE a single reference swap, readers see the old or the new snapshot
+    _SYSTEM_CONFIG.instance = config
+
+    logging.debug("system config loaded")
+
+    return config
+
+
+def get_config() -> SystemConfig:
+    """
+    Current config snapshot, loaded from the env on first use
+    """
+    return _SYSTEM_CONFIG.get(load_config)
+
+
+def reload_config() -> SystemConfig:
+    """
+    Hot reload of the config (env + db env_data), an invalid config is logged and
+    the current snapshot kept
+    """
+    try:
+        return load_config(db_connection.read(key=ENV_DATA))
+
+    except ValidationError as e:
+        logging.error(f"invalid system config, keeping the current one: {e}")
+
+        return get_config()
+
+
+def watch_config(interval: float) -> threading.Thread:
+    """
+    Reload the config every interval seconds in a daemon thread
+    """
+    def reload_forever():
+        while True:
+            time.sleep(interval)
+            reload_config()
+
+    thread = threading.Thread(target=reload_forever, daemon=True)
+    thread.start()
+
+    return thread
+
+
 def get_conf(var_name: str):
     """
+    NOTE prefer get_config, this parses the env var on every lookup
+
     Get the value of an environment variable with automatic type conversion.
 
     Args:
@@ -120,6 +333,8 @@ class SystemConfigPrompt(Prompt):
         os.environ[OPENAI_TTT_TEMPERATURE] = "0.9"
         os.environ[OPENAI_TTT_FREQUENCY_PENALTY] = "0.2"
         os.environ[OPENAI_TTT_PRESENCE_PENALTY] = "0"
+        os.environ[OPENAI_TTT_FALLBACK_MODEL] = OpenAITTTModels.GPT_3_5_TURBO.value
+        os.environ[OPENAI_TTT_DEADLINE] = "15"
 
         # openai STT
         os.environ[OPENAI_STT_MODEL] = OpenAISTTModels.WHISPER_1.value
@@ -293,6 +508,19 @@ class SystemConfigPrompt(Prompt):
                             message="Presence penalty",
                             default=0,
                         ),
+                        Question(
+                            name=OPENAI_TTT_FALLBACK_MODEL,
+                            qtype=QTypes.SELECT,
+                            message="Fallback model (when a response is late)",
+                            enum_struct=OpenAITTTModels,
+                            default=OpenAITTTModels.GPT_3_5_TURBO,
+                        ),
+                        Question(
+                            name=OPENAI_TTT_DEADLINE,
+                            qtype=QTypes.FLOAT,
+                            message="Response deadline (seconds)",
+                            default=15,
+                        ),
                     ],
                 )
                 self._set_env(openai_ttt_params)
@@ -0,0 +1,173 @@
+import json
+import logging
+from abc import ABC, abstractmethod
+from enum import Enum
+from typing import Any
+
+# NOTE fast codecs are project dependencies, stdlib json is only the fallback for
+# installs without them
+try:
+    import orjson
+
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+
+except ImportError:
+    zstandard = None
+
+
+"""
+Payload layout
+
+    | MAGIC (3 bytes) | VERSION (1 byte) | FLAGS (1 byte) | BODY |
+
+- MAGIC starts with a null byte which never starts a JSON document, so values written
+  before the codec layer (plain JSON) are still read transparently
+- FLAGS low nibble is the codec id, ZSTD_FLAG marks a zstd compressed body
+"""
+
+MAGIC = b"\x00OH"
+VERSION = 1
+HEADER_SIZE = len(MAGIC) + 2
+
+ZSTD_FLAG = 0x10
+CODEC_MASK = 0x0F
+
+# bodies smaller than this are not worth compressing
+DEFAULT_COMPRESS_THRESHOLD = 4096
+
+
+class CodecTypes(Enum):
+    JSON = "json"
+    MSGPACK = "msgpack"
+
+
+class Codec(ABC):
+    codec_id: int
+
+    @abstractmethod
+    def dumps(self, data: Any) -> bytes:
+        raise NotImplementedError
+
+    @abstractmethod
+    def loads(self, body: bytes) -> Any:
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+
+    """
+    orjson when installed (several times faster), stdlib json otherwise - both
+    produce plain JSON so either can read the other's payloads
+    """
+
+    codec_id = 1
+
+    def dumps(self, data: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(data)
+
+        return json.dumps(data).encode("utf-8")
+
+    def loads(self, body: bytes) -> Any:
+        if orjson is not None:
+            return orjson.loads(body)
+
+        return json.loads(body.decode("utf-8"))
+
+
+class MsgpackCodec(Codec):
+    codec_id = 2
+
+    def dumps(self, data: Any) -> bytes:
+        return msgpack.packb(data, use_bin_type=True)
+
+    def loads(self, body: bytes) -> Any:
+        return msgpack.unpackb(body, raw=False)
+
+
+CODECS: dict[int, Codec] = {
+    JsonCodec.codec_id: JsonCodec(),
+    MsgpackCodec.codec_id: MsgpackCodec(),
+}
+
+
+def get_codec(codec_type: CodecTypes) -> Codec:
+    match codec_type:
+        case CodecTypes.JSON:
+            return CODECS[JsonCodec.codec_id]
+
+        case CodecTypes.MSGPACK:
+            if msgpack is None:
+                logging.warning("msgpack not installed, falling back to json codec")
+                return CODECS[JsonCodec.codec_id]
+
+            return CODECS[MsgpackCodec.codec_id]
+
+        case _:
+            raise ValueError(f"Invalid codec type: {codec_type}")
+
+
+def is_encoded(data: bytes) -> bool:
+    return data.startswith(MAGIC)
+
+
+def encode(
+    data: Any,
+    codec_type: CodecTypes = CodecTypes.JSON,
+    compress_threshold: int | None = DEFAULT_COMPRESS_THRESHOLD,
+) -> bytes:
+    codec = get_codec(codec_type)
+
+    body = codec.dumps(data)
+
+    flags = codec.codec_id
+
+    if (
+        zstandard is not None
+        and compress_threshold is not None
+        and len(body) >= compress_threshold
+    ):
+        body = zstandard.ZstdCompressor().compress(body)
+        flags |= ZSTD_FLAG
+
+    return MAGIC + bytes([VERSION, flags]) + body
+
+
+def decode(data: bytes) -> Any:
+    """
+    Decode a payload written by encode, or a legacy plain JSON payload
+    """
+    if not is_encoded(data):
+        return CODECS[JsonCodec.codec_id].loads(data)
+
+    version, flags = data[len(MAGIC)], data[len(MAGIC) + 1]
+
+    if version > VERSION:
+        raise ValueError(f"Unsupported payload version: {version}")
+
+    body = data[HEADER_SIZE:]
+
+    if flags & ZSTD_FLAG:
+        if zstandard is None:
+            raise ValueError(
+                "Payload is zstd compressed but zstandard is not installed",
+            )
+
+        body = zstandard.ZstdDecompressor().decompress(body)
+
+    codec = CODECS.get(flags & CODEC_MASK)
+
+    if codec is None:
+        raise ValueError(f"Unsupported payload codec id: {flags & CODEC_MASK}")
+
+    return codec.loads(body)
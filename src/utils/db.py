@@ -1,9 +1,102 @@
+import os
 import redis
 import logging
-import json
+import threading
 
+from abc import ABC, abstractmethod
+from enum import Enum
 from typing import Any
 from pydantic import BaseModel, ConfigDict
+from src.utils import codec
+
+# NOTE env vars selecting the storage backend (see get_db_connection)
+DB_BACKEND = "db_backend"
+DB_PATH = "db_path"
+
+CURR_DIR = os.getcwd()
+
+# hash field holding the version of versioned writes (see compare_and_set_fields)
+VERSION_FIELD = "version"
+
+# NOTE compare-and-set is done server side so the check and the write are atomic
+COMPARE_AND_SET_FIELDS_LUA = """
+local version = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+if version ~= tonumber(ARGV[2]) then
+    return -1
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+return redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+"""
+
+# NOTE the type check, the swap and the append are one step so a crash (or another
+# migrating process) never sees the key gone nor the items appended twice - ARGV is
+# the number of fields, the field / value pairs then the items
+REPLACE_WITH_FIELDS_LUA = """
+if redis.call('TYPE', KEYS[1]).ok ~= 'string' then
+    return 0
+end
+local fields = tonumber(ARGV[1])
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], unpack(ARGV, 2, 2 * fields + 1))
+if redis.call('LLEN', KEYS[2]) == 0 then
+    for i = 2 * fields + 2, #ARGV do
+        redis.call('RPUSH', KEYS[2], ARGV[i])
+    end
+end
+return 1
+"""
+
+# NOTE refill and take are done server side so concurrent takers never overdraw,
+# same logic as refill_token_buckets - ARGV is the reserve then (amount, rate,
+# capacity) per bucket in KEYS
+TAKE_TOKENS_LUA = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local reserve = tonumber(ARGV[1])
+local tokens = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local amount = tonumber(ARGV[3 * i - 1])
+    local rate = tonumber(ARGV[3 * i])
+    local capacity = tonumber(ARGV[3 * i + 1])
+    local stored = redis.call('HMGET', key, 'tokens', 'ts')
+    local available = capacity
+    if stored[1] then
+        available = math.min(
+            capacity,
+            tonumber(stored[1]) + math.max(0, now - tonumber(stored[2])) * rate
+        )
+    end
+    tokens[i] = available
+    local missing = amount + reserve * capacity - available
+    if missing > 0 then
+        wait = math.max(wait, missing / rate)
+    end
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[3 * i])
+    local capacity = tonumber(ARGV[3 * i + 1])
+    if wait == 0 then
+        tokens[i] = tokens[i] - tonumber(ARGV[3 * i - 1])
+    end
+    redis.call('HSET', key, 'tokens', tostring(tokens[i]), 'ts', tostring(now))
+    redis.call('PEXPIRE', key, math.ceil(capacity / rate * 1000) + 1000)
+end
+return tostring(wait)
+"""
+
+# NOTE one pool per (host, port, db) shared by every RedisConnect of the process
+_CONNECTION_POOLS: dict[tuple[str, int, int], redis.ConnectionPool] = {}
+_CONNECTION_POOLS_LOCK = threading.Lock()
+
+_DB_CONNECTIONS: dict[str, "DbConnect"] = {}
+_DB_CONNECTIONS_LOCK = threading.Lock()
+
+
+class DbBackends(Enum):
+    REDIS = "redis"
+    MEMORY = "memory"
+    SQLITE = "sqlite"
 
 
 def is_bytes_not_parquet(data):
@@ -13,8 +106,368 @@ def is_bytes_not_parquet(data):
     return False
 
 
-class RedisConnect(BaseModel):
+class TokenBucket(BaseModel):
+
+    """
+    amount to take from the bucket stored at key, refilled at rate (per second) up
+    to capacity
+    """
+
+    key: str
+    amount: float
+    rate: float
+    capacity: float
+
+
+def refill_token_buckets(
+    stored: list[tuple[float, float] | None],
+    buckets: list[TokenBucket],
+    reserve: float,
+    now: float,
+) -> tuple[float, list[float]]:
+    """
+    Refill the buckets from their stored (tokens, timestamp), a missing bucket is
+    full - returns the seconds until amount can be taken from all of them (0 when
+    taken) and the tokens left in each
+    """
+    tokens = []
+    wait = 0.0
+
+    for state, bucket in zip(stored, buckets, strict=True):
+        available = bucket.capacity
+        if state is not None:
+            available = min(
+                bucket.capacity,
+                state[0] + max(0.0, now - state[1]) * bucket.rate,
+            )
+
+        tokens.append(available)
+
+        missing = bucket.amount + reserve * bucket.capacity - available
+        if missing > 0:
+            wait = max(wait, missing / bucket.rate)
+
+    if wait == 0:
+        tokens = [t - bucket.amount for t, bucket in zip(tokens, buckets, strict=True)]
+
+    return wait, tokens
+
+
+def get_connection_pool(host: str, port: int, db: int) -> redis.ConnectionPool:
+    with _CONNECTION_POOLS_LOCK:
+        pool = _CONNECTION_POOLS.get((host, port, db))
+
+        if pool is None:
+            logging.debug(f"creating Redis connection pool - {host}:{port}/{db}")
+
+            pool = redis.ConnectionPool(host=host, port=port, db=db)
+            _CONNECTION_POOLS[(host, port, db)] = pool
+
+    return pool
+
+
+def get_db_connection() -> "DbConnect":
+    """
+    Shared connection to the storage backend selected by the DB_BACKEND env var
+        - redis (default)
+        - memory: in-process dicts, hermetic tests and benchmarks
+        - sqlite: single file (DB_PATH) in WAL mode, single-user deployments
+    """
+    backend = DbBackends(os.environ.get(DB_BACKEND, DbBackends.REDIS.value))
+
+    with _DB_CONNECTIONS_LOCK:
+        connection = _DB_CONNECTIONS.get(backend.value)
+
+        if connection is None:
+            logging.debug(f"connecting to {backend.value} db backend")
+
+            match backend:
+                case DbBackends.REDIS:
+                    connection = RedisConnect()
+
+                case DbBackends.MEMORY:
+                    from src.utils.db_memory import MemoryConnect
+
+                    connection = MemoryConnect()
+
+                case DbBackends.SQLITE:
+                    from src.utils.db_sqlite import SQLiteConnect
+
+                    connection = SQLiteConnect(
+                        path=os.environ.get(DB_PATH, f"{CURR_DIR}/openhome.db"),
+                    )
+
+                case _:
+                    raise ValueError(f"Invalid db backend: {backend}")
+
+            _DB_CONNECTIONS[backend.value] = connection
+
+    return connection
+
+
+class DbConnect(BaseModel, ABC):
+
+    """
+    Storage backend interface - the Redis data model (strings, lists, hashes and
+    sorted sets under string keys) every backend implements
+    """
+
     model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    # payloads are written with a versioned header (see utils/codec.py)
+    codec_type: codec.CodecTypes = codec.CodecTypes.JSON
+
+    # zstd compress payloads above this size (in bytes), None disables compression
+    compress_threshold: int | None = codec.DEFAULT_COMPRESS_THRESHOLD
+
+    @property
+    @abstractmethod
+    def all_keys(self) -> list[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def exists_many(self, keys: list[str]) -> list[bool]:
+        """
+        Check many keys in a single round trip
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def key_type(self, key: str) -> str:
+        """
+        Type of the value stored at key (string, list, hash, zset), none when the
+        key does not exist
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def read(self, key: str) -> Any:
+        raise NotImplementedError
+
+    def read_many(self, base_key: str) -> list[Any]:
+        keys = self.scan_keys(f"{base_key}:*")
+
+        logging.debug(f"Reading {len(keys)} keys from db")
+
+        return [data for data in self.read_keys(keys) if data is not None]
+
+    @abstractmethod
+    def scan_keys(self, pattern: str) -> list[str]:
+        """
+        Keys matching the glob-style pattern, without blocking the db
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def read_keys(self, keys: list[str]) -> list[Any]:
+        """
+        Read many keys in a single round trip, missing keys read as None
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def write(self, key: str, data: Any, ttl: float | None = None):
+        """
+        - ttl: seconds after which the db drops the key, backends without a native
+          expiry keep it (callers storing an expiry check it on read)
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_many(self, data: dict[str, Any]):
+        """
+        Write many keys in a single round trip
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_fields(self, key: str, data: dict[str, Any]):
+        """
+        Write (only) the given fields of the hash stored at key, fields not given are
+        left untouched
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def read_fields(self, key: str, fields: list[str] | None = None) -> dict[str, Any]:
+        """
+        Read fields of the hash stored at key, all fields when none are given,
+        missing fields are left out
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def compare_and_set_fields(
+        self,
+        key: str,
+        data: dict[str, Any],
+        version: int,
+    ) -> int | None:
+        """
+        Optimistic concurrency - write the given fields of the hash stored at key only
+        if its VERSION_FIELD still equals version (a missing hash is version 0)
+            - returns the new (incremented) version
+            - returns None when another writer got there first, the caller should
+              re-read, merge and retry
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def replace_with_fields(
+        self,
+        key: str,
+        data: dict[str, Any],
+        list_key: str,
+        items: list[Any],
+    ) -> bool:
+        """
+        Replace the string stored at key with a hash of the given fields and append
+        items to the list at list_key unless it already has some, atomically
+            - returns False (and changes nothing) when key no longer holds a string
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def append(self, key: str, data: Any) -> int:
+        """
+        Append a single item to the list stored at key
+            - O(1) regardless of how long the list already is
+            - returns the new length of the list
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def append_many(self, key: str, data: list[Any]) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def read_range(self, key: str, start: int = 0, end: int = -1) -> list[Any]:
+        """
+        Read items of the list stored at key, both start and end are inclusive
+        and negative indexes count from the tail (LRANGE semantics)
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def read_tail(self, key: str, count: int) -> tuple[int, list[Any]]:
+        """
+        Read the last count items of the list stored at key together with the total
+        length of the list, in a single (atomic) round trip
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def read_tails(self, counts: dict[str, int]) -> dict[str, tuple[int, list[Any]]]:
+        """
+        read_tail of several lists (key: count) at once, atomically - e.g. a list and
+        the index of what was moved out of it
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def length(self, key: str) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def trim(self, key: str, start: int = 0, end: int = -1):
+        """
+        Keep only the items of the list stored at key from start to end, both
+        inclusive and negative indexes count from the tail (LTRIM semantics)
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def append_and_trim(
+        self,
+        key: str,
+        data: Any,
+        trim_key: str,
+        start: int = 0,
+        end: int = -1,
+    ):
+        """
+        append data to the list at key and trim the list at trim_key, atomically
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def take_tokens(self, buckets: list[TokenBucket], reserve: float = 0) -> float:
+        """
+        Take amount from every bucket (hashes of their tokens and refill timestamp),
+        all or none, atomically
+            - reserve: share of each bucket's capacity that must be left once taken
+            - returns 0 when taken, else the seconds until it could be
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_to_index(self, key: str, member: str, score: float = 0):
+        """
+        Add member to the sorted set stored at key, members are unique and ordered by
+        score (then lexicographically)
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def remove_from_index(self, key: str, member: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def read_index(self, key: str) -> list[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def index_length(self, key: str) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def pop_index(self, key: str, count: int = 1) -> list[str]:
+        """
+        Remove and return the count lowest scored members of the sorted set
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def erase_db(self):
+        raise NotImplementedError
+
+    def _encode(self, data: Any) -> str | bytes:
+        if not isinstance(data, str | bytes):
+            data = codec.encode(data, self.codec_type, self.compress_threshold)
+
+        return data
+
+    @staticmethod
+    def _decode(data: Any) -> Any:
+        if isinstance(data, bytes) and is_bytes_not_parquet(data):
+            data = codec.decode(data)
+
+        return data
+
+
+def list_slice(start: int, end: int, length: int) -> slice:
+    """
+    LRANGE (inclusive, negative from the tail) indexes as a python slice
+    """
+    if start < 0:
+        start = max(0, length + start)
+
+    if end < 0:
+        end = length + end
+
+    return slice(start, max(start, end + 1))
+
+
+class RedisConnect(DbConnect):
+
     """
     In-memory > latency with scale
     Key-Value structure optimized
@@ -28,11 +481,23 @@ class RedisConnect(BaseModel):
     db: int = 0
 
     _connection: redis.Redis | None = None
+    _compare_and_set_fields: Any = None
+    _replace_with_fields: Any = None
+    _take_tokens: Any = None
     # _tensor_serializer_context = pa.default_serialization_context()
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._connection = redis.Redis(host=self.host, port=self.port, db=self.db)
+        self._connection = redis.Redis(
+            connection_pool=get_connection_pool(self.host, self.port, self.db),
+        )
+        self._compare_and_set_fields = self._connection.register_script(
+            COMPARE_AND_SET_FIELDS_LUA,
+        )
+        self._replace_with_fields = self._connection.register_script(
+            REPLACE_WITH_FIELDS_LUA,
+        )
+        self._take_tokens = self._connection.register_script(TAKE_TOKENS_LUA)
 
     @property
     def all_keys(self) -> list[str]:
@@ -41,43 +506,263 @@ class RedisConnect(BaseModel):
     def exists(self, key: str) -> bool:
         return self._connection.exists(key)
 
+    def key_type(self, key: str) -> str:
+        """
+        Redis type of the value stored at key (string, list, hash, zset...), none
+        when the key does not exist
+        """
+        return self._connection.type(key).decode("utf-8")
+
+    def exists_many(self, keys: list[str]) -> list[bool]:
+        """
+        Check many keys in a single round trip (pipelined EXISTS)
+        """
+        pipe = self._connection.pipeline(transaction=False)
+        for key in keys:
+            pipe.exists(key)
+
+        return [bool(res) for res in pipe.execute()]
+
     def read(self, key: str) -> Any:
         data = self._connection.get(key)
 
         if data is None:
             logging.error(f"failed to read from Redis - key: {key}")
 
-        if isinstance(data, bytes) and is_bytes_not_parquet(data):
-            data = json.loads(data.decode("utf-8"))
+        return self._decode(data)
 
-        return data
+    def scan_keys(self, pattern: str) -> list[str]:
+        """
+        Incrementally iterate keys matching pattern (SCAN), unlike KEYS this never
+        blocks the server for the whole keyspace
+        """
+        return [k.decode("utf-8") for k in self._connection.scan_iter(match=pattern)]
 
-    def read_many(self, base_key: str) -> list[Any]:
-        keys = self._connection.keys(f"{base_key}:*")
+    def read_keys(self, keys: list[str]) -> list[Any]:
+        """
+        Read many keys in a single round trip (MGET), missing keys read as None
+        """
+        if len(keys) == 0:
+            return []
 
-        logging.debug(f"Reading {len(keys)} keys from Redis")
+        return [self._decode(data) for data in self._connection.mget(keys)]
 
-        results = []
-        for key in keys:
-            result = self.read(key.decode("utf-8"))
-            results.append(result)
-
-        return results
-
-    def write(self, key: str, data: Any):
+    def write(self, key: str, data: Any, ttl: float | None = None):
         # if self.exists(key):
         #     logging.warning(
         #         f"Key '{key}' already exists in Redis. Overriding... (or saving)"
         #     )
 
-        if not isinstance(data, str | bytes):
-            data = json.dumps(data)
+        px = max(1, int(ttl * 1000)) if ttl is not None else None
 
-        res = self._connection.set(key, data)
+        res = self._connection.set(key, self._encode(data), px=px)
 
         if res == 0:
             logging.error(f"failed to write to Redis - key: {key}")
 
+    def write_many(self, data: dict[str, Any]):
+        """
+        Write many keys in a single round trip (MSET)
+        """
+        if len(data) == 0:
+            return
+
+        res = self._connection.mset({k: self._encode(v) for k, v in data.items()})
+
+        if not res:
+            logging.error(f"failed to write to Redis - keys: {list(data.keys())}")
+
+    def write_fields(self, key: str, data: dict[str, Any]):
+        """
+        Write (only) the given fields of the hash stored at key (HSET), fields not
+        given are left untouched
+        """
+        if len(data) == 0:
+            return
+
+        self._connection.hset(
+            key,
+            mapping={field: self._encode(v) for field, v in data.items()},
+        )
+
+    def read_fields(self, key: str, fields: list[str] | None = None) -> dict[str, Any]:
+        """
+        Read fields of the hash stored at key, all fields when none are given
+        (HMGET / HGETALL), missing fields are left out
+        """
+        if fields is None:
+            data = {
+                field.decode("utf-8"): v
+                for field, v in self._connection.hgetall(key).items()
+            }
+
+        else:
+            data = dict(zip(fields, self._connection.hmget(key, fields), strict=True))
+
+        return {field: self._decode(v) for field, v in data.items() if v is not None}
+
+    def compare_and_set_fields(
+        self,
+        key: str,
+        data: dict[str, Any],
+        version: int,
+    ) -> int | None:
+        """
+        Optimistic concurrency - write the given fields of the hash stored at key only
+        if its VERSION_FIELD still equals version (a missing hash is version 0)
+            - returns the new (incremented) version
+            - returns None when another writer got there first, the caller should
+              re-read, merge and retry
+        """
+        args = [VERSION_FIELD, version]
+        for field, v in data.items():
+            args += [field, self._encode(v)]
+
+        new_version = self._compare_and_set_fields(keys=[key], args=args)
+
+        if new_version == -1:
+            logging.debug(f"version conflict writing to Redis - key: {key}")
+            return None
+
+        return new_version
+
+    def replace_with_fields(
+        self,
+        key: str,
+        data: dict[str, Any],
+        list_key: str,
+        items: list[Any],
+    ) -> bool:
+        args = [len(data)]
+        for field, v in data.items():
+            args += [field, self._encode(v)]
+
+        args += [self._encode(item) for item in items]
+
+        return self._replace_with_fields(keys=[key, list_key], args=args) == 1
+
+    def append(self, key: str, data: Any) -> int:
+        """
+        Append a single item to the list stored at key (RPUSH)
+            - O(1) regardless of how long the list already is
+            - returns the new length of the list
+        """
+        return self._connection.rpush(key, self._encode(data))
+
+    def append_many(self, key: str, data: list[Any]) -> int:
+        if len(data) == 0:
+            return self.length(key)
+
+        return self._connection.rpush(key, *[self._encode(d) for d in data])
+
+    def read_range(self, key: str, start: int = 0, end: int = -1) -> list[Any]:
+        """
+        Read items of the list stored at key, both start and end are inclusive
+        and negative indexes count from the tail (LRANGE semantics)
+        """
+        return [self._decode(d) for d in self._connection.lrange(key, start, end)]
+
+    def read_tail(self, key: str, count: int) -> tuple[int, list[Any]]:
+        """
+        Read the last count items of the list stored at key together with the total
+        length of the list, in a single (atomic) round trip
+        """
+        if count <= 0:
+            return self.length(key), []
+
+        pipe = self._connection.pipeline(transaction=True)
+        pipe.llen(key)
+        pipe.lrange(key, -count, -1)
+        length, items = pipe.execute()
+
+        return length, [self._decode(d) for d in items]
+
+    def read_tails(self, counts: dict[str, int]) -> dict[str, tuple[int, list[Any]]]:
+        """
+        read_tail of several lists in a single MULTI
+        """
+        pipe = self._connection.pipeline(transaction=True)
+        for key, count in counts.items():
+            pipe.llen(key)
+
+            # NOTE LRANGE key -0 -1 would be the whole list
+            if count > 0:
+                pipe.lrange(key, -count, -1)
+            else:
+                pipe.lrange(key, 1, 0)
+
+        results = pipe.execute()
+
+        return {
+            key: (length, [self._decode(d) for d in items])
+            for key, length, items in zip(
+                counts,
+                results[::2],
+                results[1::2],
+                strict=True,
+            )
+        }
+
+    def length(self, key: str) -> int:
+        return self._connection.llen(key)
+
+    def trim(self, key: str, start: int = 0, end: int = -1):
+        self._connection.ltrim(key, start, end)
+
+    def append_and_trim(
+        self,
+        key: str,
+        data: Any,
+        trim_key: str,
+        start: int = 0,
+        end: int = -1,
+    ):
+        pipe = self._connection.pipeline(transaction=True)
+        pipe.rpush(key, self._encode(data))
+        pipe.ltrim(trim_key, start, end)
+        pipe.execute()
+
+    def take_tokens(self, buckets: list[TokenBucket], reserve: float = 0) -> float:
+        """
+        Token buckets refilled and taken from server side (Lua, Redis clock) so every
+        process shares them, idle buckets expire once they would be full anyway
+        """
+        if len(buckets) == 0:
+            return 0.0
+
+        args = [reserve]
+        for bucket in buckets:
+            args += [bucket.amount, bucket.rate, bucket.capacity]
+
+        return float(
+            self._take_tokens(keys=[bucket.key for bucket in buckets], args=args),
+        )
+
+    def add_to_index(self, key: str, member: str, score: float = 0):
+        """
+        Add member to the sorted set stored at key (ZADD), members are unique and
+        ordered by score
+        """
+        self._connection.zadd(key, {member: score})
+
+    def remove_from_index(self, key: str, member: str):
+        res = self._connection.zrem(key, member)
+
+        if res == 0:
+            logging.error(f"failed to remove from Redis index - key: {key} {member}")
+
+    def read_index(self, key: str) -> list[str]:
+        return [m.decode("utf-8") for m in self._connection.zrange(key, 0, -1)]
+
+    def index_length(self, key: str) -> int:
+        return self._connection.zcard(key)
+
+    def pop_index(self, key: str, count: int = 1) -> list[str]:
+        return [
+            member.decode("utf-8")
+            for member, _ in self._connection.zpopmin(key, count)
+        ]
+
     def delete(self, key: str):
         res = self._connection.delete(key)
 
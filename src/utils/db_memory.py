@@ -0,0 +1,280 @@
+import time
+import fnmatch
+import logging
+import threading
+from typing import Any
+from pydantic import PrivateAttr
+from src.utils.db import (
+    DbConnect,
+    TokenBucket,
+    VERSION_FIELD,
+    list_slice,
+    refill_token_buckets,
+)
+
+
+class MemoryConnect(DbConnect):
+
+    """
+    In-process backend - plain dicts behind a lock, nothing survives the process
+        - hermetic tests and benchmarks (no Redis needed)
+        - values are stored encoded so reads never alias written objects
+    """
+
+    _strings: dict[str, bytes] = PrivateAttr(default_factory=dict)
+    _lists: dict[str, list[bytes]] = PrivateAttr(default_factory=dict)
+    _hashes: dict[str, dict[str, bytes]] = PrivateAttr(default_factory=dict)
+    _zsets: dict[str, dict[str, float]] = PrivateAttr(default_factory=dict)
+    _lock: Any = PrivateAttr(default_factory=threading.RLock)
+
+    @property
+    def all_keys(self) -> list[str]:
+        with self._lock:
+            return [
+                *self._strings.keys(),
+                *self._lists.keys(),
+                *self._hashes.keys(),
+                *self._zsets.keys(),
+            ]
+
+    def exists(self, key: str) -> bool:
+        return self.key_type(key) != "none"
+
+    def exists_many(self, keys: list[str]) -> list[bool]:
+        return [self.exists(key) for key in keys]
+
+    def key_type(self, key: str) -> str:
+        with self._lock:
+            for key_type, store in (
+                ("string", self._strings),
+                ("list", self._lists),
+                ("hash", self._hashes),
+                ("zset", self._zsets),
+            ):
+                if key in store:
+                    return key_type
+
+        return "none"
+
+    def read(self, key: str) -> Any:
+        data = self._strings.get(key)
+
+        if data is None:
+            logging.error(f"failed to read from memory db - key: {key}")
+
+        return self._decode(data)
+
+    def scan_keys(self, pattern: str) -> list[str]:
+        return [key for key in self.all_keys if fnmatch.fnmatchcase(key, pattern)]
+
+    def read_keys(self, keys: list[str]) -> list[Any]:
+        with self._lock:
+            return [self._decode(self._strings.get(key)) for key in keys]
+
+    def write(self, key: str, data: Any, ttl: float | None = None):
+        # NOTE no native expiry, ttl is ignored
+        self.write_many({key: data})
+
+    def write_many(self, data: dict[str, Any]):
+        encoded = {key: self._to_bytes(v) for key, v in data.items()}
+
+        with self._lock:
+            for key in encoded:
+                self._delete(key)
+
+            self._strings.update(encoded)
+
+    def write_fields(self, key: str, data: dict[str, Any]):
+        encoded = {field: self._to_bytes(v) for field, v in data.items()}
+
+        with self._lock:
+            self._hashes.setdefault(key, {}).update(encoded)
+
+    def read_fields(self, key: str, fields: list[str] | None = None) -> dict[str, Any]:
+        with self._lock:
+            stored = dict(self._hashes.get(key, {}))
+
+        if fields is not None:
+            stored = {field: stored[field] for field in fields if field in stored}
+
+        return {field: self._decode(v) for field, v in stored.items()}
+
+    def compare_and_set_fields(
+        self,
+        key: str,
+        data: dict[str, Any],
+        version: int,
+    ) -> int | None:
+        encoded = {field: self._to_bytes(v) for field, v in data.items()}
+
+        with self._lock:
+            stored = self._hashes.setdefault(key, {})
+
+            if int(stored.get(VERSION_FIELD, b"0")) != version:
+                logging.debug(f"version conflict writing to memory db - key: {key}")
+                return None
+
+            stored.update(encoded)
+            stored[VERSION_FIELD] = str(version + 1).encode("utf-8")
+
+        return version + 1
+
+    def replace_with_fields(
+        self,
+        key: str,
+        data: dict[str, Any],
+        list_key: str,
+        items: list[Any],
+    ) -> bool:
+        encoded = {field: self._to_bytes(v) for field, v in data.items()}
+
+        with self._lock:
+            if key not in self._strings:
+                return False
+
+            self._delete(key)
+            self._hashes[key] = encoded
+
+            if len(items) > 0 and len(self._lists.get(list_key, [])) == 0:
+                self.append_many(list_key, items)
+
+        return True
+
+    def append(self, key: str, data: Any) -> int:
+        return self.append_many(key, [data])
+
+    def append_many(self, key: str, data: list[Any]) -> int:
+        encoded = [self._to_bytes(d) for d in data]
+
+        with self._lock:
+            items = self._lists.setdefault(key, [])
+            items.extend(encoded)
+
+            return len(items)
+
+    def read_range(self, key: str, start: int = 0, end: int = -1) -> list[Any]:
+        with self._lock:
+            items = self._lists.get(key, [])
+            items = items[list_slice(start, end, len(items))]
+
+        return [self._decode(d) for d in items]
+
+    def read_tail(self, key: str, count: int) -> tuple[int, list[Any]]:
+        with self._lock:
+            items = self._lists.get(key, [])
+            length, items = len(items), items[max(0, len(items) - count) :]
+
+        return length, [self._decode(d) for d in items]
+
+    def read_tails(self, counts: dict[str, int]) -> dict[str, tuple[int, list[Any]]]:
+        with self._lock:
+            return {key: self.read_tail(key, count) for key, count in counts.items()}
+
+    def length(self, key: str) -> int:
+        return len(self._lists.get(key, []))
+
+    def trim(self, key: str, start: int = 0, end: int = -1):
+        with self._lock:
+            items = self._lists.get(key, [])
+            items = items[list_slice(start, end, len(items))]
+
+            if len(items) == 0:
+                self._lists.pop(key, None)
+
+            elif key in self._lists:
+                self._lists[key] = items
+
+    def append_and_trim(
+        self,
+        key: str,
+        data: Any,
+        trim_key: str,
+        start: int = 0,
+        end: int = -1,
+    ):
+        with self._lock:
+            self.append(key, data)
+            self.trim(trim_key, start, end)
+
+    def take_tokens(self, buckets: list[TokenBucket], reserve: float = 0) -> float:
+        with self._lock:
+            stored = []
+            for bucket in buckets:
+                state = self._hashes.get(bucket.key)
+
+                if state is None:
+                    stored.append(None)
+
+                else:
+                    stored.append((float(state["tokens"]), float(state["ts"])))
+
+            now = time.time()
+            wait, tokens = refill_token_buckets(stored, buckets, reserve, now)
+
+            for bucket, bucket_tokens in zip(buckets, tokens, strict=True):
+                self._hashes[bucket.key] = {
+                    "tokens": str(bucket_tokens).encode("utf-8"),
+                    "ts": str(now).encode("utf-8"),
+                }
+
+        return wait
+
+    def add_to_index(self, key: str, member: str, score: float = 0):
+        with self._lock:
+            self._zsets.setdefault(key, {})[member] = score
+
+    def remove_from_index(self, key: str, member: str):
+        with self._lock:
+            members = self._zsets.get(key, {})
+
+            if members.pop(member, None) is None:
+                logging.error(f"failed to remove from memory index - {key} {member}")
+
+            if len(members) == 0:
+                self._zsets.pop(key, None)
+
+    def read_index(self, key: str) -> list[str]:
+        with self._lock:
+            members = dict(self._zsets.get(key, {}))
+
+        return sorted(members, key=lambda member: (members[member], member))
+
+    def index_length(self, key: str) -> int:
+        with self._lock:
+            return len(self._zsets.get(key, {}))
+
+    def pop_index(self, key: str, count: int = 1) -> list[str]:
+        with self._lock:
+            members = self.read_index(key)[:count]
+
+            for member in members:
+                self.remove_from_index(key, member)
+
+        return members
+
+    def delete(self, key: str):
+        with self._lock:
+            if not self._delete(key):
+                logging.error(f"failed to delete from memory db - key: {key}")
+
+    def erase_db(self):
+        with self._lock:
+            for store in (self._strings, self._lists, self._hashes, self._zsets):
+                store.clear()
+
+        logging.info("Entire memory database erased successfully.")
+
+    def _delete(self, key: str) -> bool:
+        deleted = False
+        for store in (self._strings, self._lists, self._hashes, self._zsets):
+            deleted = store.pop(key, None) is not None or deleted
+
+        return deleted
+
+    def _to_bytes(self, data: Any) -> bytes:
+        data = self._encode(data)
+
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+
+        return data
@@ -0,0 +1,408 @@
+import time
+import fnmatch
+import logging
+import sqlite3
+import threading
+from typing import Any
+from src.utils.db import (
+    DbConnect,
+    TokenBucket,
+    VERSION_FIELD,
+    list_slice,
+    refill_token_buckets,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS strings (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lists (
+    key TEXT NOT NULL,
+    idx INTEGER PRIMARY KEY AUTOINCREMENT,
+    value BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lists_key_idx ON lists (key, idx);
+CREATE TABLE IF NOT EXISTS hashes (
+    key TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value BLOB NOT NULL,
+    PRIMARY KEY (key, field)
+);
+CREATE TABLE IF NOT EXISTS zsets (
+    key TEXT NOT NULL,
+    member TEXT NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (key, member)
+);
+"""
+
+TABLES = {
+    "string": "strings",
+    "list": "lists",
+    "hash": "hashes",
+    "zset": "zsets",
+}
+
+
+class SQLiteConnect(DbConnect):
+
+    """
+    Single file backend for single-user deployments, skips the Redis hop entirely
+        - WAL mode with synchronous=NORMAL, commits are appended to the WAL without
+          an fsync (synced at checkpoints)
+        - one connection shared across threads behind a lock, reads and writes of
+          the process are serialized (WAL only lets other processes read while
+          this one writes)
+    """
+
+    path: str
+
+    _connection: sqlite3.Connection | None = None
+    _lock: Any = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+
+    @property
+    def all_keys(self) -> list[str]:
+        with self._lock:
+            return [
+                key
+                for table in TABLES.values()
+                for (key,) in self._connection.execute(
+                    f"SELECT DISTINCT key FROM {table}",
+                )
+            ]
+
+    def exists(self, key: str) -> bool:
+        return self.key_type(key) != "none"
+
+    def exists_many(self, keys: list[str]) -> list[bool]:
+        with self._lock:
+            return [self.exists(key) for key in keys]
+
+    def key_type(self, key: str) -> str:
+        with self._lock:
+            for key_type, table in TABLES.items():
+                row = self._connection.execute(
+                    f"SELECT 1 FROM {table} WHERE key = ? LIMIT 1",
+                    (key,),
+                ).fetchone()
+
+                if row is not None:
+                    return key_type
+
+        return "none"
+
+    def read(self, key: str) -> Any:
+        data = self.read_keys([key])[0]
+
+        if data is None:
+            logging.error(f"failed to read from SQLite - key: {key}")
+
+        return data
+
+    def scan_keys(self, pattern: str) -> list[str]:
+        return [key for key in self.all_keys if fnmatch.fnmatchcase(key, pattern)]
+
+    def read_keys(self, keys: list[str]) -> list[Any]:
+        if len(keys) == 0:
+            return []
+
+        with self._lock:
+            rows = dict(
+                self._connection.execute(
+                    "SELECT key, value FROM strings WHERE key IN "
+                    f"({', '.join('?' * len(keys))})",
+                    keys,
+                ).fetchall(),
+            )
+
+        return [self._decode(rows.get(key)) for key in keys]
+
+    def write(self, key: str, data: Any, ttl: float | None = None):
+        # NOTE no native expiry, ttl is ignored
+        self.write_many({key: data})
+
+    def write_many(self, data: dict[str, Any]):
+        encoded = [(key, self._to_bytes(v)) for key, v in data.items()]
+
+        with self._lock, self._transaction():
+            for key, _ in encoded:
+                self._delete(key)
+
+            self._connection.executemany(
+                "INSERT INTO strings (key, value) VALUES (?, ?)",
+                encoded,
+            )
+
+    def write_fields(self, key: str, data: dict[str, Any]):
+        encoded = [(key, field, self._to_bytes(v)) for field, v in data.items()]
+
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO hashes (key, field, value) VALUES (?, ?, ?)",
+                encoded,
+            )
+
+    def read_fields(self, key: str, fields: list[str] | None = None) -> dict[str, Any]:
+        with self._lock:
+            stored = dict(
+                self._connection.execute(
+                    "SELECT field, value FROM hashes WHERE key = ?",
+                    (key,),
+                ).fetchall(),
+            )
+
+        if fields is not None:
+            stored = {field: stored[field] for field in fields if field in stored}
+
+        return {field: self._decode(v) for field, v in stored.items()}
+
+    def compare_and_set_fields(
+        self,
+        key: str,
+        data: dict[str, Any],
+        version: int,
+    ) -> int | None:
+        encoded = [(key, field, self._to_bytes(v)) for field, v in data.items()]
+        encoded.append((key, VERSION_FIELD, str(version + 1).encode("utf-8")))
+
+        with self._lock, self._transaction():
+            row = self._connection.execute(
+                "SELECT value FROM hashes WHERE key = ? AND field = ?",
+                (key, VERSION_FIELD),
+            ).fetchone()
+
+            if int(row[0] if row is not None else b"0") != version:
+                logging.debug(f"version conflict writing to SQLite - key: {key}")
+                return None
+
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO hashes (key, field, value) VALUES (?, ?, ?)",
+                encoded,
+            )
+
+        return version + 1
+
+    def replace_with_fields(
+        self,
+        key: str,
+        data: dict[str, Any],
+        list_key: str,
+        items: list[Any],
+    ) -> bool:
+        encoded = [(key, field, self._to_bytes(v)) for field, v in data.items()]
+
+        with self._lock, self._transaction():
+            if self.key_type(key) != "string":
+                return False
+
+            self._delete(key)
+
+            self._connection.executemany(
+                "INSERT INTO hashes (key, field, value) VALUES (?, ?, ?)",
+                encoded,
+            )
+
+            if self.length(list_key) == 0:
+                self._append_many(list_key, items)
+
+        return True
+
+    def append(self, key: str, data: Any) -> int:
+        return self.append_many(key, [data])
+
+    def append_many(self, key: str, data: list[Any]) -> int:
+        with self._lock, self._transaction():
+            self._append_many(key, data)
+
+            return self.length(key)
+
+    def read_range(self, key: str, start: int = 0, end: int = -1) -> list[Any]:
+        with self._lock:
+            items = list_slice(start, end, self.length(key))
+
+            rows = self._connection.execute(
+                "SELECT value FROM lists WHERE key = ? ORDER BY idx LIMIT ? OFFSET ?",
+                (key, items.stop - items.start, items.start),
+            ).fetchall()
+
+        return [self._decode(value) for (value,) in rows]
+
+    def read_tail(self, key: str, count: int) -> tuple[int, list[Any]]:
+        with self._lock:
+            length = self.length(key)
+
+            items = self.read_range(key, -count, -1) if count > 0 else []
+
+        return length, items
+
+    def read_tails(self, counts: dict[str, int]) -> dict[str, tuple[int, list[Any]]]:
+        with self._lock, self._transaction():
+            return {key: self.read_tail(key, count) for key, count in counts.items()}
+
+    def length(self, key: str) -> int:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM lists WHERE key = ?",
+                (key,),
+            ).fetchone()[0]
+
+    def trim(self, key: str, start: int = 0, end: int = -1):
+        with self._lock, self._transaction():
+            self._trim(key, start, end)
+
+    def append_and_trim(
+        self,
+        key: str,
+        data: Any,
+        trim_key: str,
+        start: int = 0,
+        end: int = -1,
+    ):
+        with self._lock, self._transaction():
+            self._append_many(key, [data])
+            self._trim(trim_key, start, end)
+
+    def take_tokens(self, buckets: list[TokenBucket], reserve: float = 0) -> float:
+        with self._lock, self._transaction():
+            stored = []
+            for bucket in buckets:
+                state = dict(
+                    self._connection.execute(
+                        "SELECT field, value FROM hashes WHERE key = ?",
+                        (bucket.key,),
+                    ).fetchall(),
+                )
+                stored.append(
+                    (float(state["tokens"]), float(state["ts"])) if state else None,
+                )
+
+            now = time.time()
+            wait, tokens = refill_token_buckets(stored, buckets, reserve, now)
+
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO hashes (key, field, value) VALUES (?, ?, ?)",
+                [
+                    (bucket.key, field, str(value).encode("utf-8"))
+                    for bucket, bucket_tokens in zip(buckets, tokens, strict=True)
+                    for field, value in (("tokens", bucket_tokens), ("ts", now))
+                ],
+            )
+
+        return wait
+
+    def add_to_index(self, key: str, member: str, score: float = 0):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO zsets (key, member, score) VALUES (?, ?, ?)",
+                (key, member, score),
+            )
+
+    def remove_from_index(self, key: str, member: str):
+        with self._lock:
+            res = self._connection.execute(
+                "DELETE FROM zsets WHERE key = ? AND member = ?",
+                (key, member),
+            )
+
+        if res.rowcount == 0:
+            logging.error(f"failed to remove from SQLite index - key: {key} {member}")
+
+    def read_index(self, key: str) -> list[str]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT member FROM zsets WHERE key = ? ORDER BY score, member",
+                (key,),
+            ).fetchall()
+
+        return [member for (member,) in rows]
+
+    def index_length(self, key: str) -> int:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM zsets WHERE key = ?",
+                (key,),
+            ).fetchone()[0]
+
+    def pop_index(self, key: str, count: int = 1) -> list[str]:
+        with self._lock, self._transaction():
+            rows = self._connection.execute(
+                "SELECT member FROM zsets WHERE key = ? "
+                "ORDER BY score, member LIMIT ?",
+                (key, count),
+            ).fetchall()
+
+            self._connection.executemany(
+                "DELETE FROM zsets WHERE key = ? AND member = ?",
+                [(key, member) for (member,) in rows],
+            )
+
+        return [member for (member,) in rows]
+
+    def delete(self, key: str):
+        with self._lock, self._transaction():
+            if not self._delete(key):
+                logging.error(f"failed to delete from SQLite - key: {key}")
+
+    def erase_db(self):
+        try:
+            with self._lock, self._transaction():
+                for table in TABLES.values():
+                    self._connection.execute(f"DELETE FROM {table}")
+
+            logging.info("Entire SQLite database erased successfully.")
+
+        except Exception as e:
+            logging.error(f"Failed to erase SQLite database: {e}")
+
+    def _transaction(self):
+        # NOTE sqlite3 connections commit on success and roll back on error
+        self._connection.execute("BEGIN IMMEDIATE")
+        return self._connection
+
+    def _append_many(self, key: str, data: list[Any]):
+        # NOTE called within a transaction
+        self._connection.executemany(
+            "INSERT INTO lists (key, value) VALUES (?, ?)",
+            [(key, self._to_bytes(d)) for d in data],
+        )
+
+    def _trim(self, key: str, start: int, end: int):
+        # NOTE called within a transaction
+        items = list_slice(start, end, self.length(key))
+
+        self._connection.execute(
+            "DELETE FROM lists WHERE key = ? AND idx NOT IN "
+            "(SELECT idx FROM lists WHERE key = ? ORDER BY idx LIMIT ? OFFSET ?)",
+            (key, key, items.stop - items.start, items.start),
+        )
+
+    def _delete(self, key: str) -> bool:
+        deleted = 0
+        for table in TABLES.values():
+            deleted += self._connection.execute(
+                f"DELETE FROM {table} WHERE key = ?",
+                (key,),
+            ).rowcount
+
+        return deleted > 0
+
+    def _to_bytes(self, data: Any) -> bytes:
+        data = self._encode(data)
+
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+
+        return data
@@ -0,0 +1,179 @@
+import json
+import time
+import hashlib
+import logging
+import threading
+from pydantic import BaseModel
+from src.system_conf import SystemConfig, get_config
+from src.utils.db import DbConnect, get_db_connection
+from src.utils.singleton import Singleton
+
+# NOTE opt-in per call site (text_to_text(..., cache=True)), only for prompts whose
+# response can be reused as is (e.g. the cold start greeting of a personality)
+LLM_CACHE_KEY_PREFIX = "llm_cache"
+# sorted set of the cached keys scored by last access time (LRU order)
+LLM_CACHE_INDEX_KEY = "llm_cache_index"
+
+_RESPONSE_CACHE: "Singleton[ResponseCache]" = Singleton()
+
+
+class CacheStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    expired: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+
+        return self.hits / lookups if lookups > 0 else 0.0
+
+
+def normalize_messages(
+    messages_input: str | list[dict[str, str]],
+) -> list[dict[str, str]]:
+    """
+    Messages as sent to the model with whitespace collapsed, prompts only differing
+    by indentation or blank lines share a cache entry
+    """
+    if isinstance(messages_input, str):
+        messages_input = [{"role": "system", "content": messages_input}]
+
+    return [
+        {"role": msg["role"], "content": " ".join(msg["content"].split())}
+        for msg in messages_input
+    ]
+
+
+def cache_key(
+    messages_input: str | list[dict[str, str]],
+    config: SystemConfig,
+    model: str | None = None,
+) -> str:
+    """
+    Hash of everything the response depends on - client, model, sampling params and
+    the (normalized) prompt
+        - model: the one that produced the response (e.g. the fallback one), the
+          configured one by default
+    """
+    payload = json.dumps(
+        {
+            "client": config.ttt_client,
+            "model": model or config.openai_ttt_model,
+            "temperature": config.temperature,
+            "frequency_penalty": config.frequency_penalty,
+            "presence_penalty": config.presence_penalty,
+            "messages": normalize_messages(messages_input),
+        },
+        sort_keys=True,
+    )
+
+    digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    return f"{LLM_CACHE_KEY_PREFIX}:{digest}"
+
+
+class ResponseCache:
+
+    """
+    LLM responses stored in the db
+        - entries expire ttl seconds after being written, checked on read so it
+          works the same on every db backend, redis also drops the expired entry
+        - least recently used entries are evicted past max_entries
+        - ttl and max_entries follow the config (llm_cache_ttl,
+          llm_cache_max_entries) unless given
+        - hit / miss metrics of the process
+    """
+
+    def __init__(
+        self,
+        db: DbConnect | None = None,
+        ttl: float | None = None,
+        max_entries: int | None = None,
+    ):
+        self.db = db or get_db_connection()
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+
+    @property
+    def ttl(self) -> float:
+        return get_config().llm_cache_ttl if self._ttl is None else self._ttl
+
+    @property
+    def max_entries(self) -> int:
+        if self._max_entries is None:
+            return get_config().llm_cache_max_entries
+
+        return self._max_entries
+
+    def get(self, key: str) -> str | None:
+        entry = self.db.read_keys([key])[0]
+
+        if isinstance(entry, dict) and entry.get("expires_at", 0) <= time.time():
+            logging.debug(f"llm cache entry expired: {key}")
+            self._remove(key)
+            self._count("expired")
+            entry = None
+
+        if not isinstance(entry, dict):
+            self._count("misses")
+            return None
+
+        self.db.add_to_index(LLM_CACHE_INDEX_KEY, key, score=time.time())
+        self._count("hits")
+
+        return entry["response"]
+
+    def set(self, key: str, response: str):
+        now = time.time()
+
+        ttl = self.ttl
+
+        self.db.write(key, {"response": response, "expires_at": now + ttl}, ttl=ttl)
+        self.db.add_to_index(LLM_CACHE_INDEX_KEY, key, score=now)
+
+        self._evict()
+
+    def clear(self):
+        for key in self.db.read_index(LLM_CACHE_INDEX_KEY):
+            self._remove(key)
+
+    def _evict(self):
+        excess = self.db.index_length(LLM_CACHE_INDEX_KEY) - self.max_entries
+
+        if excess <= 0:
+            return
+
+        # NOTE index is ordered by last access, least recently used popped first
+        for key in self.db.pop_index(LLM_CACHE_INDEX_KEY, excess):
+            if self.db.exists(key):
+                self.db.delete(key)
+
+            self._count("evictions")
+
+    def _remove(self, key: str):
+        if self.db.exists(key):
+            self.db.delete(key)
+
+        self.db.remove_from_index(LLM_CACHE_INDEX_KEY, key)
+
+    def _count(self, metric: str):
+        with self._lock:
+            setattr(self.stats, metric, getattr(self.stats, metric) + 1)
+
+            stats = self.stats.model_copy()
+
+        logging.debug(
+            f"llm cache {metric} - hits: {stats.hits} misses: {stats.misses} "
+            f"hit rate: {stats.hit_rate:.2f}",
+        )
+
+
+def get_response_cache() -> ResponseCache:
+    """
+    The process wide response cache, created on first use
+    """
+    return _RESPONSE_CACHE.get(ResponseCache)
@@ -1,14 +1,56 @@
 # from string import Template
+import os
+import logging
+import threading
 from jinja2 import Template
 from typing import Any
 
+# NOTE compiled templates keyed by path, recompiled when the file's mtime changes
+_TEMPLATES: dict[str, tuple[int, Template]] = {}
+_TEMPLATES_LOCK = threading.Lock()
+
+
+def get_template(file_path: str) -> Template:
+    """
+    Compiled template of file_path, only compiled again when the file changed
+    """
+    mtime = os.stat(file_path).st_mtime_ns
+
+    cached = _TEMPLATES.get(file_path)
+
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
 
-def prompt_loader(file_path: str, variables: dict[str, Any] = {}) -> str:
     with open(file_path) as file:
-        template_content = file.read()
+        template = Template(file.read())
+
+    with _TEMPLATES_LOCK:
+        _TEMPLATES[file_path] = (mtime, template)
+
+    logging.debug(f"compiled template {file_path}")
 
-    template = Template(template_content)
-    return template.render(**variables)
+    return template
+
+
+def precompile_templates(dir_path: str) -> int:
+    """
+    Compile every markdown template of dir_path ahead of their first render,
+    returns the number of templates compiled
+    """
+    file_paths = [
+        os.path.join(dir_path, file_name)
+        for file_name in sorted(os.listdir(dir_path))
+        if file_name.endswith(".md")
+    ]
+
+    for file_path in file_paths:
+        get_template(file_path)
+
+    return len(file_paths)
+
+
+def prompt_loader(file_path: str, variables: dict[str, Any] = {}) -> str:
+    return get_template(file_path).render(**variables)
 
     # placeholders = set(re.findall(r"\{\{ (\w+) \}\}", template_content))
     # # placeholders = set(re.findall(r"\$\{(\w+)\}", template_content))
@@ -0,0 +1,125 @@
+import mmap
+import os
+import struct
+from collections.abc import Iterator
+from typing import Any
+from src.utils import codec
+
+"""
+Append-only segment files - a batch of records written once and never modified,
+read back through mmap so random access and scans never load the whole file
+
+    | HEADER | OFFSETS (count + 1 x u64) | RECORDS |
+
+- HEADER: magic, version and record count
+- OFFSETS: start of each record relative to the RECORDS region, the extra last
+  offset is the end of the last record, so record i is RECORDS[offsets[i]:offsets[i+1]]
+- RECORDS: payloads encoded with utils/codec.py
+"""
+
+SEGMENT_MAGIC = b"OHSG"
+SEGMENT_VERSION = 1
+
+HEADER = struct.Struct("<4sBI")
+OFFSET = struct.Struct("<Q")
+
+
+def write_segment(path: str, records: list[Any]):
+    """
+    Write records to a new segment file, atomically (tmp file + rename)
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    payloads = [codec.encode(record) for record in records]
+
+    offsets = [0]
+    for payload in payloads:
+        offsets.append(offsets[-1] + len(payload))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, len(records)))
+        file.write(b"".join(OFFSET.pack(offset) for offset in offsets))
+        file.write(b"".join(payloads))
+
+        file.flush()
+        os.fsync(file.fileno())
+
+    os.replace(tmp_path, path)
+
+
+class SegmentReader:
+
+    """
+    Memory-mapped reader of a segment file, records are decoded on access
+
+    ```
+    with SegmentReader(path) as segment:
+        last = segment[-1]
+        matches = segment.search("hello")
+    ```
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self._count = HEADER.unpack_from(self._mmap, 0)
+
+        if magic != SEGMENT_MAGIC or version > SEGMENT_VERSION:
+            self.close()
+            raise ValueError(f"Invalid segment file: {path}")
+
+        self._records_start = HEADER.size + OFFSET.size * (self._count + 1)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: int | slice) -> Any:
+        if isinstance(index, slice):
+            return [self._read(i) for i in range(*index.indices(self._count))]
+
+        if index < 0:
+            index += self._count
+
+        if not 0 <= index < self._count:
+            raise IndexError(f"segment index out of range: {index}")
+
+        return self._read(index)
+
+    def __iter__(self) -> Iterator[Any]:
+        for i in range(self._count):
+            yield self._read(i)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exit_type, value, traceback):
+        self.close()
+
+    def search(self, text: str, field: str = "content") -> list[Any]:
+        """
+        Records whose field contains text (case insensitive)
+        """
+        text = text.lower()
+
+        return [
+            record
+            for record in self
+            if text in str(record.get(field, "")).lower()
+        ]
+
+    def close(self):
+        self._mmap.close()
+
+    def _read(self, index: int) -> Any:
+        start, end = (
+            OFFSET.unpack_from(self._mmap, HEADER.size + OFFSET.size * i)[0]
+            for i in (index, index + 1)
+        )
+
+        return codec.decode(
+            self._mmap[self._records_start + start : self._records_start + end],
+        )
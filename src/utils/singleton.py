@@ -0,0 +1,40 @@
+import threading
+from typing import Generic, TypeVar
+from collections.abc import Callable
+
+T = TypeVar("T")
+
+
+class Singleton(Generic[T]):
+
+    """
+    Holder of a process wide instance, created on first use
+        - get runs the factory once even when called from many threads
+        - lock guards compound updates of the instance (e.g. replacing it when the
+          config changed)
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.instance: T | None = None
+
+    def get(self, factory: Callable[[], T]) -> T:
+        instance = self.instance
+
+        if instance is None:
+            with self.lock:
+                if self.instance is None:
+                    self.instance = factory()
+
+                instance = self.instance
+
+        return instance
+
+    def pop(self) -> T | None:
+        """
+        Forget the instance and return it (e.g. to close it), None when not created
+        """
+        with self.lock:
+            instance, self.instance = self.instance, None
+
+        return instance
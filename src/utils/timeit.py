@@ -1,6 +1,6 @@
 import math
 import time
-import timeit
+import timeit as _timeit
 import inspect
 import logging
 import traceback
@@ -215,14 +215,14 @@ def nice_timeit(
     number=0,
     repeat=None,
     precision=3,
-    timer_func=timeit.default_timer,
+    timer_func=_timeit.default_timer,
 ):
     """Time execution of a Python statement or expression."""
 
     if repeat is None:
-        repeat = 7 if timeit.default_repeat < 7 else timeit.default_repeat  # type: ignore[attr-defined]
+        repeat = 7 if _timeit.default_repeat < 7 else _timeit.default_repeat  # type: ignore[attr-defined]
 
-    timer = timeit.Timer(stmt, setup, timer=timer_func, globals=None)
+    timer = _timeit.Timer(stmt, setup, timer=timer_func, globals=None)
 
     # Get compile time
     compile_time_start = timer_func()
@@ -0,0 +1,69 @@
+import math
+import logging
+from functools import lru_cache
+
+# NOTE optional exact tokenizer, a chars per token estimate is the fallback
+try:
+    import tiktoken
+
+except ImportError:
+    tiktoken = None
+
+# encoding of the gpt-3.5 / gpt-4 chat models
+TIKTOKEN_ENCODING = "cl100k_base"
+
+# average number of characters per token of english text (estimate fallback)
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    if tiktoken is None:
+        logging.warning("tiktoken not installed, token counts are estimated")
+        return None
+
+    try:
+        return tiktoken.get_encoding(TIKTOKEN_ENCODING)
+
+    except Exception as e:
+        # NOTE the encoding is downloaded on first use, e.g. fails offline
+        logging.warning(f"tiktoken encoding unavailable, counts are estimated: {e}")
+        return None
+
+
+def exact_token_counts() -> bool:
+    """
+    Whether token counts come from the tokenizer and not the chars per token estimate
+    """
+    return _get_encoding() is not None
+
+
+@lru_cache(maxsize=256)
+def count_tokens(text: str) -> int:
+    """
+    Number of tokens of text, exact with tiktoken and estimated otherwise - cached
+    as the same prompt parts (e.g. personality DNA) are counted every turn
+    """
+    encoding = _get_encoding()
+
+    if encoding is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """
+    Start of text fitting max_tokens
+    """
+    encoding = _get_encoding()
+
+    if encoding is None:
+        return text[: max(0, max_tokens) * CHARS_PER_TOKEN]
+
+    tokens = encoding.encode(text, disallowed_special=())
+
+    if len(tokens) <= max_tokens:
+        return text
+
+    return encoding.decode(tokens[: max(0, max_tokens)])
@@ -0,0 +1,226 @@
+import atexit
+import logging
+import threading
+import time
+from collections.abc import Callable
+from typing import Any
+
+
+class WriteBehindQueue:
+
+    """
+    Write-behind persistence - writes are buffered in memory and flushed to the db by
+    a background thread, so db latency never sits on the conversation's critical path
+        - writes to the same key (or hash field) are coalesced, only the latest value
+          is persisted
+        - a write can be a callable, it is then serialized at flush time
+        - appends keep their order and are flushed with one RPUSH per key
+        - calls are callables doing their own (e.g. versioned) writes, coalesced per key
+        - flushes every flush_interval seconds or once max_pending ops are queued
+        - drained on interpreter shutdown
+    """
+
+    def __init__(
+        self,
+        db_connection,
+        flush_interval: float = 0.5,
+        max_pending: int = 100,
+    ):
+        self.db_connection = db_connection
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        # metrics
+        self.flushes = 0
+        self.flushed_ops = 0
+        self.last_flush_time = 0.0
+
+        self._writes: dict[str, Any | Callable[[], Any]] = {}
+        self._fields: dict[str, dict[str, Any | Callable[[], Any]]] = {}
+        self._appends: dict[str, list[Any]] = {}
+        self._calls: dict[str, Callable[[], None]] = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._atexit_registered = False
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        Number of ops (coalesced writes + appends) waiting to be flushed
+        """
+        return self._pending
+
+    def write(self, key: str, data: Any | Callable[[], Any]):
+        with self._lock:
+            if key not in self._writes:
+                self._pending += 1
+
+            self._writes[key] = data
+
+        self._notify()
+
+    def write_fields(self, key: str, data: dict[str, Any | Callable[[], Any]]):
+        with self._lock:
+            fields = self._fields.setdefault(key, {})
+
+            self._pending += len(data.keys() - fields.keys())
+
+            fields.update(data)
+
+        self._notify()
+
+    def append(self, key: str, data: Any):
+        with self._lock:
+            self._appends.setdefault(key, []).append(data)
+            self._pending += 1
+
+        self._notify()
+
+    def call(self, key: str, fn: Callable[[], None]):
+        with self._lock:
+            if key not in self._calls:
+                self._pending += 1
+
+            self._calls[key] = fn
+
+        self._notify()
+
+    def discard(self, key: str):
+        """
+        Drop any queued op for key, e.g. before the key is deleted
+        """
+        with self._lock:
+            if self._writes.pop(key, None) is not None:
+                self._pending -= 1
+
+            self._pending -= len(self._fields.pop(key, {}))
+
+            if self._calls.pop(key, None) is not None:
+                self._pending -= 1
+
+            self._pending -= len(self._appends.pop(key, []))
+
+    def flush(self):
+        """
+        Synchronously persist every queued op
+        """
+        with self._flush_lock:
+            with self._lock:
+                writes, self._writes = self._writes, {}
+                fields, self._fields = self._fields, {}
+                appends, self._appends = self._appends, {}
+                calls, self._calls = self._calls, {}
+                pending, self._pending = self._pending, 0
+
+            if pending == 0:
+                return
+
+            stime = time.perf_counter()
+            try:
+                # NOTE ops are popped once persisted so a failure only re-queues the
+                # ones left, nothing is written twice
+                self.db_connection.write_many(
+                    {k: v() if callable(v) else v for k, v in writes.items()},
+                )
+                writes = {}
+
+                while len(fields) > 0:
+                    key, data = next(iter(fields.items()))
+                    self.db_connection.write_fields(
+                        key,
+                        {f: v() if callable(v) else v for f, v in data.items()},
+                    )
+                    fields.pop(key)
+
+                while len(appends) > 0:
+                    key, data = next(iter(appends.items()))
+                    self.db_connection.append_many(key, data)
+                    appends.pop(key)
+
+                while len(calls) > 0:
+                    key, fn = next(iter(calls.items()))
+                    fn()
+                    calls.pop(key)
+
+            except Exception as e:
+                logging.error(f"write-behind flush failed, re-queueing: {e}")
+                self._requeue(writes, fields, appends, calls)
+                return
+
+            self.flushes += 1
+            self.flushed_ops += pending
+            self.last_flush_time = time.perf_counter() - stime
+
+            logging.debug(
+                f"write-behind flushed {pending} op(s) in {self.last_flush_time:.4f}s",
+            )
+
+    def drain(self):
+        """
+        Flush everything and stop the background thread
+        """
+        thread, self._thread = self._thread, None
+
+        if thread is not None:
+            self._wakeup.set()
+            thread.join()
+
+        self.flush()
+
+    def _requeue(
+        self,
+        writes: dict[str, Any],
+        fields: dict[str, dict[str, Any]],
+        appends: dict[str, list[Any]],
+        calls: dict[str, Callable[[], None]],
+    ):
+        with self._lock:
+            for key, data in writes.items():
+                if key not in self._writes:
+                    self._writes[key] = data
+                    self._pending += 1
+
+            for key, data in fields.items():
+                queued = self._fields.setdefault(key, {})
+                for field, v in data.items():
+                    if field not in queued:
+                        queued[field] = v
+                        self._pending += 1
+
+            for key, data in appends.items():
+                self._appends[key] = data + self._appends.get(key, [])
+                self._pending += len(data)
+
+            for key, fn in calls.items():
+                if key not in self._calls:
+                    self._calls[key] = fn
+                    self._pending += 1
+
+    def _notify(self):
+        if self._thread is None:
+            self._start()
+
+        if self._pending >= self.max_pending:
+            self._wakeup.set()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+
+            self._thread = threading.Thread(target=self._flush_forever, daemon=True)
+            self._thread.start()
+
+            if not self._atexit_registered:
+                self._atexit_registered = True
+                atexit.register(self.drain)
+
+    def _flush_forever(self):
+        while self._thread is threading.current_thread():
+            self._wakeup.wait(timeout=self.flush_interval)
+            self._wakeup.clear()
+
+            self.flush()
@@ -6,18 +6,85 @@ import logging
 
 # import pyttsx
 from gtts import gTTS
-from src.utils.db import RedisConnect
-from src.agent.base import BotAgent, AgentNameExistsError, BotPersonalityDna
+from src.utils.db import get_db_connection
+from src.utils.db_memory import MemoryConnect
+from src.utils.write_behind import WriteBehindQueue
+from src.agent.base import (
+    BotAgent,
+    BotMetadata,
+    AgentNameExistsError,
+    BotPersonalityDna,
+)
+from src.agent.memory import BotAgentMemory
+from src.agent.message import RoleTypes
 from src.agent.capability import Capability
 from src.agent.io_interface import STT_CLIENTS, TTS_CLIENTS, TTT_CLIENTS
 from src.dev_tools.db_management import create_new_db
-from src.system_conf import SystemConfigPrompt, ENV_DATA
+from src.system_conf import SystemConfigPrompt, ENV_DATA, ARCHIVE_DIR, load_config
+from src.utils.tokens import exact_token_counts
 from unittest.mock import patch
 
-db_connection = RedisConnect()
+db_connection = get_db_connection()
 
 DEFAULT_DATA_PATH = "dev_tools/default_data/default_personalities.yml"
 
+USER_ID = "0.0.0.0"
+
+
+@pytest.fixture
+def memory_db(monkeypatch, tmp_path):
+    """
+    Agents stored in a fresh in-memory db (and archived under tmp_path)
+    """
+    import src.agent.base as base
+
+    db = MemoryConnect()
+
+    monkeypatch.setattr(base, "db_connection", db)
+    monkeypatch.setattr(base, "write_behind", WriteBehindQueue(db))
+
+    load_config(
+        {
+            **SystemConfigPrompt().default_config(),
+            ARCHIVE_DIR: str(tmp_path / "archive"),
+        },
+    )
+
+    return db
+
+
+def create_agent(name: str) -> BotAgent:
+    return BotAgent.create(
+        name,
+        voice_id="1",
+        personality_dna=BotPersonalityDna.create_new_personality_dna(),
+        mood_dna=[],
+        capabilities=[],
+    )
+
+
+def write_legacy_agent(db, name: str, history: list[dict] | None = None):
+    """
+    Agent stored the way it was before the hot/cold split - one blob embedding
+    its full history
+    """
+    agent = BotAgent(
+        unique_name=name,
+        user_id=USER_ID,
+        metadata=BotMetadata(
+            voice_api_id="1",
+            personality_dna=BotPersonalityDna.create_new_personality_dna(),
+            mood_dna=[],
+        ),
+        memory=BotAgentMemory.create_fresh_memory(),
+        capabilities=[],
+    )
+
+    bot = agent.model_dump()
+    bot["memory"]["full_message_history"] = history or []
+
+    db.write(f"agent:{USER_ID}:{name}", bot)
+
 
 def test_agent():
     logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
@@ -115,3 +182,283 @@ def test_agent():
 
         os.environ["TTS_CLIENT"] = client.value
         agent.speak("testing, testing 1, 2, 3... Allan out!")
+
+
+def test_available_bots_backfill(memory_db):
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("TESTING agents index backfill")
+
+    write_legacy_agent(memory_db, "Legacy")
+    create_agent("Fresh")
+
+    assert set(BotAgent.available_bots()) == {
+        "Legacy",
+        "Fresh",
+    }, "expected the legacy agent backfilled next to the created one"
+
+    write_legacy_agent(memory_db, "Late legacy")
+    BotAgent.find_agent("Late legacy")
+
+    assert (
+        "Late legacy" in BotAgent.available_bots()
+    ), "expected a migrated legacy agent indexed"
+
+
+def test_agent_save_merge_on_conflict(memory_db):
+    import src.agent.base as base
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("TESTING concurrent agent saves")
+
+    create_agent("Shared")
+
+    agent_x = BotAgent.find_agent("Shared")
+    agent_y = BotAgent.find_agent("Shared")
+
+    agent_x.update_summaries(last_day_summation="X day")
+    base.write_behind.flush()
+
+    agent_y.update_summaries(last_week_summation="Y week")
+    agent_y.update_mood("calm")
+    base.write_behind.flush()
+
+    agent = BotAgent.find_agent("Shared")
+
+    assert agent.memory.last_day_summation == "X day", "expected X's summary kept"
+    assert agent.memory.last_week_summation == "Y week", "expected Y's summary saved"
+    assert agent.memory.current_mood == "calm", "expected Y's mood saved"
+    assert agent_y.memory.last_day_summation == "X day", "expected Y merged X's summary"
+
+
+def test_agent_save_conflict_not_requeued(memory_db):
+    import src.agent.base as base
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("TESTING unresolved save conflict")
+
+    agent = create_agent("Contended")
+    base.write_behind.flush()
+
+    with patch.object(MemoryConnect, "compare_and_set_fields", return_value=None):
+        agent.update_mood("tense")
+        base.write_behind.flush()
+
+    assert base.write_behind.queue_depth == 0, "expected the conflicting save dropped"
+    assert agent._dirty_fields == {
+        base.AgentDbFields.MOOD,
+    }, "expected the mood kept dirty for the next save"
+
+    agent.save()
+    base.write_behind.flush()
+
+    assert (
+        BotAgent.find_agent("Contended").memory.current_mood == "tense"
+    ), "expected the next save to persist the mood"
+
+
+def test_agent_dirty_field_saves(memory_db):
+    import src.agent.base as base
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("TESTING dirty field saves")
+
+    agent = create_agent("Dirty")
+    base.write_behind.flush()
+
+    with patch.object(
+        MemoryConnect,
+        "compare_and_set_fields",
+        autospec=True,
+        side_effect=MemoryConnect.compare_and_set_fields,
+    ) as compare_and_set_fields:
+        agent.update_mood("curious")
+        agent.update_mood("amused")
+        base.write_behind.flush()
+
+    assert compare_and_set_fields.call_count == 1, "expected the saves coalesced"
+
+    written = compare_and_set_fields.call_args.args[2]
+    assert written == {
+        base.AgentDbFields.MOOD.value: {"current_mood": "amused"},
+    }, "expected only the dirty field written"
+
+    assert (
+        BotAgent.find_agent("Dirty").memory.current_mood == "amused"
+    ), "expected the dirty field persisted"
+
+
+def test_agent_legacy_blob_migration(memory_db):
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("TESTING legacy agent blob migration")
+
+    history = [
+        {"role": "user", "content": f"message {i}"} for i in range(5)
+    ]
+    write_legacy_agent(memory_db, "Legacy", history)
+
+    agent = BotAgent.find_agent("Legacy", history_tail=2)
+
+    assert [m.content for m in agent.memory.full_message_history] == [
+        "message 3",
+        "message 4",
+    ], "expected the tail of the legacy history"
+    assert agent.message_count == 5, "expected the whole legacy history counted"
+
+    assert (
+        memory_db.key_type(agent.unique_db_key) == "hash"
+    ), "expected the blob re-saved as fields"
+    assert (
+        memory_db.read_range(agent.messages_db_key) == history
+    ), "expected the legacy history moved to the message list"
+
+    agent = BotAgent.find_agent("Legacy")
+
+    assert len(agent.memory.full_message_history) == 5, "expected the migrated history"
+
+    # NOTE another process loaded the blob before it was migrated
+    agent._migrate_legacy_blob(history)
+
+    assert (
+        memory_db.read_range(agent.messages_db_key) == history
+    ), "expected the legacy history not stored twice"
+
+
+def save_messages(agent: BotAgent, count: int, start: int = 0):
+    for i in range(start, start + count):
+        role = RoleTypes.USER if i % 2 == 0 else RoleTypes.ASSISTANT
+        agent.save_message(f"message {i}", role)
+
+
+def test_agent_history_tail(memory_db):
+    import src.agent.base as base
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("TESTING history tail loading")
+
+    agent = create_agent("Chatty")
+    save_messages(agent, 10)
+    base.write_behind.flush()
+
+    agent = BotAgent.find_agent("Chatty", history_tail=4)
+
+    assert [m.content for m in agent.memory.full_message_history] == [
+        f"message {i}" for i in range(6, 10)
+    ], "expected only the tail loaded"
+    assert agent.memory.history_offset == 6, "expected the offset of the tail"
+    assert agent.message_count == 10, "expected the whole history counted"
+    assert agent.curr_message == "message 8", "expected the last user message"
+    # NOTE only exact counts are stored with the messages
+    assert all(
+        (message.tokens is not None) == exact_token_counts()
+        for message in agent.memory.full_message_history
+    ), "expected the exact token counts loaded, not recounted"
+
+    older = agent.load_older_messages(3)
+
+    assert [m.content for m in older] == [
+        f"message {i}" for i in range(3, 6)
+    ], "expected the messages before the tail"
+    assert agent.memory.history_offset == 3, "expected the offset moved back"
+
+    save_messages(agent, 1, start=10)
+    base.write_behind.flush()
+
+    agent = BotAgent.find_agent("Chatty", history_tail=1)
+
+    assert (
+        agent.memory.full_message_history[0].content == "message 10"
+    ), "expected new messages appended after the loaded tail"
+
+
+def test_agent_archived_history(memory_db):
+    import src.agent.base as base
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("TESTING paging in archived history")
+
+    agent = create_agent("Archivist")
+    save_messages(agent, 6)
+    base.write_behind.flush()
+
+    assert agent.archive_history(keep=4) == 2, "expected the 2 oldest archived"
+
+    save_messages(agent, 4, start=6)
+    base.write_behind.flush()
+
+    assert agent.archive_history(keep=4) == 4, "expected a second segment archived"
+    assert memory_db.length(agent.messages_db_key) == 4, "expected the hot tail kept"
+
+    agent = BotAgent.find_agent("Archivist", history_tail=2)
+
+    assert agent.message_count == 10, "expected archived messages counted"
+
+    # NOTE spans the hot list and both segments
+    older = agent.load_older_messages(7)
+
+    assert [m.content for m in older] == [
+        f"message {i}" for i in range(1, 8)
+    ], "expected messages read across the archive and the hot list"
+
+    older = agent.load_older_messages(5)
+
+    assert [m.content for m in older] == ["message 0"], "expected the oldest message"
+    assert agent.load_older_messages(5) == [], "expected nothing older"
+
+    assert [
+        m.content for m in agent.search_archived_messages("message 3")
+    ] == ["message 3"], "expected archived messages searchable"
+
+
+def test_agent_no_response(memory_db, monkeypatch):
+    import src.agent.base as base
+    import src.agent.mood as mood
+    from src.agent.speculation import SpeculativeResponse
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("TESTING turns without a generated response")
+
+    # NOTE what ttt returns past the deadline or once every request failed
+    monkeypatch.setattr(base, "text_to_text", lambda **kwargs: None)
+    monkeypatch.setattr(mood, "text_to_text", lambda **kwargs: None)
+
+    agent = create_agent("Speechless")
+    speculation = SpeculativeResponse(agent.speculative_response)
+
+    for turn in range(2):
+        msgs = f"hello {turn}"
+        speculation.propose(msgs)
+
+        agent.save_message(msgs, role=RoleTypes.USER)
+
+        context = agent.manage_context(msgs, speculation=speculation)
+
+        assert context == base.FALLBACK_RESPONSE, "expected the fallback response"
+
+        agent.save_message(context, role=RoleTypes.ASSISTANT)
+
+    assert speculation.hits == 0, "expected no speculative response used"
+    assert agent.message_count == 4, "expected the conversation to go on"
+
+
+def test_agent_mood_prompt_snapshot(memory_db, monkeypatch):
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("TESTING mood evolver prompt snapshot")
+
+    agent = create_agent("Moody")
+
+    prompts = []
+    monkeypatch.setattr(agent._mood_evolver, "evolve", prompts.append)
+
+    agent.save_message("first question", role=RoleTypes.USER)
+    agent.save_message("first answer", role=RoleTypes.ASSISTANT)
+    agent.save_message("second question", role=RoleTypes.USER)
+
+    expected = agent.mood_evolver_prompt
+    agent.evolve_mood()
+
+    # NOTE what the next turn does while the evolution is still queued
+    agent.save_message("second answer", role=RoleTypes.ASSISTANT)
+    agent.save_message("third question", role=RoleTypes.USER)
+    agent.update_mood("gloomy")
+
+    assert prompts[0]() == expected, "expected the prompt of the turn it started on"
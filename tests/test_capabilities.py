@@ -2,10 +2,10 @@ import pytest
 import sys
 import os
 import logging
-from src.utils.db import RedisConnect
+from src.utils.db import get_db_connection
 from src.agent.capability import Capability
 
-db_connection = RedisConnect()
+db_connection = get_db_connection()
 
 
 def test_agent():
@@ -18,3 +18,28 @@ def test_agent():
     logging.debug(f"TESTING calling capability: {capability.unique_name}")
 
     capability.call()
+
+
+def test_capability_llm_fallback(monkeypatch):
+    # NOTE ttt returns None on a deadline or an api error
+    from capabilities import capability_with_gpt
+    from capabilities.personality_quiz import PersonalityQuizCapability
+    from src.agent.base import FALLBACK_RESPONSE
+
+    class Agent:
+        def speak(self, response):
+            pass
+
+    monkeypatch.setattr(capability_with_gpt, "text_to_text", lambda *args, **kwargs: None)
+
+    stats = capability_with_gpt.SystemstatsCapability.register_capability()
+
+    assert stats.call(Agent()) == FALLBACK_RESPONSE, "expected fallback response for a missing description"
+
+    class Client:
+        def ttt(self, messages_input):
+            return None
+
+    quiz = PersonalityQuizCapability.register_capability()
+
+    assert quiz.generate_mbti_prediction(Client()) == "Error generating response", "expected fallback prediction"
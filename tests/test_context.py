@@ -0,0 +1,144 @@
+import sys
+import logging
+import src.agent.message as message_module
+from src.agent.context import (
+    ContextWindow,
+    CHAT_MESSAGE_TOKEN_OVERHEAD,
+    LINE_TOKEN_OVERHEAD,
+    PREVIOUS_MESSAGES_INSTRUCTIONS,
+)
+from src.agent.message import RoleTypes, Message
+from src.system_conf import SystemConfigPrompt, CONTEXT_TOKEN_BUDGET, load_config
+from src.utils.tokens import count_tokens, exact_token_counts
+
+
+def test_context_window():
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+
+    load_config(SystemConfigPrompt().default_config())
+
+    context = ContextWindow(size=4, skip_last=2)
+
+    assert context.previous_messages() == "", "expected no previous messages"
+    assert context.curr_message == "", "expected no current message"
+
+    for i, role in enumerate(
+        [RoleTypes.USER, RoleTypes.ASSISTANT, RoleTypes.USER, RoleTypes.SYSTEM],
+    ):
+        context.push(Message(role=role, content=f"message {i}"))
+
+    assert context.curr_message == "message 2", "expected the last user message"
+
+    assert context.previous_messages() == (
+        "1: user: message 0" + PREVIOUS_MESSAGES_INSTRUCTIONS
+    ), "expected assistant and last 2 messages left out"
+
+    context.push(Message(role=RoleTypes.ASSISTANT, content="message 4"))
+    context.push(Message(role=RoleTypes.USER, content="message 5"))
+
+    assert context.previous_messages() == (
+        "1: user: message 2\n2: user: message 3" + PREVIOUS_MESSAGES_INSTRUCTIONS
+    ), "expected the window to slide"
+
+    context.rebuild(
+        [Message(role=RoleTypes.USER, content="old")]
+        + [Message(role=RoleTypes.ASSISTANT, content="reply")] * 5,
+    )
+
+    assert context.curr_message == "old", "expected user message older than the window"
+
+
+def test_context_window_token_budget():
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+
+    context = ContextWindow(size=10, skip_last=0)
+
+    context.push(Message(role=RoleTypes.USER, content="long " * 400))
+
+    for i in range(3):
+        context.push(Message(role=RoleTypes.USER, content=f"short {i}"))
+
+    message = Message(role=RoleTypes.USER, content="short 0")
+    line_tokens = message.token_count + LINE_TOKEN_OVERHEAD
+
+    if exact_token_counts():
+        assert (
+            Message(**message.model_dump()).tokens == message.token_count
+        ), "expected the token count stored with the message"
+
+    else:
+        assert (
+            "tokens" not in message.model_dump()
+        ), "expected an estimated token count not stored"
+
+    assert context.previous_messages(token_budget=2 * line_tokens) == (
+        "1: user: short 1\n2: user: short 2" + PREVIOUS_MESSAGES_INSTRUCTIONS
+    ), "expected only the most recent messages fitting the budget"
+
+    load_config(
+        {
+            **SystemConfigPrompt().default_config(),
+            CONTEXT_TOKEN_BUDGET: str(2 * line_tokens),
+        },
+    )
+
+    assert context.previous_messages() == context.previous_messages(
+        token_budget=2 * line_tokens,
+    ), "expected the context token budget of the config by default"
+
+    assert context.previous_messages(token_budget=0) == (
+        PREVIOUS_MESSAGES_INSTRUCTIONS
+    ), "expected no message to fit"
+
+    assert context.previous_messages(token_budget=10_000).startswith(
+        "1: user: long",
+    ), "expected every message to fit"
+
+    assert context.recent_messages(token_budget=3 * line_tokens) == [
+        {"role": "user", "content": f"short {i}"} for i in range(3)
+    ], "expected the most recent chat messages fitting the budget"
+
+    for i in range(30):
+        context.push(Message(role=RoleTypes.USER, content=f"short {i}"))
+
+    assert context.previous_messages(token_budget=10_000).count("\n") == 11, (
+        "expected at most size messages"
+    )
+
+
+def test_context_window_last_message_over_budget():
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+
+    context = ContextWindow(size=10, skip_last=0)
+
+    for content in ("hi", "hello", "word " * 600):
+        context.push(Message(role=RoleTypes.USER, content=content))
+
+    recent_messages = context.recent_messages(token_budget=300)
+
+    assert len(recent_messages) == 1, "expected the last message kept alone"
+    assert recent_messages[0]["role"] == "user", "expected the user message"
+    assert recent_messages[0]["content"].startswith("word"), "expected its start kept"
+    assert (
+        count_tokens(recent_messages[0]["content"]) + CHAT_MESSAGE_TOKEN_OVERHEAD <= 300
+    ), "expected the last message truncated to the budget"
+
+    assert context.recent_messages(token_budget=0)[0]["content"].startswith(
+        "word",
+    ), "expected the last message kept even without budget"
+
+
+def test_message_estimated_tokens_not_stored(monkeypatch):
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+
+    monkeypatch.setattr(message_module, "exact_token_counts", lambda: False)
+
+    message = Message(role=RoleTypes.USER, content="estimated " * 10)
+
+    assert message.token_count == count_tokens(message.content), "expected a count"
+    assert message.tokens is None, "expected an estimated token count not kept"
+
+    monkeypatch.setattr(message_module, "exact_token_counts", lambda: True)
+
+    assert message.token_count == count_tokens(message.content), "expected a count"
+    assert message.tokens is not None, "expected an exact token count kept"
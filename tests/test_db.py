@@ -0,0 +1,385 @@
+import sys
+import json
+import logging
+import pytest
+from src.utils import codec
+from src.utils.db import DbBackends, RedisConnect, TokenBucket, VERSION_FIELD
+from src.utils.db_memory import MemoryConnect
+from src.utils.db_sqlite import SQLiteConnect
+from src.utils.segments import SegmentReader, write_segment
+from src.utils.write_behind import WriteBehindQueue
+
+TEST_KEY = "test:db"
+
+
+@pytest.fixture(params=[backend.value for backend in DbBackends])
+def db_connection(request, tmp_path):
+    match DbBackends(request.param):
+        case DbBackends.REDIS:
+            return RedisConnect()
+
+        case DbBackends.MEMORY:
+            return MemoryConnect()
+
+        case DbBackends.SQLITE:
+            return SQLiteConnect(path=str(tmp_path / "test.db"))
+
+
+def test_append_read_range(db_connection):
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+
+    db_connection.delete(TEST_KEY)
+
+    assert db_connection.length(TEST_KEY) == 0, "expected empty list"
+
+    db_connection.append(TEST_KEY, {"role": "user", "content": "hello"})
+    db_connection.append_many(
+        TEST_KEY,
+        [
+            {"role": "assistant", "content": "hi"},
+            {"role": "user", "content": "bye"},
+        ],
+    )
+
+    assert db_connection.length(TEST_KEY) == 3, "expected 3 items appended"
+
+    assert db_connection.read_range(TEST_KEY) == [
+        {"role": "user", "content": "hello"},
+        {"role": "assistant", "content": "hi"},
+        {"role": "user", "content": "bye"},
+    ], "expected items in insertion order"
+
+    assert db_connection.read_range(TEST_KEY, -1) == [
+        {"role": "user", "content": "bye"},
+    ], "expected negative start to read from the tail"
+
+    assert db_connection.read_tail(TEST_KEY, 2) == (
+        3,
+        [{"role": "assistant", "content": "hi"}, {"role": "user", "content": "bye"}],
+    ), "expected the last 2 items and the total length"
+
+    db_connection.trim(TEST_KEY, 1, -1)
+
+    assert db_connection.read_range(TEST_KEY) == [
+        {"role": "assistant", "content": "hi"},
+        {"role": "user", "content": "bye"},
+    ], "expected the oldest item trimmed"
+
+    index_key = f"{TEST_KEY}:moved"
+    db_connection.delete(index_key)
+
+    db_connection.append_and_trim(index_key, {"moved": 1}, TEST_KEY, 1, -1)
+
+    assert db_connection.read_tails({TEST_KEY: 5, index_key: 1, "missing": 0}) == {
+        TEST_KEY: (1, [{"role": "user", "content": "bye"}]),
+        index_key: (1, [{"moved": 1}]),
+        "missing": (0, []),
+    }, "expected both lists updated and read together"
+
+    db_connection.delete(TEST_KEY)
+    db_connection.delete(index_key)
+
+
+def test_batch_operations(db_connection):
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+
+    keys = [f"{TEST_KEY}:{i}" for i in range(3)]
+    for key in keys:
+        db_connection.delete(key)
+
+    db_connection.write_many({key: {"index": i} for i, key in enumerate(keys[:2])})
+
+    assert db_connection.exists_many(keys) == [True, True, False], "expected 2 keys"
+
+    assert db_connection.read_keys(keys) == [
+        {"index": 0},
+        {"index": 1},
+        None,
+    ], "expected missing keys to read as None"
+
+    assert sorted(
+        data["index"] for data in db_connection.read_many(TEST_KEY)
+    ) == [0, 1], "expected read_many to find both keys under the base key"
+
+    for key in keys:
+        db_connection.delete(key)
+
+
+def test_index(db_connection):
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+
+    index_key = f"{TEST_KEY}:index"
+    db_connection.delete(index_key)
+
+    db_connection.add_to_index(index_key, "b", score=2)
+    db_connection.add_to_index(index_key, "a", score=1)
+    db_connection.add_to_index(index_key, "b", score=2)
+
+    assert db_connection.read_index(index_key) == ["a", "b"], "expected unique members"
+
+    assert db_connection.scan_keys(f"{TEST_KEY}:ind*") == [
+        index_key,
+    ], "expected scan to match the index key"
+
+    db_connection.remove_from_index(index_key, "a")
+
+    assert db_connection.read_index(index_key) == ["b"], "expected a to be removed"
+
+    db_connection.add_to_index(index_key, "c", score=3)
+    db_connection.add_to_index(index_key, "a", score=1)
+
+    assert db_connection.index_length(index_key) == 3, "expected 3 members"
+    assert db_connection.pop_index(index_key, 2) == [
+        "a",
+        "b",
+    ], "expected the lowest scored members popped"
+    assert db_connection.read_index(index_key) == ["c"], "expected c left"
+
+    db_connection.delete(index_key)
+
+
+def test_write_behind(db_connection):
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+
+    list_key = f"{TEST_KEY}:list"
+    db_connection.delete(TEST_KEY)
+    db_connection.delete(list_key)
+
+    queue = WriteBehindQueue(db_connection, flush_interval=60)
+
+    for i in range(3):
+        queue.write(TEST_KEY, {"version": i})
+        queue.append(list_key, {"index": i})
+
+    assert queue.queue_depth == 4, "expected writes to the same key to coalesce"
+    assert not db_connection.exists(TEST_KEY), "expected nothing written before flush"
+
+    queue.drain()
+
+    assert queue.queue_depth == 0, "expected an empty queue after drain"
+    assert db_connection.read(TEST_KEY) == {"version": 2}, "expected latest write"
+    assert db_connection.read_range(list_key) == [
+        {"index": i} for i in range(3)
+    ], "expected appends flushed in order"
+
+    db_connection.delete(TEST_KEY)
+    db_connection.delete(list_key)
+
+
+def test_codec(db_connection):
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+
+    data = {"content": "hello " * 1000, "nested": [1, 2.5, None, True]}
+
+    db_connection.write(TEST_KEY, data)
+    assert db_connection.read(TEST_KEY) == data, "expected payload to round trip"
+
+    for codec_type in codec.CodecTypes:
+        for threshold in (None, 0):
+            payload = codec.encode(data, codec_type, compress_threshold=threshold)
+            assert codec.is_encoded(payload), "expected payload with codec header"
+            assert codec.decode(payload) == data, f"expected {codec_type} round trip"
+
+    db_connection.write(TEST_KEY, json.dumps(data))
+    assert db_connection.read(TEST_KEY) == data, "expected legacy json to be readable"
+
+    db_connection.delete(TEST_KEY)
+
+
+def test_codec_fast_path(monkeypatch):
+    assert codec.orjson is not None, "expected orjson to be installed"
+    assert codec.zstandard is not None, "expected zstandard to be installed"
+
+    orjson = codec.orjson
+    orjson_calls = []
+
+    class OrjsonSpy:
+        def dumps(self, data):
+            orjson_calls.append(data)
+            return orjson.dumps(data)
+
+        loads = staticmethod(orjson.loads)
+
+    monkeypatch.setattr(codec, "orjson", OrjsonSpy())
+
+    data = {"content": "hello " * 1000}
+
+    payload = codec.encode(data)
+
+    assert orjson_calls == [data], "expected the default codec to use orjson"
+    assert (
+        payload[codec.HEADER_SIZE - 1] & codec.ZSTD_FLAG
+    ), "expected a large payload to be zstd compressed"
+    assert codec.decode(payload) == data, "expected the fast path to round trip"
+
+
+def test_fields(db_connection):
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+
+    db_connection.delete(TEST_KEY)
+
+    assert db_connection.key_type(TEST_KEY) == "none", "expected missing key"
+
+    db_connection.write_fields(TEST_KEY, {"cold": {"a": 1}, "hot": {"b": 1}})
+    db_connection.write_fields(TEST_KEY, {"hot": {"b": 2}})
+
+    assert db_connection.key_type(TEST_KEY) == "hash", "expected a hash"
+    assert db_connection.read_fields(TEST_KEY) == {
+        "cold": {"a": 1},
+        "hot": {"b": 2},
+    }, "expected only the hot field to be updated"
+    assert db_connection.read_fields(TEST_KEY, ["hot", "missing"]) == {
+        "hot": {"b": 2},
+    }, "expected missing fields to be left out"
+
+    db_connection.delete(TEST_KEY)
+
+
+def test_replace_with_fields(db_connection):
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+
+    list_key = f"{TEST_KEY}:list"
+    db_connection.delete(TEST_KEY)
+    db_connection.delete(list_key)
+
+    db_connection.write(TEST_KEY, {"blob": 1})
+
+    assert db_connection.replace_with_fields(
+        TEST_KEY,
+        {"cold": {"a": 1}, "hot": {"b": 1}},
+        list_key,
+        [{"index": 0}, {"index": 1}],
+    ), "expected the string replaced"
+    assert db_connection.read_fields(TEST_KEY) == {
+        "cold": {"a": 1},
+        "hot": {"b": 1},
+    }, "expected the fields written"
+    assert db_connection.read_range(list_key) == [
+        {"index": 0},
+        {"index": 1},
+    ], "expected the items appended"
+
+    assert not db_connection.replace_with_fields(
+        TEST_KEY,
+        {"cold": {"a": 2}},
+        list_key,
+        [{"index": 0}, {"index": 1}],
+    ), "expected a hash left as is"
+    assert db_connection.read_range(list_key) == [
+        {"index": 0},
+        {"index": 1},
+    ], "expected the items not appended twice"
+
+    db_connection.delete(TEST_KEY)
+    db_connection.write(TEST_KEY, {"blob": 2})
+
+    assert db_connection.replace_with_fields(
+        TEST_KEY,
+        {"cold": {"a": 3}},
+        list_key,
+        [{"index": 0}, {"index": 1}],
+    ), "expected the string replaced"
+    assert (
+        db_connection.length(list_key) == 2
+    ), "expected items left out of a list already holding some"
+
+    db_connection.delete(TEST_KEY)
+    db_connection.delete(list_key)
+
+
+def test_compare_and_set_fields(db_connection):
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+
+    db_connection.delete(TEST_KEY)
+
+    assert (
+        db_connection.compare_and_set_fields(TEST_KEY, {"hot": 1}, version=0) == 1
+    ), "expected a missing hash to be version 0"
+
+    assert (
+        db_connection.compare_and_set_fields(TEST_KEY, {"hot": 2}, version=0) is None
+    ), "expected a stale version to be rejected"
+
+    assert db_connection.read_fields(TEST_KEY) == {
+        VERSION_FIELD: 1,
+        "hot": 1,
+    }, "expected the rejected write to leave the hash untouched"
+
+    assert (
+        db_connection.compare_and_set_fields(TEST_KEY, {"hot": 2}, version=1) == 2
+    ), "expected the current version to be accepted"
+
+    db_connection.delete(TEST_KEY)
+
+
+def test_take_tokens(db_connection):
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+
+    requests_key, tokens_key = f"{TEST_KEY}:requests", f"{TEST_KEY}:tokens"
+    for key in (requests_key, tokens_key):
+        if db_connection.exists(key):
+            db_connection.delete(key)
+
+    def buckets(tokens):
+        return [
+            TokenBucket(key=requests_key, amount=1, rate=1, capacity=2),
+            TokenBucket(key=tokens_key, amount=tokens, rate=100, capacity=100),
+        ]
+
+    assert db_connection.take_tokens(buckets(60)) == 0, "expected a full bucket"
+
+    wait = db_connection.take_tokens(buckets(60))
+    assert 0.1 < wait <= 0.2, f"expected to wait for the tokens to refill, got {wait}"
+
+    assert (
+        db_connection.take_tokens(buckets(30), reserve=0.5) > 0
+    ), "expected the reserve to be left untouched"
+
+    assert db_connection.take_tokens(buckets(30)) == 0, "expected the remaining tokens"
+
+    wait = db_connection.take_tokens(buckets(0))
+    assert 0.9 < wait <= 1, f"expected to wait for a request, got {wait}"
+
+    for key in (requests_key, tokens_key):
+        db_connection.delete(key)
+
+
+def test_redis_connection_pool():
+    assert (
+        RedisConnect()._connection.connection_pool
+        is RedisConnect()._connection.connection_pool
+    ), "expected connections to share one pool"
+
+
+def test_segments(tmp_path):
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+
+    path = str(tmp_path / "archive" / "000000000000.seg")
+
+    messages = [{"role": "user", "content": f"message {i}"} for i in range(10)]
+    messages.append(
+        {"role": "assistant", "content": "x" * codec.DEFAULT_COMPRESS_THRESHOLD},
+    )
+
+    write_segment(path, messages)
+
+    with SegmentReader(path) as segment:
+        assert len(segment) == 11, "expected every record in the segment"
+
+        assert segment[3] == messages[3], "expected random access to a record"
+
+        assert segment[-1] == messages[-1], "expected a large (compressed) record"
+
+        assert segment[2:5] == messages[2:5], "expected slices of records"
+
+        assert list(segment) == messages, "expected records in write order"
+
+        assert segment.search("MESSAGE 7") == [
+            messages[7],
+        ], "expected case insensitive search"
+
+    with open(path, "r+b") as file:
+        file.write(b"NOPE")
+
+    with pytest.raises(ValueError):
+        SegmentReader(path)
@@ -0,0 +1,294 @@
+import sys
+import time
+import logging
+import threading
+from types import SimpleNamespace
+
+sys.path.append("src")
+
+
+class FakeConnection:
+    def __init__(self):
+        self.exit = False
+        self.handlers = {}
+        self.sent = []
+
+    def on(self, event, handler):
+        self.handlers[event] = handler
+
+    def start(self, options):
+        return True
+
+    def send(self, data):
+        self.sent.append(data)
+
+    def finish(self):
+        self.exit = True
+
+    def emit(self, event, **kwargs):
+        self.handlers[event](self, **kwargs)
+
+
+def transcript(text, speech_final=False):
+    return SimpleNamespace(
+        channel=SimpleNamespace(alternatives=[SimpleNamespace(transcript=text)]),
+        is_final=speech_final,
+        speech_final=speech_final,
+    )
+
+
+def fake_session(monkeypatch, **config):
+    import src.clients.deepgram as deepgram
+    from src.clients.rate_limiter import RateLimiter
+    from src.system_conf import SystemConfigPrompt, load_config
+    from src.utils.db_memory import MemoryConnect
+
+    connections = []
+    microphones = []
+
+    def client(api_key, options):
+        connections.append(FakeConnection())
+        live = SimpleNamespace(v=lambda version: connections[-1])
+        return SimpleNamespace(listen=SimpleNamespace(live=live))
+
+    def microphone(push):
+        microphones.append(push)
+        return SimpleNamespace(start=lambda: True, finish=lambda: True)
+
+    monkeypatch.setattr(deepgram, "DeepgramClient", client)
+    monkeypatch.setattr(deepgram, "Microphone", microphone)
+    monkeypatch.setattr(
+        deepgram,
+        "get_rate_limiter",
+        lambda: RateLimiter(db=MemoryConnect()),
+    )
+
+    session = deepgram.DeepgramSession(
+        load_config(
+            {**SystemConfigPrompt().default_config(), "deepgram_key": "xxx", **config},
+        ),
+    )
+
+    return session, connections, microphones
+
+
+def start_listening(session):
+    result = []
+    listener = threading.Thread(target=lambda: result.append(session.listen()))
+    listener.start()
+
+    while session._muted.is_set():
+        time.sleep(0.01)
+
+    return listener, result
+
+
+def test_deepgram_session(monkeypatch):
+    from deepgram import LiveTranscriptionEvents
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("testing persistent deepgram session")
+
+    session, connections, microphones = fake_session(monkeypatch)
+
+    def utterance(*texts):
+        listener, result = start_listening(session)
+
+        microphones[-1](b"audio")
+        for text in texts:
+            connections[-1].emit(
+                LiveTranscriptionEvents.Transcript,
+                result=transcript(text),
+            )
+        connections[-1].emit(LiveTranscriptionEvents.UtteranceEnd, utterance_end=None)
+
+        listener.join(5)
+        return result[0]
+
+    assert utterance("hel", "hello there") == "hello there", "expected the utterance"
+    assert connections[-1].sent == [b"audio"], "expected the audio sent while listening"
+
+    microphones[-1](b"echo")
+    assert connections[-1].sent == [b"audio"], "expected the mic muted between turns"
+
+    assert utterance("how are you") == "how are you", "expected the next utterance"
+    assert len(session.setup_times) == 1, "expected the connection reused across turns"
+
+    connections[-1].exit = True
+    assert utterance("still there") == "still there", "expected a transparent reconnect"
+    assert len(session.setup_times) == 2, "expected the setup time of the reconnection"
+
+
+def test_deepgram_utterance_events(monkeypatch):
+    from deepgram import LiveTranscriptionEvents
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("testing event driven deepgram utterances")
+
+    session, connections, _ = fake_session(monkeypatch)
+
+    listener, result = start_listening(session)
+    connections[-1].emit(
+        LiveTranscriptionEvents.Transcript,
+        result=transcript("hi", speech_final=True),
+    )
+    listener.join(0.5)
+    assert listener.is_alive(), "expected speech_final ignored without early finalize"
+
+    stime = time.time()
+    connections[-1].emit(LiveTranscriptionEvents.UtteranceEnd, utterance_end=None)
+    listener.join(5)
+    assert time.time() - stime < 0.05, "expected the listener woken up"
+    assert result == ["hi"], "expected the utterance"
+
+    session, connections, _ = fake_session(monkeypatch, deepgram_early_finalize="True")
+
+    listener, result = start_listening(session)
+    connections[-1].emit(LiveTranscriptionEvents.Transcript, result=transcript("hello"))
+    connections[-1].emit(
+        LiveTranscriptionEvents.Transcript,
+        result=transcript("hello there", speech_final=True),
+    )
+    listener.join(5)
+    assert result == ["hello there"], "expected the utterance finalized on speech_final"
+
+    listener, result = start_listening(session)
+    connections[-1].emit(LiveTranscriptionEvents.UtteranceEnd, utterance_end=None)
+    listener.join(0.2)
+    assert listener.is_alive(), "expected a late UtteranceEnd ignored"
+
+    connections[-1].emit(
+        LiveTranscriptionEvents.Transcript,
+        result=transcript("bye", speech_final=True),
+    )
+    listener.join(5)
+    assert result == ["bye"], "expected the next utterance"
+
+    # the late UtteranceEnd lands once the next utterance is being transcribed
+    listener, result = start_listening(session)
+    connections[-1].emit(LiveTranscriptionEvents.Transcript, result=transcript("see"))
+    connections[-1].emit(LiveTranscriptionEvents.UtteranceEnd, utterance_end=None)
+    listener.join(0.2)
+    assert listener.is_alive(), "expected the next utterance not cut short"
+
+    connections[-1].emit(
+        LiveTranscriptionEvents.Transcript,
+        result=transcript("see you", speech_final=True),
+    )
+    listener.join(5)
+    assert result == ["see you"], "expected the whole next utterance"
+
+    listener, result = start_listening(session)
+    connections[-1].emit(LiveTranscriptionEvents.Error, error="socket closed")
+
+    stime = time.time()
+    while len(connections) < 2 or not session.is_connected:
+        time.sleep(0.001)
+    assert time.time() - stime < 0.05, "expected an immediate reconnect on error"
+
+    connections[-1].emit(
+        LiveTranscriptionEvents.Transcript,
+        result=transcript("again", speech_final=True),
+    )
+    listener.join(5)
+    assert result == ["again"], "expected the utterance over the new connection"
+    assert len(session.setup_times) == 2, "expected the setup time of the reconnection"
+
+
+def test_deepgram_stable_interim(monkeypatch):
+    from deepgram import LiveTranscriptionEvents
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("testing stable interim transcripts")
+
+    session, connections, _ = fake_session(monkeypatch, interim_stable_seconds="0.05")
+
+    interims = []
+    result = []
+    listener = threading.Thread(
+        target=lambda: result.append(session.listen(on_interim=interims.append)),
+    )
+    listener.start()
+
+    while session._muted.is_set():
+        time.sleep(0.01)
+
+    connections[-1].emit(LiveTranscriptionEvents.Transcript, result=transcript("hello"))
+    time.sleep(0.2)
+    connections[-1].emit(LiveTranscriptionEvents.UtteranceEnd, utterance_end=None)
+    listener.join(5)
+
+    assert interims == ["hello"], "expected the interim reported once stable"
+    assert result == ["hello"], "expected the utterance"
+
+
+def test_deepgram_connect_failures(monkeypatch):
+    import pytest
+    import src.clients.deepgram as deepgram
+    from src.clients.rate_limiter import RateLimitTimeoutError
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("testing deepgram connection failures")
+
+    session, _, _ = fake_session(monkeypatch)
+    monkeypatch.setattr(deepgram, "sleep", lambda seconds: None)
+
+    attempts = []
+
+    def client(api_key, options):
+        attempts.append(api_key)
+        raise OSError("no microphone")
+
+    monkeypatch.setattr(deepgram, "DeepgramClient", client)
+
+    with pytest.raises(OSError):
+        session.listen()
+    assert (
+        len(attempts) == deepgram.RECONNECT_MAX_RETRIES + 1
+    ), "expected the reconnections capped"
+
+    class RateLimiter:
+        def acquire(self, provider, **kwargs):
+            attempts.append(provider)
+            raise RateLimitTimeoutError(provider, "*", 30)
+
+    attempts.clear()
+    monkeypatch.setattr(deepgram, "get_rate_limiter", RateLimiter)
+
+    with pytest.raises(RateLimitTimeoutError):
+        session.listen()
+    assert attempts == ["deepgram"], "expected no retry past the rate limit wait"
+
+
+def test_deepgram_shared_session():
+    import src.clients.deepgram as deepgram
+    from src.system_conf import SystemConfigPrompt, load_config
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("testing the process wide deepgram session")
+
+    config = load_config(
+        {**SystemConfigPrompt().default_config(), "deepgram_key": "xxx"},
+    )
+    session = deepgram.get_deepgram_session(config)
+
+    reloaded = config.model_copy(update={"deepgram_early_finalize": True})
+
+    assert (
+        deepgram.get_deepgram_session(reloaded) is session
+    ), "expected the session kept for the same key"
+    assert session.config is reloaded, "expected the session following the config"
+
+    rekeyed = config.model_copy(update={"deepgram_key": "yyy"})
+
+    assert (
+        deepgram.get_deepgram_session(rekeyed) is not session
+    ), "expected the session reopened for a new key"
+
+    deepgram.close_deepgram_session()
+
+    assert (
+        deepgram.get_deepgram_session(config) is not session
+    ), "expected a new session once closed"
+
+    deepgram.close_deepgram_session()
@@ -0,0 +1,132 @@
+import sys
+import time
+import logging
+
+sys.path.append("src")
+
+
+def test_response_cache():
+    from src.system_conf import SystemConfigPrompt, load_config
+    from src.utils.db_memory import MemoryConnect
+    from src.utils.llm_cache import ResponseCache, cache_key
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("testing llm response cache")
+
+    config = load_config(SystemConfigPrompt().default_config())
+
+    cache = ResponseCache(db=MemoryConnect(), ttl=60, max_entries=2)
+
+    key = cache_key("describe my machine", config)
+
+    assert key == cache_key(
+        "  describe   my\nmachine ",
+        config,
+    ), "expected whitespace normalized"
+    assert key != cache_key(
+        "describe my machine",
+        config.model_copy(update={"temperature": config.temperature + 0.1}),
+    ), "expected sampling params in the key"
+
+    assert cache.get(key) is None, "expected a miss on an empty cache"
+
+    cache.set(key, "a fine machine")
+    assert cache.get(key) == "a fine machine", "expected a hit once set"
+    assert (
+        cache.stats.hits == 1 and cache.stats.misses == 1
+    ), f"unexpected stats {cache.stats}"
+
+    # LRU - key was read last, other is evicted by the third entry
+    other, third = cache_key("other", config), cache_key("third", config)
+    cache.set(other, "other")
+    time.sleep(0.01)
+    cache.get(key)
+    cache.set(third, "third")
+
+    assert cache.get(other) is None, "expected the least recently used entry evicted"
+    assert cache.get(key) == "a fine machine", "expected the recently used entry kept"
+    assert cache.stats.evictions == 1, f"unexpected stats {cache.stats}"
+
+    expiring = ResponseCache(db=cache.db, ttl=0, max_entries=2)
+    expiring.set(key, "stale")
+    assert expiring.get(key) is None, "expected expired entries to miss"
+    assert expiring.stats.expired == 1, f"unexpected stats {expiring.stats}"
+
+    configured = ResponseCache(db=cache.db)
+    assert configured.ttl == config.llm_cache_ttl, "expected the ttl of the config"
+
+    load_config({**SystemConfigPrompt().default_config(), "llm_cache_ttl": "0"})
+    configured.set(key, "stale")
+    assert configured.get(key) is None, "expected a reloaded ttl applied"
+
+
+def test_response_cache_native_expiry():
+    from src.system_conf import SystemConfigPrompt, load_config
+    from src.utils.db import get_db_connection
+    from src.utils.llm_cache import ResponseCache, cache_key
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("testing llm response cache entries expired by redis")
+
+    config = load_config(SystemConfigPrompt().default_config())
+
+    cache = ResponseCache(db=get_db_connection(), ttl=0.05, max_entries=10)
+    key = cache_key("expire natively", config)
+
+    cache.set(key, "short lived")
+    assert cache.db.exists(key), "expected the entry written"
+
+    time.sleep(0.2)
+    assert not cache.db.exists(key), "expected the entry dropped without a read"
+
+    cache.clear()
+
+
+def test_response_cache_fallback_model(monkeypatch):
+    import src.agent.io_interface as io_interface
+    from types import SimpleNamespace
+    from src.clients.openai import TTTPaths, TTTResponse
+    from src.system_conf import SystemConfigPrompt, load_config
+    from src.utils.db_memory import MemoryConnect
+    from src.utils.llm_cache import ResponseCache, cache_key
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("testing llm response cache of fallback responses")
+
+    config = load_config(
+        {
+            **SystemConfigPrompt().default_config(),
+            "openai_ttt_model": "gpt-4",
+            "openai_ttt_fallback_model": "gpt-3.5-turbo",
+        },
+    )
+
+    cache = ResponseCache(db=MemoryConnect(), ttl=60, max_entries=10)
+    responses = [
+        TTTResponse(content="fallback", model="gpt-3.5-turbo", path=TTTPaths.FALLBACK),
+        TTTResponse(content="primary", model="gpt-4", path=TTTPaths.PRIMARY),
+    ]
+
+    def ttt_response(**kwargs):
+        return responses.pop(0)
+
+    monkeypatch.setattr(io_interface, "get_response_cache", lambda: cache)
+    monkeypatch.setattr(
+        io_interface,
+        "get_openai_client",
+        lambda: SimpleNamespace(ttt_response=ttt_response),
+    )
+
+    assert (
+        io_interface.text_to_text("greet", config, cache=True) == "fallback"
+    ), "expected the fallback response"
+    assert cache.get(
+        cache_key("greet", config, model="gpt-3.5-turbo"),
+    ) == "fallback", "expected the fallback response cached under its model"
+
+    assert (
+        io_interface.text_to_text("greet", config, cache=True) == "primary"
+    ), "expected the fallback response not served for the configured model"
+    assert (
+        io_interface.text_to_text("greet", config, cache=True) == "primary"
+    ), "expected the configured model's response cached"
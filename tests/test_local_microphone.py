@@ -0,0 +1,112 @@
+import sys
+import time
+import array
+import logging
+import speech_recognition as sr
+
+sys.path.append("src")
+
+# NOTE one calibration step and the listen chunk at most
+CALIBRATION_WAIT = 0.25
+
+
+class FakeMicrophone(sr.AudioSource):
+
+    """
+    10ms chunks of constant amplitude, read in real time
+    """
+
+    CHUNK = 160
+    SAMPLE_RATE = 16000
+    SAMPLE_WIDTH = 2
+
+    amplitude = 1000
+    failing = False
+    opened = 0
+
+    def __init__(self):
+        self.stream = None
+
+    def __enter__(self):
+        FakeMicrophone.opened += 1
+        self.stream = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        FakeMicrophone.opened -= 1
+        self.stream = None
+
+    def read(self, size):
+        if FakeMicrophone.failing:
+            raise OSError("microphone unplugged")
+
+        time.sleep(size / self.SAMPLE_RATE)
+        return array.array("h", [FakeMicrophone.amplitude] * size).tobytes()
+
+
+def test_ambient_noise_calibrator(monkeypatch):
+    import src.clients.local_microphone as local_microphone
+    from src.system_conf import SystemConfigPrompt, load_config
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("testing background ambient noise calibration")
+
+    monkeypatch.setattr(sr, "Microphone", FakeMicrophone)
+
+    config = load_config(
+        {**SystemConfigPrompt().default_config(), "energy_adjustment_duration": "0.5"},
+    )
+    calibrator = local_microphone.AmbientNoiseCalibrator(config)
+
+    thresholds = []
+
+    def listen(source):
+        thresholds.append(calibrator.recognizer.energy_threshold)
+        return sr.AudioData(
+            source.read(source.CHUNK),
+            source.SAMPLE_RATE,
+            source.SAMPLE_WIDTH,
+        )
+
+    monkeypatch.setattr(calibrator.recognizer, "listen", listen)
+
+    try:
+        calibrator.listen()
+        assert 1000 < thresholds[-1] <= 1500, "expected the threshold calibrated"
+
+        FakeMicrophone.amplitude = 3000
+        time.sleep(2)
+
+        stime = time.time()
+        calibrator.listen()
+        assert time.time() - stime < CALIBRATION_WAIT, "expected no calibration wait"
+        assert 4000 < thresholds[-1] <= 4500, "expected the noise tracked"
+
+    finally:
+        calibrator.close()
+        FakeMicrophone.amplitude = 1000
+
+    assert not calibrator.is_running, "expected the calibrator stopped"
+
+
+def test_ambient_noise_calibrator_failure(monkeypatch):
+    import pytest
+    import src.clients.local_microphone as local_microphone
+    from src.system_conf import SystemConfigPrompt, load_config
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("testing a failing ambient noise calibration")
+
+    monkeypatch.setattr(sr, "Microphone", FakeMicrophone)
+    monkeypatch.setattr(FakeMicrophone, "failing", True)
+
+    config = load_config(
+        {**SystemConfigPrompt().default_config(), "energy_adjustment_duration": "0.1"},
+    )
+    calibrator = local_microphone.AmbientNoiseCalibrator(config)
+
+    with pytest.raises(OSError):
+        calibrator.start()
+
+    assert FakeMicrophone.opened == 0, "expected the microphone closed"
+    assert not calibrator.is_running, "expected the calibrator stopped"
@@ -0,0 +1,32 @@
+import os
+import sys
+import logging
+from src.utils.markdown_loader import get_template, precompile_templates, prompt_loader
+
+
+def test_prompt_loader(tmp_path):
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+
+    file_path = str(tmp_path / "prompt.md")
+
+    with open(file_path, "w") as file:
+        file.write("Hello {{ name }}")
+
+    assert precompile_templates(str(tmp_path)) == 1, "expected 1 template compiled"
+
+    template = get_template(file_path)
+
+    assert prompt_loader(file_path, {"name": "Alan"}) == "Hello Alan"
+
+    assert get_template(file_path) is template, "expected the compiled template cached"
+
+    with open(file_path, "w") as file:
+        file.write("Bye {{ name }}")
+
+    # NOTE bump the mtime explicitly, writes can land within the fs timestamp resolution
+    stat = os.stat(file_path)
+    os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    assert prompt_loader(file_path, {"name": "Alan"}) == "Bye Alan", (
+        "expected the template recompiled once the file changed"
+    )
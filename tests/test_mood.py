@@ -0,0 +1,100 @@
+import sys
+import time
+import logging
+import threading
+
+sys.path.append("src")
+
+
+def test_mood_evolver(monkeypatch):
+    import src.agent.mood as mood
+    from src.system_conf import SystemConfigPrompt, load_config
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("testing background mood evolution")
+
+    load_config({**SystemConfigPrompt().default_config(), "ttt_deadline": "15"})
+
+    release = threading.Event()
+    deadlines = []
+
+    def text_to_text(messages_input, config, **kwargs):
+        deadlines.append(config.ttt_deadline)
+
+        if messages_input == "slow":
+            release.wait(1)
+
+        return f"mood for {messages_input}"
+
+    monkeypatch.setattr(mood, "text_to_text", text_to_text)
+
+    moods = []
+    evolver = mood.MoodEvolver(on_mood=moods.append, deadline=2)
+
+    evolver.evolve(lambda: "hello").result(timeout=1)
+    assert moods == ["mood for hello"], "expected the evolved mood to be reported"
+    assert deadlines == [2], "expected the evolver deadline on the LLM call"
+
+    # superseded while running, its result is dropped
+    slow = evolver.evolve(lambda: "slow")
+    time.sleep(0.05)
+    latest = evolver.evolve(lambda: "latest")
+    release.set()
+    slow.result(timeout=1)
+    latest.result(timeout=1)
+    assert moods == ["mood for hello", "mood for latest"], f"unexpected moods {moods}"
+
+    release.clear()
+    cancelled = evolver.evolve(lambda: "slow")
+    time.sleep(0.05)
+    evolver.cancel()
+    release.set()
+    cancelled.result(timeout=1)
+    assert moods[-1] == "mood for latest", "expected a cancelled evolution dropped"
+
+    load_config(
+        {
+            **SystemConfigPrompt().default_config(),
+            "ttt_deadline": "15",
+            "mood_evolver_deadline": "3",
+        },
+    )
+
+    evolver = mood.MoodEvolver(on_mood=moods.append)
+    evolver.evolve(lambda: "configured").result(timeout=1)
+    assert deadlines[-1] == 3, "expected the deadline of the config on the LLM call"
+
+
+def test_mood_evolver_cancel_while_setting_mood(monkeypatch):
+    import src.agent.mood as mood
+    from src.system_conf import SystemConfigPrompt, load_config
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("testing a cancel while the evolved mood is being set")
+
+    load_config(SystemConfigPrompt().default_config())
+
+    monkeypatch.setattr(mood, "text_to_text", lambda **kwargs: "calm")
+
+    # NOTE stands for the agent's lock, held by clear_message_history and taken by
+    # update_mood
+    agent_lock = threading.Lock()
+    moods = []
+
+    def on_mood(evolved):
+        with agent_lock:
+            moods.append(evolved)
+
+    evolver = mood.MoodEvolver(on_mood=on_mood, deadline=2)
+
+    with agent_lock:
+        evolution = evolver.evolve(lambda: "hello")
+        time.sleep(0.05)
+
+        canceller = threading.Thread(target=evolver.cancel)
+        canceller.start()
+        canceller.join(1)
+        assert not canceller.is_alive(), "expected cancel not to deadlock"
+
+    evolution.result(timeout=1)
+    assert moods == ["calm"], "expected the mood set once the lock is released"
@@ -0,0 +1,136 @@
+import sys
+import time
+import logging
+import openai
+
+sys.path.append("src")
+
+
+def test_ttt_hedging(monkeypatch):
+    import src.clients.openai as openai_client
+    from src.system_conf import SystemConfigPrompt, load_config
+    from src.clients.openai import OpenAiClient, TTT_LATENCY_MIN_SAMPLES
+    from src.clients.rate_limiter import RateLimiter
+    from src.utils.db_memory import MemoryConnect
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("testing TTT deadlines, hedging and fallback")
+
+    config = load_config(
+        {
+            **SystemConfigPrompt().default_config(),
+            "openai_key": "xxx",
+            "openai_ttt_model": "gpt-4",
+            "openai_ttt_fallback_model": "gpt-3.5-turbo",
+            "ttt_deadline": "1",
+        },
+    )
+
+    calls = []
+    delays = {}
+
+    def create(model, **kwargs):
+        calls.append(model)
+        delay = delays[model].pop(0)
+
+        if isinstance(delay, Exception):
+            raise delay
+
+        time.sleep(delay)
+        return {"choices": [{"message": {"content": f"{model} #{len(calls)}"}}]}
+
+    monkeypatch.setattr(openai.ChatCompletion, "create", create)
+
+    limiter = RateLimiter(db=MemoryConnect())
+    monkeypatch.setattr(openai_client, "get_rate_limiter", lambda: limiter)
+
+    client = OpenAiClient()
+    for _ in range(TTT_LATENCY_MIN_SAMPLES):
+        client.latencies.record("gpt-4", 0.05)
+        client.latencies.record("gpt-3.5-turbo", 0.3)
+
+    # slower than the p95, a duplicate request wins
+    delays["gpt-4"] = [0.5, 0.01]
+    response = client.ttt("hi", config=config)
+    assert response == "gpt-4 #2", "expected the hedged request to win"
+
+    # a failed request is retried right away
+    calls.clear()
+    delays["gpt-4"] = [openai.error.APIError("boom"), 0.01]
+    response = client.ttt("hi", config=config)
+    assert response == "gpt-4 #2", "expected a retry after an error"
+
+    # both requests late, the fallback model is raced once the deadline is at risk
+    calls.clear()
+    delays["gpt-4"] = [2, 2]
+    delays["gpt-3.5-turbo"] = [0.05]
+    response = client.ttt_response("hi", config=config)
+    assert response.content == "gpt-3.5-turbo #3", "expected the fallback to win"
+    assert response.model == "gpt-3.5-turbo", "expected the model that responded"
+
+    # nothing in time
+    calls.clear()
+    delays["gpt-4"] = [2, 2]
+    delays["gpt-3.5-turbo"] = [2]
+    stime = time.monotonic()
+    response = client.ttt("hi", config=config)
+    assert response is None, "expected no response past the deadline"
+    assert time.monotonic() - stime < 1.5, "expected ttt to return at the deadline"
+
+    # every request failing returns None (no UnboundLocalError)
+    calls.clear()
+    delays["gpt-4"] = [openai.error.APIError("boom")] * 2
+    delays["gpt-3.5-turbo"] = [openai.error.APIError("boom")]
+    response = client.ttt("hi", config=config)
+    assert response is None, "expected None when all requests fail"
+
+    assert client.ttt_paths == {
+        "hedge": 2,
+        "fallback": 1,
+        "timeout": 1,
+        "error": 1,
+    }, f"unexpected paths {client.ttt_paths}"
+
+
+def test_ttt_request_timeout(monkeypatch):
+    import pytest
+    import src.clients.openai as openai_client
+    from src.clients.rate_limiter import Priority
+    from src.system_conf import SystemConfigPrompt, load_config
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("testing TTT request timeouts after rate limiting")
+
+    config = load_config({**SystemConfigPrompt().default_config(), "openai_key": "xxx"})
+
+    class RateLimiter:
+        waited = 0.0
+
+        def acquire(self, *args, timeout, **kwargs):
+            self.timeout = timeout
+            return self.waited
+
+    limiter = RateLimiter()
+    monkeypatch.setattr(openai_client, "get_rate_limiter", lambda: limiter)
+
+    timeouts = []
+
+    def create(request_timeout, **kwargs):
+        timeouts.append(request_timeout)
+        return {"choices": [{"message": {"content": "hi"}}]}
+
+    monkeypatch.setattr(openai.ChatCompletion, "create", create)
+
+    client = openai_client.OpenAiClient()
+    msg = [{"role": "system", "content": "hi"}]
+    min_timeout = openai_client.TTT_MIN_REQUEST_TIMEOUT
+
+    # queued for the quota past the deadline, the request keeps a minimum timeout
+    limiter.waited = 2.0
+    client._chat_completion(msg, "gpt-4", config, 2.0, Priority.FOREGROUND)
+    assert limiter.timeout == 2.0 - min_timeout, "expected time left for the call"
+    assert timeouts == [min_timeout], f"expected the minimum timeout, got {timeouts}"
+
+    with pytest.raises(openai.error.Timeout):
+        client._chat_completion(msg, "gpt-4", config, 0.05, Priority.FOREGROUND)
+    assert len(timeouts) == 1, "expected no request without time left"
@@ -0,0 +1,159 @@
+import sys
+import json
+import time
+import asyncio
+import logging
+import threading
+import pytest
+from pydantic import ValidationError
+
+sys.path.append("src")
+
+
+def test_rate_limiter():
+    from src.utils.db_memory import MemoryConnect
+    from src.clients.rate_limiter import (
+        Priority,
+        RateLimit,
+        RateLimiter,
+        RateLimitTimeoutError,
+    )
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("testing provider rate limiter")
+
+    limiter = RateLimiter(
+        db=MemoryConnect(),
+        limits={
+            "openai:gpt-4": RateLimit(requests=600, tokens=6000),
+            "elevenlabs:*": RateLimit(requests=60),
+        },
+    )
+
+    limit = limiter.limit("openai", "gpt-3.5-turbo")
+    assert limit is None, "expected unlisted models unlimited"
+
+    limit = limiter.limit("elevenlabs", "any")
+    assert limit is not None, "expected provider wide limits"
+
+    # 10 requests / 100 tokens per second, a full minute of burst first
+    waited = limiter.acquire("openai", "gpt-4", tokens=5900)
+    assert waited < 0.01, "expected the burst granted"
+
+    waited = limiter.acquire("openai", "gpt-4", tokens=200)
+    assert 0.05 < waited < 1.5, f"expected to wait for the tokens, waited {waited}"
+
+    with pytest.raises(RateLimitTimeoutError):
+        limiter.acquire("openai", "gpt-4", tokens=3000, timeout=1)
+
+    # background calls leave the reserve (20%) and wait for foreground ones
+    assert limiter.acquire("elevenlabs") < 0.01, "expected a request granted"
+    order = []
+
+    def call(priority):
+        limiter.acquire("elevenlabs", priority=priority)
+        order.append(priority)
+
+    for _ in range(47):
+        limiter.acquire("elevenlabs", priority=Priority.BACKGROUND)
+
+    background = threading.Thread(target=call, args=(Priority.BACKGROUND,))
+    background.start()
+    time.sleep(0.05)
+    foreground = threading.Thread(target=call, args=(Priority.FOREGROUND,))
+    foreground.start()
+
+    foreground.join(5)
+    background.join(5)
+    assert order == [
+        Priority.FOREGROUND,
+        Priority.BACKGROUND,
+    ], f"unexpected order {order}"
+
+
+def test_rate_limits_config():
+    from src.utils.db_memory import MemoryConnect
+    from src.clients.rate_limiter import DEFAULT_RATE_LIMITS, RateLimiter
+    from src.system_conf import SystemConfigPrompt, load_config
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("testing rate limits of the system config")
+
+    env = SystemConfigPrompt().default_config()
+
+    load_config(
+        {
+            **env,
+            "rate_limits": '{"openai:gpt-4": {"requests": 5000, "tokens": 300000}}',
+        },
+    )
+
+    limiter = RateLimiter(db=MemoryConnect())
+    limit = limiter.limit("openai", "gpt-4")
+    assert limit.requests == 5000, "expected the config limit"
+
+    default = DEFAULT_RATE_LIMITS["openai:gpt-3.5-turbo"]
+    assert limiter.limit("openai", "gpt-3.5-turbo") == default, "expected the defaults"
+
+    for rate_limits in (
+        "not json",
+        '{"openai": {"requests": 10}}',
+        '{"openai:gpt-4": {"requests": -1}}',
+        '{"openai:gpt-4": {"request": 10, "tokens": "many"}}',
+    ):
+        with pytest.raises(ValidationError):
+            load_config({**env, "rate_limits": rate_limits})
+
+
+def test_eleven_labs_stream_charges_characters(monkeypatch):
+    from src.clients import eleven_labs_wss
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("testing elevenlabs streamed characters charged")
+
+    charged = []
+    sent = []
+
+    class Limiter:
+        def acquire(self, provider, tokens=0, requests=1):
+            charged.append((provider, tokens, requests))
+            return 0.0
+
+    class Websocket:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *args):
+            return False
+
+        async def send(self, message):
+            sent.append(json.loads(message)["text"])
+
+        async def recv(self):
+            return json.dumps({"isFinal": True})
+
+    async def stream(audio_stream):
+        async for _ in audio_stream:
+            pass
+
+    monkeypatch.setattr(eleven_labs_wss, "get_rate_limiter", Limiter)
+    monkeypatch.setattr(eleven_labs_wss.websockets, "connect", lambda uri: Websocket())
+    monkeypatch.setattr(eleven_labs_wss, "stream", stream)
+
+    asyncio.run(
+        eleven_labs_wss.eleven_labs_wss_tts_stream(
+            iter(["Hello", " there,", " friend."]),
+            "voice",
+            "key",
+        ),
+    )
+
+    text = "".join(sent[1:])
+
+    assert charged[0] == ("elevenlabs", 0, 1), "expected the request charged upfront"
+    assert all(
+        requests == 0 for _, _, requests in charged[1:]
+    ), "expected the chunks charged without a request"
+    assert sum(tokens for _, tokens, _ in charged[1:]) == len(
+        text,
+    ), f"expected every sent character charged, got {charged} for {text!r}"
@@ -0,0 +1,39 @@
+import sys
+import time
+import logging
+import threading
+from src.utils.singleton import Singleton
+
+
+def test_singleton():
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("testing process wide instance holder")
+
+    holder: Singleton[object] = Singleton()
+    created = []
+
+    def factory():
+        time.sleep(0.05)
+        created.append(object())
+        return created[-1]
+
+    instances = []
+    threads = [
+        threading.Thread(target=lambda: instances.append(holder.get(factory)))
+        for _ in range(8)
+    ]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join(5)
+
+    assert len(created) == 1, f"expected the factory run once, ran {len(created)}"
+    assert all(
+        instance is created[0] for instance in instances
+    ), "expected every thread given the same instance"
+
+    assert holder.pop() is created[0], "expected the instance popped"
+    assert holder.pop() is None, "expected nothing left to pop"
+    assert holder.get(factory) is created[1], "expected a new instance after a pop"
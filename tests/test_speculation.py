@@ -0,0 +1,60 @@
+import sys
+import time
+import logging
+
+sys.path.append("src")
+
+
+def test_speculative_response():
+    from src.agent.speculation import SpeculativeResponse, transcripts_match
+    from src.system_conf import SystemConfigPrompt, load_config
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("testing speculative response from interim transcripts")
+
+    load_config(SystemConfigPrompt().default_config())
+
+    assert transcripts_match(
+        "what is the meaning of life",
+        "What is the meaning of life?",
+    ), "expected case and punctuation ignored"
+    assert not transcripts_match(
+        "what is the meaning",
+        "what is the meaning of life and death",
+    ), "expected a longer final transcript to miss"
+
+    generated = []
+
+    def generate(transcript):
+        generated.append(transcript)
+        time.sleep(0.05)
+        return f"response to {transcript}"
+
+    speculation = SpeculativeResponse(generate)
+
+    assert speculation.commit("hello") is None, "expected no response to commit"
+
+    speculation.propose("what is the meaning of life")
+    speculation.propose("What is the meaning of life.")
+
+    response = speculation.commit("What is the meaning of life?")
+    assert (
+        response == "response to what is the meaning of life"
+    ), "expected the speculative response"
+    assert len(generated) == 1, "expected an equivalent proposal to keep generating"
+
+    speculation.propose("what is")
+    assert speculation.commit("what is the weather like") is None, "expected a miss"
+    assert (speculation.hits, speculation.misses) == (1, 1), "unexpected hit / misses"
+
+    speculation.propose("tell me a joke")
+    speculation.cancel()
+    assert speculation.commit("tell me a joke") is None, "expected it cancelled"
+
+    load_config(
+        {**SystemConfigPrompt().default_config(), "speculation_min_ratio": "95"},
+    )
+    assert not transcripts_match(
+        "hello there",
+        "hello their",
+    ), "expected the min ratio of the config"
@@ -0,0 +1,32 @@
+import sys
+import logging
+import pytest
+from pydantic import ValidationError
+
+sys.path.append("src")
+
+
+def test_system_config():
+    from src.system_conf import SystemConfigPrompt, load_config, get_config
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.debug("testing typed system config snapshot")
+
+    env = SystemConfigPrompt().default_config()
+
+    config = load_config({**env, "openai_key": "xxx", "speech_off": "True"})
+
+    assert get_config() is config, "expected load_config to set the current snapshot"
+    assert isinstance(config.temperature, float), "expected temperature parsed as float"
+    assert isinstance(config.energy_threshold, int), "expected an int energy_threshold"
+    assert config.speech_off is True, "expected speech_off parsed as bool"
+    assert config.openai_key == "xxx", "expected keys read from env_data"
+
+    with pytest.raises(ValidationError):
+        load_config({**env, "temperature": "very hot"})
+
+    assert get_config() is config, "expected an invalid config to keep the snapshot"
+
+    copy = config.model_copy(update={"tts_client": "internal"})
+    assert copy.tts_client == "internal", "expected per call overrides on a copy"
+    assert get_config().tts_client == env["TTS_CLIENT"], "expected snapshot unchanged"